@@ -0,0 +1,119 @@
+"""Measure request throughput on the DB-bound endpoints as client concurrency grows.
+
+Starts `uvicorn server:app` (one worker) against a scratch SQLite database,
+seeds document rows, then drives a mix of GET /documents/, GET
+/documents/{id} and PUT /documents/{id} at each concurrency level:
+
+    python benchmarks/db_throughput.py --duration 5 --concurrency 1 4 16 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir: str, port: int, extra_env: dict) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "OPENROUTER_API_KEY": "benchmark-placeholder",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "BLOB_STORE_DIR": os.path.join(workdir, "blobs"),
+        **extra_env,
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/documents/?limit=1", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+def seed(db_path: str, rows: int):
+    connection = sqlite3.connect(db_path, timeout=30)
+    features = json.dumps({"first_name": "TEST", "last_name": "SPECIMEN"})
+    connection.executemany(
+        "INSERT INTO document_records (original_filename, document_type, features) VALUES (?, ?, ?)",
+        [(f"scan_{i}.jpg", "drivers_license", features) for i in range(rows)]
+    )
+    connection.commit()
+    connection.close()
+
+
+async def run_level(base_url: str, concurrency: int, duration: float, rows: int, timeout: float = 10.0) -> dict:
+    completed = 0
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal completed, errors
+        while time.perf_counter() < deadline:
+            roll = random.random()
+            document_id = random.randint(1, rows)
+            try:
+                if roll < 0.4:
+                    response = await client.get("/documents/", params={"limit": 10})
+                elif roll < 0.8:
+                    response = await client.get(f"/documents/{document_id}")
+                else:
+                    response = await client.put(
+                        f"/documents/{document_id}", json={"features": {"first_name": f"EDIT{random.randint(0, 999)}"}}
+                    )
+                errors += response.status_code >= 400
+            except httpx.HTTPError:
+                errors += 1
+            completed += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {"concurrency": concurrency, "requests": completed, "errors": errors, "rps": completed / elapsed}
+
+
+def main(levels: list, duration: float, rows: int):
+    workdir = tempfile.mkdtemp()
+    port = free_port()
+    process = start_server(workdir, port, {})
+    try:
+        seed(os.path.join(workdir, "bench.db"), rows)
+        print(f"{'concurrency':>11} {'requests':>9} {'errors':>7} {'req/s':>9}")
+        for level in levels:
+            result = asyncio.run(run_level(f"http://127.0.0.1:{port}", level, duration, rows))
+            print(f"{result['concurrency']:>11} {result['requests']:>9} {result['errors']:>7} {result['rps']:>9.1f}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per concurrency level")
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args()
+    main(args.concurrency, args.duration, args.rows)
@@ -0,0 +1,108 @@
+"""Compare offset pagination with keyset (cursor) pagination at increasing page depth.
+
+Seeds a scratch SQLite database (1M rows by default, reused between runs)
+and times one page at each depth through both crud functions:
+
+    python benchmarks/document_listing.py --rows 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_ROOT)
+DEFAULT_DB_PATH = os.path.join(tempfile.gettempdir(), "id_classifier_listing_bench.db")
+
+
+def seed(engine, rows: int):
+    import models
+
+    models.Base.metadata.create_all(bind=engine)
+    with engine.connect() as connection:
+        existing = connection.exec_driver_sql("SELECT COUNT(*) FROM document_records").scalar()
+    if existing >= rows:
+        return
+    print(f"Seeding {rows - existing:,} rows...")
+    document_types = ["passport", "drivers_license", "ead_card"]
+    start = datetime(2024, 1, 1)
+    features = json.dumps({"first_name": "TEST", "last_name": "SPECIMEN", "date_of_birth": "1990-01-01"})
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        batch = []
+        for i in range(existing, rows):
+            # Several rows per second, so cursor tie-breaking on id is exercised
+            timestamp = (start + timedelta(seconds=i // 3)).strftime("%Y-%m-%d %H:%M:%S")
+            batch.append((f"scan_{i}.jpg", random.choice(document_types), features, timestamp, timestamp))
+            if len(batch) == 50_000:
+                cursor.executemany(
+                    "INSERT INTO document_records (original_filename, document_type, features, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    batch
+                )
+                batch.clear()
+        if batch:
+            cursor.executemany(
+                "INSERT INTO document_records (original_filename, document_type, features, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                batch
+            )
+        raw.commit()
+    finally:
+        raw.close()
+    with engine.connect() as connection:
+        connection.exec_driver_sql("ANALYZE")
+
+
+async def median_ms(fn, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+async def main(rows: int, page_size: int, runs: int, db_path: str):
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    import crud
+    from database import AsyncSessionLocal, async_engine, engine
+
+    seed(engine, rows)
+    db = AsyncSessionLocal()
+    depths = [d for d in (0, 1_000, 10_000, 100_000, 500_000, rows - page_size) if d <= rows - page_size]
+    print(f"{rows:,} rows, page size {page_size}, median of {runs} run(s)")
+    print(f"{'depth':>10} {'offset':>10} {'keyset':>10} {'keyset+type':>12}")
+    try:
+        for depth in depths:
+            anchor = None
+            if depth:
+                # The cursor a client would hold after paging to this depth
+                anchor_row = (await crud.get_document_records(db, skip=depth - 1, limit=1))[0]
+                anchor = (anchor_row.updated_at, anchor_row.id)
+            offset_ms = await median_ms(lambda: crud.get_document_records(db, skip=depth, limit=page_size), runs)
+            keyset_ms = await median_ms(lambda: crud.get_document_summaries(db, limit=page_size, after=anchor), runs)
+            typed_ms = await median_ms(
+                lambda: crud.get_document_summaries(db, limit=page_size, after=anchor, document_type="passport"), runs
+            )
+            print(f"{depth:>10,} {offset_ms:>8.2f}ms {keyset_ms:>8.2f}ms {typed_ms:>10.2f}ms")
+    finally:
+        await db.close()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--db-path", default=DEFAULT_DB_PATH)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.page_size, args.runs, args.db_path))
@@ -0,0 +1,160 @@
+"""Measure streaming export memory and the cost of a retention purge to live traffic.
+
+Starts `uvicorn server:app` against a scratch SQLite database seeded with
+documents that still carry legacy inline base64 images (the rows that make the
+file large), half of them past the retention period. Then:
+
+- exports every document through GET /documents/export (NDJSON and CSV, with
+  and without images) and through GET /documents/?limit=<all>, sampling the
+  server's resident set size (Linux /proc)
+- runs `python retention.py --days 30` while clients read and update
+  documents, reporting their latency before and during the purge and the
+  database file size before and after
+
+    python benchmarks/export_retention.py --rows 4000 --image-kib 64
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.join(BENCHMARKS_DIR, "..")
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from db_throughput import free_port, start_server  # noqa: E402
+from upload_memory import RssSampler  # noqa: E402
+
+
+def seed(db_path: str, rows: int, image_kib: int):
+    connection = sqlite3.connect(db_path, timeout=30)
+    features = json.dumps({"first_name": "TEST", "last_name": "SPECIMEN", "date_of_birth": "1980-01-02"})
+    image = "data:image/jpeg;base64," + base64.b64encode(os.urandom(image_kib * 1024)).decode("ascii")
+    for start in range(0, rows, 500):
+        connection.executemany(
+            "INSERT INTO document_records (original_filename, document_type, features, image_base64, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                # Even rows are past the 30 day retention period
+                (f"scan_{i}.jpg", "drivers_license", features, image, *(["2020-01-01 00:00:00"] * 2 if i % 2 == 0 else [None, None]))
+                for i in range(start, min(rows, start + 500))
+            ]
+        )
+        connection.execute("UPDATE document_records SET created_at = datetime('now'), updated_at = datetime('now') WHERE created_at IS NULL")
+        connection.commit()
+    connection.close()
+
+
+def database_size(db_path: str) -> int:
+    return sum(os.path.getsize(path) for path in (db_path, db_path + "-wal") if os.path.exists(path))
+
+
+def describe_size(db_path: str) -> str:
+    wal_path = db_path + "-wal"
+    wal_size = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    return f"{os.path.getsize(db_path) / 2**20:.0f} MiB (+ {wal_size / 2**20:.0f} MiB WAL)"
+
+
+async def timed_download(client: httpx.AsyncClient, pid: int, path: str, params: dict):
+    baseline = RssSampler(pid).rss()
+    start = time.perf_counter()
+    size = 0
+    with RssSampler(pid) as sampler:
+        async with client.stream("GET", path, params=params) as response:
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+    return response.status_code, size, time.perf_counter() - start, sampler.peak - baseline
+
+
+async def live_traffic(client: httpx.AsyncClient, rows: int, stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        document_id = random.randint(1, rows)
+        start = time.perf_counter()
+        if random.random() < 0.5:
+            await client.get(f"/documents/{document_id}")
+        else:
+            await client.put(f"/documents/{document_id}", json={"features": {"first_name": f"EDIT{random.randint(0, 999)}"}})
+        latencies.append(time.perf_counter() - start)
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def traffic_during(client: httpx.AsyncClient, rows: int, concurrency: int, work) -> list:
+    latencies = []
+    stop = asyncio.Event()
+    clients = [asyncio.create_task(live_traffic(client, rows, stop, latencies)) for _ in range(concurrency)]
+    result = await work()
+    stop.set()
+    await asyncio.gather(*clients)
+    return latencies, result
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    port = free_port()
+    app = start_server(workdir, port, {"JOB_WORKERS": "0"})
+    try:
+        seed(db_path, args.rows, args.image_kib)
+        print(f"Seeded {args.rows} documents with {args.image_kib} KiB inline images; database {database_size(db_path) / 2**20:.0f} MiB")
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=600) as client:
+            print(f"\n{'export':<36} {'status':>6} {'size':>9} {'time':>7} {'RSS growth':>11}")
+            for label, path, params in (
+                ("GET /documents/?limit=<all>", "/documents/", {"limit": args.rows}),
+                ("export ndjson", "/documents/export", {"format": "ndjson"}),
+                ("export csv", "/documents/export", {"format": "csv"}),
+                ("export ndjson, include_images", "/documents/export", {"format": "ndjson", "include_images": "true"}),
+            ):
+                status, size, elapsed, growth = await timed_download(client, app.pid, path, params)
+                print(f"{label:<36} {status:>6} {size / 2**20:>7.1f}Mi {elapsed:>6.2f}s {growth / 2**20:>9.0f}Mi")
+
+            async def idle():
+                await asyncio.sleep(args.duration)
+
+            async def retention():
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, "retention.py", "--days", "30", "--batch-size", str(args.batch_size),
+                    cwd=REPO_ROOT, env={**os.environ, "DATABASE_URL": f"sqlite:///{db_path}", "BLOB_STORE_DIR": os.path.join(workdir, "blobs")},
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+                )
+                start = time.perf_counter()
+                output, _ = await process.communicate()
+                return time.perf_counter() - start, output.decode().strip()
+
+            size_before = describe_size(db_path)
+            baseline, _ = await traffic_during(client, args.rows, args.concurrency, idle)
+            during, (elapsed, output) = await traffic_during(client, args.rows, args.concurrency, retention)
+            print(f"\nRetention run ({elapsed:.1f}s): {output}")
+            # The WAL file keeps its size after a checkpoint; SQLite reuses it from the start
+            print(f"Database file: {size_before} -> {describe_size(db_path)}")
+            print(f"\n{'live traffic':<16} {'requests':>9} {'p50':>8} {'p99':>8} {'max':>8}")
+            for label, latencies in (("before", baseline), ("during purge", during)):
+                print(
+                    f"{label:<16} {len(latencies):>9} {percentile(latencies, 0.5) * 1000:>6.1f}ms "
+                    f"{percentile(latencies, 0.99) * 1000:>6.1f}ms {max(latencies) * 1000:>6.1f}ms"
+                )
+    finally:
+        app.terminate()
+        app.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=4000)
+    parser.add_argument("--image-kib", type=int, default=64, help="Size of each seeded image before base64")
+    parser.add_argument("--batch-size", type=int, default=500, help="retention.py --batch-size")
+    parser.add_argument("--concurrency", type=int, default=8, help="Live traffic clients")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of live traffic measured before the purge")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,77 @@
+"""Compare upstream calls, bytes sent and latency for per_field vs. single_call extraction.
+
+Runs the real pipeline over the bundled sample images against an in-process
+fake upstream, so no API key or network access is needed:
+
+    python benchmarks/extraction_modes.py --latency 0.8
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark-placeholder")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+
+import server  # noqa: E402
+
+logging.getLogger("server").setLevel(logging.WARNING)
+
+SAMPLES = {
+    "images/WALicense.png": "drivers_license",
+    "images/EADSample.jpg": "ead_card",
+    "images/UKPassport.jpg": "passport",
+}
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+class UpstreamRecorder:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.document_type = None
+        self.calls = 0
+        self.bytes_sent = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        self.bytes_sent += len(json.dumps(kwargs["messages"]))
+        await asyncio.sleep(self.latency)
+        prompt = kwargs["messages"][0]["content"][0]["text"]
+        if "JSON object" in prompt:
+            fields = server.FEATURE_EXTRACTION_CONFIG[self.document_type]["fields"]
+            content = json.dumps({"document_type": self.document_type, "features": {f: "SAMPLE" for f in fields}})
+        elif prompt == server.CLASSIFICATION_PROMPT:
+            content = self.document_type
+        else:
+            content = "SAMPLE"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+async def main(latency: float):
+    recorder = UpstreamRecorder(latency)
+    server.client.chat.completions.create = recorder.create
+    print(f"Simulated upstream latency: {latency:.2f}s")
+    print(f"{'image':<26} {'mode':<12} {'calls':>5} {'bytes sent':>12} {'latency':>8}")
+    for relative_path, document_type in SAMPLES.items():
+        with open(os.path.join(REPO_ROOT, relative_path), "rb") as f:
+            data_url = "data:image/png;base64," + server.base64.b64encode(f.read()).decode("utf-8")
+        recorder.document_type = document_type
+        for mode in server.EXTRACTION_MODES:
+            recorder.calls = recorder.bytes_sent = 0
+            start = time.perf_counter()
+            await server.run_extraction_pipeline(data_url, mode)
+            elapsed = time.perf_counter() - start
+            print(f"{relative_path:<26} {mode:<12} {recorder.calls:>5} {recorder.bytes_sent:>12,} {elapsed:>7.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.8, help="Simulated seconds per upstream call")
+    args = parser.parse_args()
+    asyncio.run(main(args.latency))
@@ -0,0 +1,147 @@
+"""A local OpenAI-compatible chat-completions server for exercising the upstream path offline.
+
+Behaviour (latency, slow tail, error rate, rate limit) is set on the command
+line and can be changed while running with POST /_control. Answers are
+synthetic, except for requests found in an optional cassette (see
+cassette.py), which get the recorded answer. Point the app at it with
+OPENROUTER_BASE_URL:
+
+    python benchmarks/fake_openrouter.py --port 8100 --latency-ms 300 --tail-ratio 0.05 --tail-ms 3000 [--cassette eval.json]
+    OPENROUTER_BASE_URL=http://127.0.0.1:8100/v1 uvicorn server:app
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+from collections import deque
+from typing import Deque, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from cassette import Cassette  # noqa: E402
+
+DOCUMENT_TYPES = ["passport", "drivers_license", "ead_card"]
+
+
+class FakeBehaviour(BaseModel):
+    latency_ms: float = 200.0
+    jitter_ms: float = 50.0
+    tail_ratio: float = 0.0 # Share of calls that take tail_ms instead
+    tail_ms: float = 2000.0
+    error_rate: float = 0.0 # Share of calls answered with a 500
+    rate_limit_rps: float = 0.0 # Above this many requests per second, answer 429 (0 disables)
+    retry_after_seconds: Optional[float] = 1.0 # Sent with 429s; None omits the header
+
+
+def document_type_for(image_url: str) -> str:
+    # Stable per image, so repeated calls about one image agree with each other
+    return DOCUMENT_TYPES[int(hashlib.sha256(image_url.encode("utf-8")).hexdigest(), 16) % len(DOCUMENT_TYPES)]
+
+
+def answer(prompt: str, image_url: str, json_mode: bool) -> str:
+    document_type = document_type_for(image_url)
+    if json_mode:
+        # The structured prompt lists each type's keys on a line: - if "<type>": "<key>": <name>, ...
+        line = re.search(rf'- if "{document_type}": (.*)', prompt)
+        keys = re.findall(r'"(\w+)":', line.group(1)) if line else []
+        return json.dumps({"document_type": document_type, "features": {key: f"FAKE {key.upper()}" for key in keys}})
+    field = re.search(r"The image provided is an? [\w ]+\. What is the (.+?)\?", prompt)
+    if field:
+        return f"FAKE {field.group(1).upper()}"
+    return document_type
+
+
+def create_app(behaviour: FakeBehaviour, cassette: Optional[Cassette] = None) -> FastAPI:
+    app = FastAPI()
+    app.state.behaviour = behaviour
+    app.state.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "canned": 0}
+    recent: Deque[float] = deque()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        behaviour: FakeBehaviour = app.state.behaviour
+        stats = app.state.stats
+        stats["requests"] += 1
+        body = await request.json()
+
+        now = time.monotonic()
+        while recent and recent[0] < now - 1:
+            recent.popleft()
+        if behaviour.rate_limit_rps and len(recent) >= behaviour.rate_limit_rps:
+            stats["rate_limited"] += 1
+            headers = {} if behaviour.retry_after_seconds is None else {"Retry-After": str(behaviour.retry_after_seconds)}
+            return JSONResponse({"error": {"message": "Rate limit exceeded", "code": 429}}, status_code=429, headers=headers)
+        recent.append(now)
+
+        slow = random.random() < behaviour.tail_ratio
+        delay_ms = behaviour.tail_ms if slow else max(0.0, random.gauss(behaviour.latency_ms, behaviour.jitter_ms))
+        await asyncio.sleep(delay_ms / 1000)
+        if random.random() < behaviour.error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"message": "Internal error", "code": 500}}, status_code=500)
+
+        content = body["messages"][0]["content"]
+        prompt = next(part["text"] for part in content if part["type"] == "text")
+        image_url = next((part["image_url"]["url"] for part in content if part["type"] == "image_url"), "")
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        canned = cassette.lookup(body) if cassette is not None else None
+        if canned is not None:
+            stats["canned"] += 1
+            text = canned["content"]
+        else:
+            text = answer(prompt, image_url, json_mode)
+        usage = (canned or {}).get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", len(prompt) // 4 + 258)
+        completion_tokens = usage.get("completion_tokens", len(text) // 4 + 1)
+        stats["ok"] += 1
+        return {
+            "id": f"fake-{stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    @app.get("/v1/models")
+    async def list_models():
+        # The app's warm-up call; it opens the connection and costs nothing
+        return {"object": "list", "data": [{"id": "fake", "object": "model", "created": 0, "owned_by": "fake"}]}
+
+    @app.post("/_control")
+    async def control(update: dict):
+        app.state.behaviour = app.state.behaviour.model_copy(update=update)
+        return app.state.behaviour
+
+    @app.get("/_stats")
+    async def read_stats():
+        return app.state.stats
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--cassette", help="answer recorded requests from this cassette file")
+    for name, field in FakeBehaviour.model_fields.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=field.default)
+    args = parser.parse_args()
+    behaviour = FakeBehaviour(**{name: getattr(args, name) for name in FakeBehaviour.model_fields})
+    cassette = Cassette(args.cassette) if args.cassette else None
+    uvicorn.run(create_app(behaviour, cassette), host="127.0.0.1", port=args.port, log_level="warning")
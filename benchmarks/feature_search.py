@@ -0,0 +1,176 @@
+"""Time /documents/search lookups against the document_features index at 1M documents.
+
+Seeds a scratch SQLite database with synthetic documents (reused between runs),
+builds the index with `migrations.rebuild_feature_index`, then times each kind
+of search through crud, next to one full scan of the features column, which is
+what a lookup cost before the index:
+
+    python benchmarks/feature_search.py --rows 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_ROOT)
+DEFAULT_DB_PATH = os.path.join(tempfile.gettempdir(), "id_classifier_search_bench.db")
+
+SYLLABLES = ["an", "ber", "cor", "dal", "en", "fer", "gar", "hol", "is", "jen", "kar", "lo", "mar", "nor",
+             "ol", "per", "quin", "ros", "sten", "tor", "ul", "ver", "wil", "yan", "zel", "son", "smith", "ley"]
+FIRST_NAMES = ["JAMES", "MARY", "ROBERT", "PATRICIA", "JOHN", "JENNIFER", "MICHAEL", "LINDA", "DAVID", "ELIZABETH",
+               "WILLIAM", "BARBARA", "RICHARD", "SUSAN", "JOSEPH", "JESSICA", "THOMAS", "SARAH", "CARLOS", "MARIA"]
+
+
+def random_surname(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).upper()
+
+
+def random_date(rng: random.Random, start: date, days: int) -> str:
+    return (start + timedelta(days=rng.randrange(days))).isoformat()
+
+
+def synthetic_features(rng: random.Random, i: int, document_type: str) -> dict:
+    first, last = rng.choice(FIRST_NAMES), random_surname(rng)
+    date_of_birth = random_date(rng, date(1940, 1, 1), 365 * 65)
+    if document_type == "passport":
+        return {"full_name": f"{first} {last}", "date_of_birth": date_of_birth, "country": rng.choice(["USA", "MEX", "CAN"]),
+                "issue_date": random_date(rng, date(2016, 1, 1), 3650), "expiration_date": random_date(rng, date(2024, 1, 1), 3650)}
+    if document_type == "drivers_license":
+        return {"license_number": f"D{i:09d}", "date_of_birth": date_of_birth, "issue_date": random_date(rng, date(2018, 1, 1), 2500),
+                "expiration_date": random_date(rng, date(2024, 1, 1), 2500), "first_name": first, "last_name": last}
+    return {"card_number": f"SRC{i:010d}", "category": rng.choice(["C09", "C08", "A05", "C33"]),
+            "card_expires_date": random_date(rng, date(2024, 1, 1), 1500), "last_name": last, "first_name": first}
+
+
+def seed(engine, rows: int, batch_size: int):
+    import models
+    from database import SessionLocal
+    from migrations import rebuild_feature_index
+
+    models.Base.metadata.create_all(bind=engine)
+    with engine.connect() as connection:
+        existing = connection.exec_driver_sql("SELECT COUNT(*) FROM document_records").scalar()
+        indexed = connection.exec_driver_sql("SELECT COUNT(DISTINCT document_id) FROM document_features").scalar()
+    if existing < rows:
+        print(f"Seeding {rows - existing:,} documents...")
+        rng = random.Random(existing)
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            batch = []
+            for i in range(existing, rows):
+                document_type = rng.choice(["passport", "drivers_license", "ead_card"])
+                batch.append((f"scan_{i}.jpg", document_type, json.dumps(synthetic_features(rng, i, document_type))))
+                if len(batch) == 50_000 or i == rows - 1:
+                    cursor.executemany(
+                        "INSERT INTO document_records (original_filename, document_type, features, created_at, updated_at) "
+                        "VALUES (?, ?, ?, datetime('now'), datetime('now'))",
+                        batch
+                    )
+                    batch.clear()
+            raw.commit()
+        finally:
+            raw.close()
+    if indexed < rows:
+        start = time.perf_counter()
+        db = SessionLocal()
+        try:
+            count = rebuild_feature_index(db, batch_size=batch_size)
+        finally:
+            db.close()
+        print(f"Rebuilt the feature index for {count:,} documents in {time.perf_counter() - start:.1f}s")
+        with engine.connect() as connection:
+            connection.exec_driver_sql("ANALYZE")
+
+
+async def median_ms(fn, runs: int):
+    timings, result = [], None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = await fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, result
+
+
+async def main(rows: int, runs: int, batch_size: int, db_path: str, scan: bool):
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    import crud
+    import feature_index
+    import models
+    from database import AsyncSessionLocal, async_engine, engine
+    from sqlalchemy import select
+
+    seed(engine, rows, batch_size)
+    db = AsyncSessionLocal()
+    try:
+        # Pick real values to look up from the middle of the table
+        sample = (await db.execute(
+            select(models.DocumentRecord.features)
+            .where(models.DocumentRecord.document_type == "drivers_license", models.DocumentRecord.id >= rows // 2)
+            .limit(1)
+        )).scalar_one()
+        surname = sample["last_name"]
+        misspelled = surname[:2] + surname[3:] if len(surname) > 4 else surname + "X"
+        date_of_birth = date.fromisoformat(sample["date_of_birth"])
+        name_fields = feature_index.NAME_FIELDS
+
+        async def fuzzy_search():
+            candidates = await crud.get_feature_tokens(db, name_fields, feature_index.normalize(misspelled)[:2])
+            tokens = feature_index.similar_tokens(feature_index.normalize(misspelled), candidates, 0.8)
+            return await crud.search_document_summaries(db, [crud.feature_condition("token", name_fields, one_of=tokens)])
+
+        searches = [
+            (f"number={sample['license_number']}", lambda: crud.search_document_summaries(
+                db, [crud.feature_condition("value", feature_index.IDENTIFIER_FIELDS, equals=feature_index.normalize(sample["license_number"]))])),
+            (f"name={surname}", lambda: crud.search_document_summaries(
+                db, [crud.feature_condition("token", name_fields, prefix=feature_index.normalize(surname))])),
+            (f"name={surname[:3]} (prefix)", lambda: crud.search_document_summaries(
+                db, [crud.feature_condition("token", name_fields, prefix=feature_index.normalize(surname[:3]))])),
+            (f"name={misspelled}&fuzzy=true", fuzzy_search),
+            (f"date_of_birth in one week", lambda: crud.search_document_summaries(
+                db, [crud.feature_condition("date", ["date_of_birth"], value_from=date_of_birth.isoformat(),
+                                            value_to=(date_of_birth + timedelta(days=6)).isoformat())])),
+            (f"name={surname} + date_of_birth", lambda: crud.search_document_summaries(db, [
+                crud.feature_condition("token", name_fields, prefix=feature_index.normalize(surname)),
+                crud.feature_condition("date", ["date_of_birth"], value_from=date_of_birth.isoformat(), value_to=date_of_birth.isoformat()),
+            ])),
+            ("expires in the next 30 days", lambda: crud.search_document_summaries(
+                db, [crud.feature_condition("date", feature_index.EXPIRATION_FIELDS, value_from="2026-01-01", value_to="2026-01-30")])),
+        ]
+        print(f"{rows:,} documents, median of {runs} run(s)")
+        print(f"{'search':<44} {'latency':>10} {'results':>8}")
+        for label, search in searches:
+            elapsed, results = await median_ms(search, runs)
+            print(f"{label:<44} {elapsed:>8.2f}ms {len(results):>8}")
+
+        if scan:
+            # What a lookup cost before the index: read every row's features and filter in Python
+            start = time.perf_counter()
+            matches = [
+                record_id for record_id, features in (await db.execute(
+                    select(models.DocumentRecord.id, models.DocumentRecord.features)
+                )).all()
+                if (features or {}).get("license_number") == sample["license_number"]
+            ]
+            print(f"{'full scan of features (no index)':<44} {(time.perf_counter() - start) * 1000:>8.0f}ms {len(matches):>8}")
+    finally:
+        await db.close()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--batch-size", type=int, default=5000, help="rebuild-feature-index batch size")
+    parser.add_argument("--db-path", default=DEFAULT_DB_PATH)
+    parser.add_argument("--no-scan", dest="scan", action="store_false", help="skip the unindexed full-scan baseline")
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.runs, args.batch_size, args.db_path, args.scan))
@@ -0,0 +1,64 @@
+"""Compare sequential vs. concurrent per-field extraction latency.
+
+The upstream model is replaced with an in-process fake that sleeps for a
+configurable latency, so no API key or network access is needed:
+
+    python benchmarks/field_extraction_latency.py --latency 0.8 --runs 5
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark-placeholder")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+
+import server  # noqa: E402
+
+logging.getLogger("server").setLevel(logging.WARNING)
+
+
+def install_fake_upstream(latency: float):
+    async def fake_create(**kwargs):
+        await asyncio.sleep(latency)
+        message = SimpleNamespace(content="SAMPLE VALUE")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    server.client.chat.completions.create = fake_create
+
+
+async def time_extraction(document_type: str, max_concurrency: int, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await server.extract_features(document_type, "data:image/png;base64,", max_concurrency=max_concurrency)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def main(latency: float, runs: int, concurrency: int):
+    install_fake_upstream(latency)
+    print(f"Simulated upstream latency: {latency:.2f}s, {runs} run(s) per row")
+    print(f"{'document_type':<16} {'fields':>6} {'sequential p50':>15} {'concurrent p50':>15} {'speedup':>8}")
+    for document_type, config in server.FEATURE_EXTRACTION_CONFIG.items():
+        sequential = statistics.median(await time_extraction(document_type, 1, runs))
+        concurrent = statistics.median(await time_extraction(document_type, concurrency, runs))
+        print(
+            f"{document_type:<16} {len(config['fields']):>6} "
+            f"{sequential:>14.2f}s {concurrent:>14.2f}s {sequential / concurrent:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.8, help="Simulated seconds per upstream call")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=server.FIELD_EXTRACTION_CONCURRENCY)
+    args = parser.parse_args()
+    asyncio.run(main(args.latency, args.runs, args.concurrency))
@@ -0,0 +1,95 @@
+"""Measure upstream payload size, normalization latency and (optionally) accuracy before/after image normalization.
+
+Size and latency are measured offline over every file in images/ plus a
+synthetic 12 MP phone-photo version of each. Accuracy needs a live model:
+
+    python benchmarks/image_normalization.py
+    OPENROUTER_API_KEY=... python benchmarks/image_normalization.py --accuracy
+"""
+import argparse
+import asyncio
+import base64
+import io
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+
+from PIL import Image  # noqa: E402
+
+from imaging import normalize_image  # noqa: E402
+
+IMAGES_DIR = os.path.join(REPO_ROOT, "images")
+
+
+def synthetic_phone_photo(contents: bytes) -> bytes:
+    image = Image.open(io.BytesIO(contents)).convert("RGBA").convert("RGB").resize((4032, 3024), Image.Resampling.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def estimate_image_tokens(contents: bytes) -> int:
+    # Gemini bills 258 tokens per 768x768 tile; images up to 384px on both sides count as one tile
+    width, height = Image.open(io.BytesIO(contents)).size
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * -(-width // 768) * -(-height // 768)
+
+
+def measure_sizes(runs: int):
+    print(f"{'image':<34} {'before':>10} {'after':>10} {'ratio':>6} {'tokens':>13} {'normalize p50':>14}")
+    for name in sorted(os.listdir(IMAGES_DIR)):
+        with open(os.path.join(IMAGES_DIR, name), "rb") as f:
+            original = f.read()
+        for label, contents in ((name, original), (f"{name} @12MP", synthetic_phone_photo(original))):
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                normalized, _ = normalize_image(contents)
+                timings.append(time.perf_counter() - start)
+            print(
+                f"{label:<34} {len(contents):>10,} {len(normalized):>10,} "
+                f"{len(normalized) / len(contents):>6.2f} "
+                f"{estimate_image_tokens(contents):>6}->{estimate_image_tokens(normalized):<6} "
+                f"{statistics.median(timings) * 1000:>12.1f}ms"
+            )
+
+
+async def measure_accuracy():
+    import server
+    from verify_classify import EXPECTED_DATA
+
+    logging.getLogger("server").setLevel(logging.WARNING)
+    print(f"\n{'image':<26} {'variant':<11} {'correct':>8} {'latency':>8}")
+    for case in EXPECTED_DATA:
+        with open(os.path.join(REPO_ROOT, case["file_path"]), "rb") as f:
+            contents = f.read()
+        variants = {
+            "raw": "data:image/png;base64," + base64.b64encode(contents).decode("utf-8"),
+            "normalized": server.encode_image_for_upstream(contents).data_url,
+        }
+        for variant, data_url in variants.items():
+            start = time.perf_counter()
+            document_type, features, _, _ = await server.run_extraction_pipeline(data_url)
+            elapsed = time.perf_counter() - start
+            expected = {"document_type": case["expected_document_type"], **case["expected_features"]}
+            actual = {"document_type": document_type, **features}
+            correct = sum(actual.get(key) == value for key, value in expected.items())
+            print(f"{case['file_path']:<26} {variant:<11} {correct:>4}/{len(expected):<3} {elapsed:>7.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--accuracy", action="store_true", help="Also compare extraction accuracy (needs OPENROUTER_API_KEY)")
+    args = parser.parse_args()
+    measure_sizes(args.runs)
+    if args.accuracy:
+        asyncio.run(measure_accuracy())
@@ -0,0 +1,212 @@
+"""Offline load test: the real server against a local fake OpenRouter, driven by a concurrent client mix.
+
+Starts benchmarks/fake_openrouter.py and `uvicorn server:app` against a scratch
+database, seeds a few documents, then runs a weighted mix of POST /classify,
+GET /documents/ and PUT /documents/{id} at each concurrency level. Reports
+throughput, p50/p95/p99 latency and error rate per endpoint, and writes a JSON
+report that a later run can be compared against:
+
+    python benchmarks/load_test.py --duration 15 --concurrency 4 16 --output before.json
+    python benchmarks/load_test.py --duration 15 --concurrency 4 16 --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.join(BENCHMARKS_DIR, "..")
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from db_throughput import free_port, start_server  # noqa: E402
+
+IMAGES_DIR = os.path.join(REPO_ROOT, "images")
+
+
+def start_fake_upstream(port: int, args) -> subprocess.Popen:
+    command = [
+        sys.executable, os.path.join(BENCHMARKS_DIR, "fake_openrouter.py"), "--port", str(port),
+        "--latency-ms", str(args.upstream_latency_ms), "--jitter-ms", str(args.upstream_jitter_ms),
+        "--tail-ratio", str(args.upstream_tail_ratio), "--tail-ms", str(args.upstream_tail_ms),
+        "--error-rate", str(args.upstream_error_rate),
+    ]
+    if args.cassette:
+        command += ["--cassette", args.cassette]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/_stats", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("fake upstream did not start")
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class LoadRun:
+    def __init__(self, client: httpx.AsyncClient, images: List[tuple], document_ids: List[int], mix: Dict[str, int], cache: str):
+        self.client = client
+        self.images = images
+        self.document_ids = document_ids
+        self.operations = [name for name, weight in mix.items() for _ in range(weight)]
+        self.cache = cache
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    async def classify(self):
+        filename, contents = random.choice(self.images)
+        response = await self.client.post("/classify", params={"cache": self.cache}, files={"image": (filename, contents)})
+        if response.status_code == 200:
+            self.document_ids.append(response.json()["id"])
+        return response
+
+    async def list_documents(self):
+        return await self.client.get("/documents/", params={"limit": 20})
+
+    async def update_document(self):
+        document_id = random.choice(self.document_ids)
+        return await self.client.put(f"/documents/{document_id}", json={"features": {"first_name": f"LOAD{random.randint(0, 9999)}"}})
+
+    async def worker(self, deadline: float):
+        operations = {"classify": self.classify, "list": self.list_documents, "update": self.update_document}
+        while time.perf_counter() < deadline:
+            name = random.choice(self.operations)
+            start = time.perf_counter()
+            try:
+                response = await operations[name]()
+                outcome = None if response.status_code < 400 else str(response.status_code)
+            except httpx.HTTPError as e:
+                outcome = type(e).__name__
+            self.latencies[name].append(time.perf_counter() - start)
+            if outcome is not None:
+                self.errors[name][outcome] += 1
+
+    async def run(self, concurrency: int, duration: float) -> Dict[str, Dict]:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(self.worker(deadline) for _ in range(concurrency)))
+        results = {}
+        for name in sorted(set(self.operations)):
+            latencies = self.latencies[name]
+            errors = sum(self.errors[name].values())
+            results[name] = {
+                "requests": len(latencies),
+                "throughput_rps": len(latencies) / duration,
+                "error_rate": errors / len(latencies) if latencies else 0.0,
+                "errors": dict(self.errors[name]),
+                "p50_ms": (percentile(latencies, 0.50) or 0) * 1000,
+                "p95_ms": (percentile(latencies, 0.95) or 0) * 1000,
+                "p99_ms": (percentile(latencies, 0.99) or 0) * 1000,
+            }
+        return results
+
+
+def print_level(concurrency: int, results: Dict[str, Dict], previous: Optional[Dict[str, Dict]]):
+    print(f"\nconcurrency {concurrency}")
+    print(f"{'endpoint':<10} {'requests':>8} {'req/s':>8} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s vs previous':>19}")
+    for name, stats in results.items():
+        comparison = ""
+        old = (previous or {}).get(name)
+        if old and old["throughput_rps"]:
+            comparison = f"{(stats['throughput_rps'] / old['throughput_rps'] - 1) * 100:+.1f}%"
+        print(
+            f"{name:<10} {stats['requests']:>8} {stats['throughput_rps']:>8.1f} {stats['error_rate'] * 100:>6.1f}% "
+            f"{stats['p50_ms']:>7.0f}ms {stats['p95_ms']:>7.0f}ms {stats['p99_ms']:>7.0f}ms {comparison:>19}"
+        )
+
+
+async def main(args):
+    mix = {name: int(weight) for name, weight in (item.split("=") for item in args.mix)}
+    images = [(name, open(os.path.join(IMAGES_DIR, name), "rb").read()) for name in sorted(os.listdir(IMAGES_DIR))]
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        upstream_port, app_port = free_port(), free_port()
+        upstream = start_fake_upstream(upstream_port, args)
+        app = start_server(workdir, app_port, {
+            "OPENROUTER_BASE_URL": f"http://127.0.0.1:{upstream_port}/v1",
+            "JOB_WORKERS": "0",
+            # The fake has no rate limit; the governor's default pacing would be what we measure
+            "UPSTREAM_REQUESTS_PER_SECOND": str(args.upstream_rps),
+        })
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=args.timeout) as client:
+                run = LoadRun(client, images, [], mix, args.cache)
+                for filename, contents in images:
+                    await run.classify()
+                if not run.document_ids:
+                    raise RuntimeError("seeding via /classify failed; is the fake upstream answering?")
+                levels = {}
+                for concurrency in args.concurrency:
+                    level = LoadRun(client, images, run.document_ids, mix, args.cache)
+                    levels[str(concurrency)] = await level.run(concurrency, args.duration)
+                    print_level(concurrency, levels[str(concurrency)], (previous or {}).get("levels", {}).get(str(concurrency)))
+                upstream_stats = httpx.get(f"http://127.0.0.1:{upstream_port}/_stats").json()
+        finally:
+            app.terminate()
+            upstream.terminate()
+            app.wait()
+            upstream.wait()
+
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    report = {
+        "run": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": commit or None,
+            "duration_seconds": args.duration,
+            "mix": mix,
+            "cache": args.cache,
+            "upstream": {
+                "latency_ms": args.upstream_latency_ms,
+                "jitter_ms": args.upstream_jitter_ms,
+                "tail_ratio": args.upstream_tail_ratio,
+                "tail_ms": args.upstream_tail_ms,
+                "error_rate": args.upstream_error_rate,
+                "calls": upstream_stats,
+            },
+        },
+        "levels": levels,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--mix", nargs="+", default=["classify=1", "list=4", "update=1"], help="operation=weight")
+    parser.add_argument("--cache", choices=["use", "bypass", "refresh"], default="bypass", help="/classify cache mode")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--upstream-latency-ms", type=float, default=300.0)
+    parser.add_argument("--upstream-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--upstream-tail-ratio", type=float, default=0.02)
+    parser.add_argument("--upstream-tail-ms", type=float, default=3000.0)
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0)
+    parser.add_argument("--upstream-rps", type=float, default=0.0, help="governor rate limit in the app (0 disables)")
+    parser.add_argument("--cassette", help="have the fake answer recorded requests from this cassette")
+    parser.add_argument("--output", help="write the machine-readable report here")
+    parser.add_argument("--compare", help="a previous --output report to diff against")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,117 @@
+"""Measure CPU latency, agreement and LLM calls saved for the local document-type pre-classifier.
+
+Agreement is leave-one-out over the bundled images/ (each image is scored by a
+model trained without it), so it is an honest if tiny estimate. With --llm the
+local predictions are also compared with the live upstream classification:
+
+    python benchmarks/local_classifier.py [--threshold 0.9]
+    OPENROUTER_API_KEY=... python benchmarks/local_classifier.py --llm
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+
+from imaging import normalize_image  # noqa: E402
+from local_classifier import LocalDocumentClassifier, extract_image_features  # noqa: E402
+from train_local_classifier import LABELS, bundled_manifest, export_onnx, load_dataset, train_softmax_regression  # noqa: E402
+
+
+def train_to_file(features, targets, path: str) -> LocalDocumentClassifier:
+    export_onnx(*train_softmax_regression(features, targets), path)
+    return LocalDocumentClassifier(path)
+
+
+def measure_latency(classifier: LocalDocumentClassifier, images, runs: int):
+    feature_timings, total_timings = [], []
+    for contents in images:
+        for _ in range(runs):
+            start = time.perf_counter()
+            extract_image_features(contents)
+            feature_timings.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            classifier.predict(contents)
+            total_timings.append(time.perf_counter() - start)
+    total_timings.sort()
+    print(
+        f"CPU latency per image (normalized input, {len(total_timings)} runs): "
+        f"features p50 {statistics.median(feature_timings) * 1000:.2f}ms, "
+        f"predict p50 {statistics.median(total_timings) * 1000:.2f}ms, "
+        f"p95 {total_timings[int(len(total_timings) * 0.95)] * 1000:.2f}ms"
+    )
+
+
+def leave_one_out(manifest, images, threshold: float, scratch_dir: str):
+    features, targets = load_dataset(manifest)
+    predictions = []
+    print(f"\n{'image':<26} {'expected':<16} {'local':<16} {'confidence':>10}")
+    for held_out, entry in enumerate(manifest):
+        keep = [i for i in range(len(manifest)) if i != held_out]
+        classifier = train_to_file(features[keep], targets[keep], os.path.join(scratch_dir, f"loo_{held_out}.onnx"))
+        label, confidence = classifier.predict(images[held_out])
+        predictions.append((label, confidence))
+        print(f"{os.path.basename(entry['file_path']):<26} {entry['document_type']:<16} {label:<16} {confidence:>10.3f}")
+
+    confident = [(entry, label) for entry, (label, confidence) in zip(manifest, predictions) if confidence >= threshold]
+    correct = sum(label == entry["document_type"] for entry, (label, _) in zip(manifest, predictions))
+    confident_correct = sum(label == entry["document_type"] for entry, label in confident)
+    print(
+        f"\nleave-one-out agreement: {correct}/{len(manifest)}; "
+        f"at threshold {threshold}: {len(confident)}/{len(manifest)} classification calls skipped, "
+        f"{confident_correct}/{len(confident)} of those correct"
+    )
+
+
+async def compare_with_llm(classifier: LocalDocumentClassifier, manifest, images, threshold: float):
+    import server
+
+    logging.getLogger("server").setLevel(logging.WARNING)
+    agree = 0
+    print(f"\n{'image':<26} {'llm':<16} {'local':<16} {'confidence':>10} {'llm latency':>12}")
+    for entry, contents in zip(manifest, images):
+        start = time.perf_counter()
+        llm_label, _ = await server.classify_document_type(server.encode_image_for_upstream(contents).data_url)
+        elapsed = time.perf_counter() - start
+        label, confidence = classifier.predict(contents)
+        agree += label == llm_label
+        print(
+            f"{os.path.basename(entry['file_path']):<26} {llm_label:<16} {label:<16} "
+            f"{confidence:>10.3f} {elapsed * 1000:>10.0f}ms"
+        )
+    print(f"\nagreement with the LLM: {agree}/{len(manifest)} (threshold {threshold} not applied)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--llm", action="store_true", help="also compare with the live upstream classifier")
+    args = parser.parse_args()
+
+    manifest = bundled_manifest(os.path.join(REPO_ROOT, "images"))
+    # The server classifies the normalized image, so measure on the same input
+    images = []
+    for entry in manifest:
+        with open(entry["file_path"], "rb") as f:
+            images.append(normalize_image(f.read())[0])
+    print(f"{len(manifest)} images, labels {LABELS}")
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        features, targets = load_dataset(manifest)
+        classifier = train_to_file(features, targets, os.path.join(scratch_dir, "full.onnx"))
+        measure_latency(classifier, images, args.runs)
+        leave_one_out(manifest, images, args.threshold, scratch_dir)
+        if args.llm:
+            asyncio.run(compare_with_llm(classifier, manifest, images, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
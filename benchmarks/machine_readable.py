@@ -0,0 +1,133 @@
+"""Measure decode latency, model calls saved and accuracy for the local MRZ/barcode decoder.
+
+Runs machine_readable.MachineReadableDecoder over the bundled images/ and two
+synthetic document backs built from verify_classify.py's expectations: an AAMVA
+PDF417 barcode for the Washington license and a TD1 machine-readable zone for
+the EAD card (the bundled license and EAD images are fronts, which carry
+neither). Calls saved are counted against per_field extraction (classification
+plus one call per field, taking five fields when an undecoded image has no
+expectation); accuracy compares each decoded value with
+verify_classify.py's expected value where there is one:
+
+    python benchmarks/machine_readable.py [--runs 3]
+"""
+import argparse
+import io
+import logging
+import os
+import statistics
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_ROOT)
+
+from machine_readable import MachineReadableDecoder, check_digit  # noqa: E402
+from verify_classify import EXPECTED_DATA  # noqa: E402
+
+IMAGES_DIR = os.path.join(REPO_ROOT, "images")
+MONOSPACE_FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf"
+
+# Fields per document type, as in server.FEATURE_EXTRACTION_CONFIG (importing server would start its clients)
+FIELD_COUNTS = {"passport": 5, "drivers_license": 6, "ead_card": 5}
+
+
+def synthetic_license_back(expected: dict) -> bytes:
+    import zxingcpp
+
+    def us_date(value: str) -> str:
+        year, month, day = value.split("-")
+        return f"{month}{day}{year}"
+
+    payload = (
+        "@\n\x1e\rANSI 636045100002DL00410200DL"
+        f"DAQ{expected['license_number']}\nDCS{expected['last_name']}\nDAC{expected['first_name']}\nDADNONE\n"
+        f"DBD{us_date(expected['issue_date'])}\nDBB{us_date(expected['date_of_birth'])}\n"
+        f"DBA{us_date(expected['expiration_date'])}\nDBC1\nDAJWA\nDCGUSA\n\r"
+    )
+    barcode = Image.fromarray(zxingcpp.create_barcode(payload, zxingcpp.BarcodeFormat.PDF417).to_image(scale=3))
+    card = Image.new("RGB", (barcode.width + 80, barcode.height + 240), "#e8ecef")
+    card.paste(barcode.convert("RGB"), (40, 160))
+    return encode(card)
+
+
+def synthetic_ead_back(expected: dict) -> bytes:
+    expiry = expected["card_expires_date"].replace("-", "")[2:]
+    document_number = expected["card_number"][-9:]
+    line1 = f"IAUSA{document_number}{check_digit(document_number)}{expected['card_number']}".ljust(30, "<")
+    line2 = f"800101{check_digit('800101')}F{expiry}{check_digit(expiry)}USA".ljust(29, "<")
+    line2 += check_digit(line1[5:30] + line2[0:7] + line2[8:15] + line2[18:29])
+    line3 = f"{expected['last_name']}<<{expected['first_name']}".ljust(30, "<")
+
+    font = ImageFont.truetype(MONOSPACE_FONT, 28)
+    card = Image.new("RGB", (640, 404), "#f1efe6")
+    draw = ImageDraw.Draw(card)
+    draw.text((24, 30), "NOT VALID FOR REENTRY TO U.S.", fill="#333333", font=ImageFont.truetype(MONOSPACE_FONT, 18))
+    for i, line in enumerate((line1, line2, line3)):
+        draw.text((40, 250 + i * 42), line, fill="black", font=font)
+    return encode(card)
+
+
+def encode(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def main(runs: int):
+    expectations = {os.path.basename(case["file_path"]): case for case in EXPECTED_DATA}
+    samples = [(name, open(os.path.join(IMAGES_DIR, name), "rb").read(), expectations.get(name)) for name in sorted(os.listdir(IMAGES_DIR))]
+    license_case = expectations["WALicense.png"]
+    ead_case = expectations["EADSample.jpg"]
+    samples.append(("WALicense back (synthetic)", synthetic_license_back(license_case["expected_features"]), license_case))
+    samples.append(("EADSample back (synthetic)", synthetic_ead_back(ead_case["expected_features"]), ead_case))
+
+    decoder = MachineReadableDecoder()
+    decoder.decode(samples[0][1])  # Load the OCR models outside the timings
+
+    print(f"{'image':<28} {'decoded as':<16} {'source':<7} {'median':>8} {'fields':>7} {'calls saved':>12} {'correct':>8}")
+    total_saved = total_calls = correct = compared = 0
+    mismatches = []
+    for name, contents, case in samples:
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = decoder.decode(contents)
+            timings.append(time.perf_counter() - start)
+        expected_type = case["expected_document_type"] if case else None
+        baseline_calls = 1 + FIELD_COUNTS.get(expected_type or (result.document_type if result else ""), 5)
+        total_calls += baseline_calls
+        if result is None:
+            print(f"{name:<28} {'-':<16} {'-':<7} {statistics.median(timings) * 1000:>6.0f}ms {0:>7} {0:>5} of {baseline_calls:<4} {'':>8}")
+            continue
+        saved = 1 + len(result.features)
+        total_saved += saved
+        matches = []
+        if case:
+            matches.append(result.document_type == expected_type)
+            for field_key, value in result.features.items():
+                expected_value = case["expected_features"].get(field_key)
+                matches.append(value == expected_value)
+                if value != expected_value:
+                    mismatches.append(f"{name}: {field_key} decoded as {value!r}, expected {expected_value!r}")
+        correct += sum(matches)
+        compared += len(matches)
+        accuracy = f"{sum(matches)}/{len(matches)}" if matches else "n/a"
+        print(
+            f"{name:<28} {result.document_type:<16} {result.source:<7} {statistics.median(timings) * 1000:>6.0f}ms "
+            f"{len(result.features):>7} {saved:>5} of {baseline_calls:<4} {accuracy:>8}"
+        )
+    print(f"\nModel calls saved: {total_saved} of {total_calls} per_field calls ({total_saved / total_calls:.0%})")
+    print(f"Decoded values matching verify_classify.py (document type included): {correct}/{compared}")
+    for mismatch in mismatches:
+        print(f"  {mismatch}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    main(args.runs)
@@ -0,0 +1,161 @@
+"""Throughput of `python serve.py` from one worker process to N, and a check that rate limits hold deployment-wide.
+
+Starts benchmarks/fake_openrouter.py, then serve.py with each --workers count
+against a scratch database, waits for GET /ready, and drives POST /classify
+(cache=bypass, so every request does the full image and extraction work) with
+a fixed number of concurrent clients. Reports documents/s and p50/p95 latency
+per worker count, and how long /ready took to pass.
+
+Then restarts serve.py with the most workers and UPSTREAM_REQUESTS_PER_SECOND
+set, and reports the upstream request rate the fake actually saw: with the
+shared token bucket it stays at the configured rate rather than N times it.
+
+    python benchmarks/multi_worker.py --workers 1 2 4 --duration 20 --concurrency 32 [--rate-limit 10]
+
+Scaling is bounded by the machine's cores (os.cpu_count() is printed); the
+fake upstream runs on the same machine and takes its share of them.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import httpx
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.join(BENCHMARKS_DIR, "..")
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from db_throughput import free_port  # noqa: E402
+from load_test import IMAGES_DIR, percentile, start_fake_upstream  # noqa: E402
+
+
+def start_serve(workdir: str, port: int, workers: int, upstream_port: int, extra_env: dict) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "OPENROUTER_API_KEY": "benchmark-placeholder",
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{upstream_port}/v1",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "BLOB_STORE_DIR": os.path.join(workdir, "blobs"),
+        "SHARED_STATE_PATH": os.path.join(workdir, "state"),
+        "JOB_WORKERS": "0",
+        "UPSTREAM_REQUESTS_PER_SECOND": "0",
+        **extra_env,
+    }
+    return subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def wait_until_ready(port: int, process: subprocess.Popen, timeout: float = 120) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError("serve.py exited during startup")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/ready", timeout=1).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("serve.py did not become ready")
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def drive(port: int, images: List[tuple], concurrency: int, duration: float):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            filename, contents = random.choice(images)
+            start = time.perf_counter()
+            response = await client.post("/classify", params={"cache": "bypass"}, files={"image": (filename, contents)})
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def upstream_requests(upstream_port: int) -> int:
+    return httpx.get(f"http://127.0.0.1:{upstream_port}/_stats").json()["requests"]
+
+
+def main(args):
+    images = []
+    for name in sorted(os.listdir(IMAGES_DIR)):
+        with open(os.path.join(IMAGES_DIR, name), "rb") as f:
+            images.append((name, f.read()))
+    upstream_port = free_port()
+    upstream = start_fake_upstream(upstream_port, argparse.Namespace(
+        upstream_latency_ms=args.upstream_latency_ms, upstream_jitter_ms=args.upstream_latency_ms / 5,
+        upstream_tail_ratio=0.0, upstream_tail_ms=0.0, upstream_error_rate=0.0, cassette=None,
+    ))
+    print(f"{os.cpu_count()} CPU(s); {len(images)} images; {args.concurrency} clients; upstream latency {args.upstream_latency_ms:.0f}ms")
+    try:
+        print(f"\n{'workers':>7} {'ready after':>12} {'documents':>10} {'errors':>7} {'docs/s':>8} {'p50':>8} {'p95':>8} {'scaling':>8}")
+        baseline = None
+        for workers in args.workers:
+            workdir = tempfile.mkdtemp()
+            port = free_port()
+            server = start_serve(workdir, port, workers, upstream_port, {})
+            try:
+                ready_after = wait_until_ready(port, server)
+                latencies, errors, elapsed = asyncio.run(drive(port, images, args.concurrency, args.duration))
+            finally:
+                stop(server)
+            throughput = len(latencies) / elapsed
+            baseline = baseline or throughput
+            print(
+                f"{workers:>7} {ready_after:>11.1f}s {len(latencies):>10} {errors:>7} {throughput:>8.2f} "
+                f"{percentile(latencies, 0.5) * 1000:>6.0f}ms {percentile(latencies, 0.95) * 1000:>6.0f}ms {throughput / baseline:>7.2f}x"
+            )
+
+        workers = max(args.workers)
+        workdir = tempfile.mkdtemp()
+        port = free_port()
+        server = start_serve(workdir, port, workers, upstream_port, {
+            "UPSTREAM_REQUESTS_PER_SECOND": str(args.rate_limit), "UPSTREAM_REQUEST_BURST": "1",
+        })
+        try:
+            wait_until_ready(port, server)
+            before = upstream_requests(upstream_port)
+            _, _, elapsed = asyncio.run(drive(port, images, args.concurrency, args.duration))
+            rate = (upstream_requests(upstream_port) - before) / elapsed
+        finally:
+            stop(server)
+        print(f"\nUPSTREAM_REQUESTS_PER_SECOND={args.rate_limit:g} with {workers} worker(s): upstream saw {rate:.1f} requests/s")
+    finally:
+        stop(upstream)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of load per worker count")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--upstream-latency-ms", type=float, default=100.0)
+    parser.add_argument("--rate-limit", type=float, default=10.0, help="UPSTREAM_REQUESTS_PER_SECOND for the shared limit check")
+    main(parser.parse_args())
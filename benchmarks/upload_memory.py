@@ -0,0 +1,138 @@
+"""Measure server memory while large uploads arrive concurrently.
+
+Starts `uvicorn server:app` against a scratch database and an in-process fake
+upstream, then posts a large generated photo to /classify at each concurrency
+level, sampling the server's resident set size (Linux /proc) throughout. Also
+checks that an oversized upload is refused without the server buffering it:
+
+    python benchmarks/upload_memory.py --megapixels 24 --concurrency 1 4 8
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import numpy as np
+import uvicorn
+from PIL import Image
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from db_throughput import free_port, start_server  # noqa: E402
+from fake_openrouter import FakeBehaviour, create_app  # noqa: E402
+
+
+def large_photo(megapixels: float, quality: int) -> bytes:
+    """Smooth gradients plus noise: compresses like a phone photo rather than like pure noise."""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([(x * 255 // width), (y * 255 // height), ((x + y) * 255 // (width + height))], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class RssSampler:
+    def __init__(self, pid: int, interval: float = 0.01):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def rss(self) -> int:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+async def upload_round(client: httpx.AsyncClient, photo: bytes, concurrency: int):
+    async def one():
+        start = time.perf_counter()
+        response = await client.post("/classify", params={"cache": "bypass"}, files={"image": ("large.jpg", photo, "image/jpeg")})
+        return response.status_code, time.perf_counter() - start
+
+    return await asyncio.gather(*(one() for _ in range(concurrency)))
+
+
+async def main(args):
+    upstream_port, app_port = free_port(), free_port()
+    fake = uvicorn.Server(uvicorn.Config(create_app(FakeBehaviour(latency_ms=200, jitter_ms=0)), port=upstream_port, log_level="error"))
+    serve_fake = asyncio.create_task(fake.serve())
+    while not fake.started:
+        await asyncio.sleep(0.05)
+
+    photo = large_photo(args.megapixels, args.quality)
+    print(f"Upload: {args.megapixels:g} MP JPEG, {len(photo) / 2**20:.1f} MiB")
+    with tempfile.TemporaryDirectory() as workdir:
+        app = start_server(workdir, app_port, {
+            "OPENROUTER_BASE_URL": f"http://127.0.0.1:{upstream_port}/v1",
+            "JOB_WORKERS": "0",
+            "UPSTREAM_REQUESTS_PER_SECOND": "0",
+            "IMAGE_MAX_PIXELS": str(int(args.megapixels * 1_000_000 * 1.1)),
+            "UPLOAD_MAX_BYTES": str(args.max_upload_mib * 2**20),
+        })
+        sampler = RssSampler(app.pid)
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=300) as client:
+                await upload_round(client, photo, 1)  # Warm up imports, thread pools and allocator arenas
+                print(f"{'concurrency':>11} {'ok':>4} {'baseline RSS':>13} {'peak RSS':>10} {'growth':>10} {'per upload':>11} {'p50':>8}")
+                for concurrency in args.concurrency:
+                    baseline = sampler.rss()
+                    with RssSampler(app.pid) as level_sampler:
+                        results = await upload_round(client, photo, concurrency)
+                    ok = sum(1 for status, _ in results if status == 200)
+                    growth = level_sampler.peak - baseline
+                    latencies = sorted(elapsed for _, elapsed in results)
+                    print(
+                        f"{concurrency:>11} {ok:>4} {baseline / 2**20:>11.0f}Mi {level_sampler.peak / 2**20:>8.0f}Mi "
+                        f"{growth / 2**20:>8.0f}Mi {growth / concurrency / 2**20:>9.1f}Mi {latencies[len(latencies) // 2]:>7.2f}s"
+                    )
+
+                oversized = b"\xff\xd8\xff" + bytes((args.max_upload_mib + 8) * 2**20)
+                baseline = sampler.rss()
+                with RssSampler(app.pid) as level_sampler:
+                    response = await client.post("/classify", files={"image": ("huge.jpg", oversized, "image/jpeg")})
+                print(
+                    f"Oversized upload ({len(oversized) / 2**20:.0f} MiB > UPLOAD_MAX_BYTES): HTTP {response.status_code}, "
+                    f"RSS growth {(level_sampler.peak - baseline) / 2**20:.0f}Mi"
+                )
+        finally:
+            app.terminate()
+            app.wait()
+    fake.should_exit = True
+    await serve_fake
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megapixels", type=float, default=24.0)
+    parser.add_argument("--quality", type=int, default=95)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--max-upload-mib", type=int, default=32, help="UPLOAD_MAX_BYTES for the server, in MiB")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,149 @@
+"""Exercise the upstream governor against a local fake OpenAI-compatible server.
+
+Runs three scenarios, each with and without the governor, through the real
+OpenAI client: a rate-limited upstream (429 storms), an outage (circuit
+breaker) and a slow tail (hedged requests):
+
+    python benchmarks/upstream_governor.py [--requests 200]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import time
+
+import httpx
+import uvicorn
+from openai import AsyncOpenAI
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, ".."))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fake_openrouter import FakeBehaviour, create_app  # noqa: E402
+from governor import CircuitBreaker, UpstreamGovernor  # noqa: E402
+
+PARAMS = {
+    "model": "fake",
+    "max_tokens": 50,
+    "messages": [{"role": "user", "content": [
+        {"type": "text", "text": "The image provided is a passport. What is the full name?"},
+        {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,AAAA"}},
+    ]}],
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def reset_fake(control: httpx.AsyncClient, **behaviour):
+    await control.post("/_control", json=FakeBehaviour(**behaviour).model_dump())
+    before = (await control.get("/_stats")).json()
+    return before
+
+
+async def run_load(create, requests: int, concurrency: int, arrival_rate: float = 0.0):
+    """Closed loop with `concurrency` callers, or open loop at `arrival_rate` requests/second."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one(index: int):
+        nonlocal failures
+        if arrival_rate:
+            await asyncio.sleep(index / arrival_rate)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await create(**PARAMS)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    return latencies, failures, time.perf_counter() - start
+
+
+async def scenario(name, control, client, governor, behaviour, requests, concurrency, mid_run=None, arrival_rate=0.0):
+    before = await reset_fake(control, **behaviour)
+    await asyncio.sleep(1.1)  # Let the fake's one-second rate window drain from the previous scenario
+    create = client.chat.completions.create if governor is None else governor.create
+    load = asyncio.create_task(run_load(create, requests, concurrency, arrival_rate))
+    if mid_run is not None:
+        await mid_run(control)
+    latencies, failures, elapsed = await load
+    after = (await control.get("/_stats")).json()
+    upstream_calls = after["requests"] - before["requests"]
+    rejected = after["rate_limited"] - before["rate_limited"] + after["errors"] - before["errors"]
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000 if latencies else float("nan")
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float("nan")
+    print(
+        f"{name:<34} {requests - failures:>4}/{requests:<4} {upstream_calls:>8} {rejected:>9} "
+        f"{p50:>8.0f}ms {p99:>8.0f}ms {elapsed:>7.1f}s"
+    )
+    return governor
+
+
+async def main(requests: int):
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(FakeBehaviour()), port=port, log_level="error"))
+    serve = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    base_url = f"http://127.0.0.1:{port}"
+    client = AsyncOpenAI(base_url=f"{base_url}/v1", api_key="fake", max_retries=0)
+    async with httpx.AsyncClient(base_url=base_url) as control:
+        print(f"{'scenario':<34} {'ok':>9} {'upstream':>8} {'429s/5xxs':>9} {'p50':>10} {'p99':>10} {'elapsed':>8}")
+
+        rate_limited = {"latency_ms": 50, "jitter_ms": 10, "rate_limit_rps": 20, "retry_after_seconds": 1}
+        await scenario("rate limited, ungoverned", control, client, None, rate_limited, requests, 32)
+        # At most 12 + 6 (burst) calls in any second, under the fake's 20
+        await scenario(
+            "rate limited, governed (12 rps)", control, client,
+            UpstreamGovernor(client.chat.completions.create, max_concurrency=32, requests_per_second=12),
+            rate_limited, requests, 32
+        )
+
+        async def outage_then_recovery(control):
+            await asyncio.sleep(1.0)
+            await control.post("/_control", json={"error_rate": 0.0})
+
+        outage = {"latency_ms": 20, "jitter_ms": 5, "error_rate": 1.0}
+        # Open loop over ~3s, so some requests arrive during the outage and some after it
+        arrival_rate = requests / 3
+        await scenario("1s outage, ungoverned", control, client, None, outage, requests, 8, outage_then_recovery, arrival_rate)
+        governed = await scenario(
+            "1s outage, governed (breaker)", control, client,
+            UpstreamGovernor(
+                client.chat.completions.create, max_concurrency=8, max_retries=2, retry_base_delay=0.2,
+                breaker=CircuitBreaker(failure_threshold=5, reset_timeout=0.5)
+            ),
+            outage, requests, 8, outage_then_recovery, arrival_rate
+        )
+        print(f"{'':<34} breaker rejections: {governed.stats['circuit_rejections']}, retries: {governed.stats['retries']}")
+
+        slow_tail = {"latency_ms": 100, "jitter_ms": 20, "tail_ratio": 0.03, "tail_ms": 2000}
+        await reset_fake(control, **slow_tail)
+        await scenario("3% slow tail, no hedging", control, client, None, slow_tail, requests, 16)
+        hedging = UpstreamGovernor(client.chat.completions.create, max_concurrency=32, hedge_after="p95")
+        await run_load(hedging.create, 100, 16)  # Warm up the latency history the p95 is taken from
+        await scenario("3% slow tail, hedged at p95", control, client, hedging, slow_tail, requests, 16)
+        print(f"{'':<34} hedges: {hedging.stats['hedges']}, won by the hedge: {hedging.stats['hedge_wins']}")
+
+    await client.close()
+    server.should_exit = True
+    await serve
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
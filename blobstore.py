@@ -0,0 +1,76 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Callable, Iterator, Optional
+
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "./blobs")
+
+
+class BlobStore:
+    """Content-addressed binary store on local disk.
+
+    Blobs live at <root>/<first two hex chars>/<sha256>, so identical uploads
+    are stored once. Writes go through a temp file and an atomic rename, so
+    readers never see a partial blob.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        self._write(digest, lambda f: f.write(data))
+        return digest
+
+    def put_file(self, file: BinaryIO, digest: str) -> str:
+        """Store a file whose sha256 the caller already computed, copying it in chunks rather than reading it whole."""
+        file.seek(0)
+        self._write(digest, lambda f: shutil.copyfileobj(file, f))
+        return digest
+
+    def _write(self, digest: str, write: Callable[[BinaryIO], object]):
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            # Storing it again counts as a write, so a concurrent delete(unless_written_since=...) keeps it
+            os.utime(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path_for(digest))
+
+    def delete(self, digest: str, unless_written_since: Optional[float] = None) -> bool:
+        """Remove a blob, unless it was stored (again) after the time.time() unless_written_since. Returns whether it was removed."""
+        path = self.path_for(digest)
+        try:
+            if unless_written_since is not None and os.path.getmtime(path) >= unless_written_since:
+                return False
+            os.unlink(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def digests(self) -> Iterator[str]:
+        for directory, _, filenames in os.walk(self.root):
+            yield from (filename for filename in filenames if not filename.startswith(".tmp-"))
+
+    def get(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self.path_for(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
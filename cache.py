@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import crud
+from database import AsyncSessionLocal
+from shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
+# (document_type, features, field_errors, sources), as returned by the extraction pipeline
+ExtractionResult = Tuple[str, Dict[str, Optional[str]], Dict[str, str], Dict[str, str]]
+
+
+def make_cache_key(image_sha256: str, model_name: str, config_fingerprint: str, extraction_mode: str) -> str:
+    """image_sha256 is the hash of the upload as received, computed while it was read."""
+    return hashlib.sha256(f"{image_sha256}:{model_name}:{config_fingerprint}:{extraction_mode}".encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """Two-tier cache of extraction results with in-flight request coalescing.
+
+    Lookups check a bounded in-memory LRU first, then the extraction_cache table.
+    Concurrent misses for the same key share one computation. Results with
+    field errors are returned but never stored.
+
+    Every worker process has its own memory tier; the table is shared. With
+    `shared_state`, an invalidation in one worker also clears the memory tier
+    of the others, on their next lookup.
+    """
+
+    def __init__(self, max_entries: int = 1024, persist: bool = True, shared_state: Optional[SharedState] = None):
+        self.max_entries = max_entries
+        self.persist = persist
+        self.shared_state = shared_state
+        self._generation = self._shared_generation()
+        self._memory: "OrderedDict[str, Tuple[str, Dict[str, Optional[str]], Dict[str, str]]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "coalesced": 0, "bypassed": 0, "stores": 0}
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[ExtractionResult]],
+        mode: str = "use"
+    ) -> ExtractionResult:
+        """mode is "use" (normal lookup), "bypass" (skip the cache) or "refresh" (recompute and overwrite)."""
+        if mode == "bypass":
+            self.stats["bypassed"] += 1
+            return await compute()
+
+        if mode == "use":
+            cached = await self._lookup(key)
+            if cached is not None:
+                return cached
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._compute_and_store(key, compute))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shielded so one client disconnecting doesn't cancel the work other requests are waiting on,
+        # but cancelled once the last waiter is gone, so abandoned extractions stop spending upstream quota
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            document_type, features, field_errors, sources = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+        return document_type, dict(features), dict(field_errors), dict(sources)
+
+    def _shared_generation(self) -> float:
+        return self.shared_state.get("cache_generation") if self.shared_state is not None else 0.0
+
+    def _sync_generation(self):
+        """Drop the memory tier if another worker invalidated the cache since we last looked."""
+        generation = self._shared_generation()
+        if generation != self._generation:
+            self._memory.clear()
+            self._generation = generation
+
+    async def _lookup(self, key: str) -> Optional[ExtractionResult]:
+        self._sync_generation()
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return entry[0], dict(entry[1]), {}, dict(entry[2])
+
+        if not self.persist:
+            return None
+        async with AsyncSessionLocal() as db:
+            db_entry = await crud.get_extraction_cache_entry(db, cache_key=key)
+        if db_entry is None:
+            return None
+        self.stats["db_hits"] += 1
+        # Entries stored before sources were recorded have none
+        sources = db_entry.sources or {}
+        self._remember(key, db_entry.document_type, db_entry.features, sources)
+        return db_entry.document_type, dict(db_entry.features), {}, dict(sources)
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[ExtractionResult]]) -> ExtractionResult:
+        document_type, features, field_errors, sources = await compute()
+        if not field_errors:
+            self._remember(key, document_type, features, sources)
+            if self.persist:
+                try:
+                    async with AsyncSessionLocal() as db:
+                        await crud.upsert_extraction_cache_entry(
+                            db, cache_key=key, document_type=document_type, features=features, sources=sources
+                        )
+                except Exception as e:
+                    logger.warning(f"Failed to persist extraction cache entry: {e}")
+            self.stats["stores"] += 1
+        return document_type, features, field_errors, sources
+
+    def _remember(self, key: str, document_type: str, features: Dict[str, Optional[str]], sources: Dict[str, str]):
+        self._sync_generation()
+        self._memory[key] = (document_type, dict(features), dict(sources))
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def invalidate(self) -> int:
+        """Drop every cached result from both tiers. Returns the number of persisted entries removed."""
+        self._memory.clear()
+        if self.shared_state is not None:
+            self._generation = self.shared_state.add("cache_generation", 1)
+        if not self.persist:
+            return 0
+        async with AsyncSessionLocal() as db:
+            return await crud.delete_extraction_cache_entries(db)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {**self.stats, "memory_entries": len(self._memory), "in_flight": len(self._in_flight)}
@@ -0,0 +1,120 @@
+"""Record upstream chat completions to a JSON file and replay them offline.
+
+A cassette maps a hash of the request (model, prompt, image, sampling
+parameters) to the response content and token usage. Replaying one makes an
+evaluation deterministic and free, and a changed prompt shows up as a miss
+rather than a silently reused answer.
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from openai.types.chat import ChatCompletion
+
+CASSETTE_MODES = ("record", "replay", "auto")
+
+
+class CassetteMissError(LookupError):
+    """Replay found no recorded response for a request."""
+
+
+def request_key(params: Dict[str, Any]) -> str:
+    parts = []
+    for message in params.get("messages", []):
+        content = message["content"]
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        for part in content:
+            if part["type"] == "text":
+                parts.append(part["text"])
+            elif part["type"] == "image_url":
+                # Only the image's hash goes into the key; cassettes never hold image data
+                parts.append(hashlib.sha256(part["image_url"]["url"].encode("utf-8")).hexdigest())
+    material = {
+        "model": params.get("model"),
+        "max_tokens": params.get("max_tokens"),
+        "temperature": params.get("temperature"),
+        "response_format": params.get("response_format"),
+        "content": parts,
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def prompt_text(params: Dict[str, Any]) -> str:
+    content = params["messages"][0]["content"]
+    if isinstance(content, str):
+        return content
+    return next((part["text"] for part in content if part["type"] == "text"), "")
+
+
+def to_completion(entry: Dict[str, Any], model: Optional[str]) -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": f"cassette-{entry['key'][:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model or "cassette",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": entry["content"]}, "finish_reason": "stop"}],
+        "usage": entry.get("usage"),
+    })
+
+
+class Cassette:
+    """Wraps a chat-completions `create` callable.
+
+    - "replay": answer only from the file; a miss raises CassetteMissError
+    - "record": always call upstream and store the answer
+    - "auto": replay hits, record misses
+    """
+
+    def __init__(self, path: str, mode: str = "replay"):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Cassette mode must be one of {CASSETTE_MODES}, got '{mode}'")
+        self.path = path
+        self.mode = mode
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"hits": 0, "misses": 0, "recorded": 0}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = {entry["key"]: entry for entry in json.load(f)["interactions"]}
+
+    def lookup(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return self.entries.get(request_key(params))
+
+    def wrap(self, create: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        async def cassette_create(**params):
+            entry = self.lookup(params) if self.mode != "record" else None
+            if entry is not None:
+                self.stats["hits"] += 1
+                return to_completion(entry, params.get("model"))
+            self.stats["misses"] += 1
+            if self.mode == "replay":
+                raise CassetteMissError(f"No recorded response for prompt '{prompt_text(params)[:80]}...'")
+            completion = await create(**params)
+            self.record(params, completion)
+            return completion
+
+        return cassette_create
+
+    def record(self, params: Dict[str, Any], completion: Any):
+        usage = getattr(completion, "usage", None)
+        key = request_key(params)
+        self.entries[key] = {
+            "key": key,
+            "prompt": prompt_text(params)[:200], # For humans reading diffs; not part of the match
+            "content": completion.choices[0].message.content,
+            "usage": {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+            } if usage is not None else None,
+        }
+        self.stats["recorded"] += 1
+
+    def save(self):
+        # Sorted by key, so re-recording gives a readable diff
+        with open(self.path, "w") as f:
+            json.dump({"interactions": sorted(self.entries.values(), key=lambda entry: entry["key"])}, f, indent=1)
+            f.write("\n")
@@ -1,34 +1,299 @@
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Row, Select, and_, delete, func, insert, intersect, literal, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
+from typing import Dict, List, Optional, Sequence, Tuple
 import models
 import schemas
+from feature_index import index_entries, prefix_upper_bound
 
-def get_document_record(db: Session, record_id: int) -> Optional[models.DocumentRecord]:
-    return db.query(models.DocumentRecord).filter(models.DocumentRecord.id == record_id).first()
+async def get_document_record(db: AsyncSession, record_id: int) -> Optional[models.DocumentRecord]:
+    stmt = select(models.DocumentRecord).options(defer(models.DocumentRecord.image_base64)).where(models.DocumentRecord.id == record_id)
+    return (await db.scalars(stmt)).first()
 
-def get_document_records(db: Session, skip: int = 0, limit: int = 10) -> List[models.DocumentRecord]:
-    return db.query(models.DocumentRecord).order_by(models.DocumentRecord.updated_at.desc()).offset(skip).limit(limit).all()
+async def get_document_records(db: AsyncSession, skip: int = 0, limit: int = 10) -> List[models.DocumentRecord]:
+    stmt = select(models.DocumentRecord).options(defer(models.DocumentRecord.image_base64)).order_by(models.DocumentRecord.updated_at.desc(), models.DocumentRecord.id.desc()).offset(skip).limit(limit)
+    return list((await db.scalars(stmt)).all())
 
-def create_document_record(db: Session, record: schemas.DocumentRecordCreate) -> models.DocumentRecord:
+DOCUMENT_SUMMARY_COLUMNS = (
+    models.DocumentRecord.id,
+    models.DocumentRecord.original_filename,
+    models.DocumentRecord.document_type,
+    models.DocumentRecord.features,
+    models.DocumentRecord.created_at,
+    models.DocumentRecord.updated_at,
+)
+
+async def get_document_summaries(
+    db: AsyncSession,
+    limit: int = 20,
+    after: Optional[Tuple[datetime, int]] = None,
+    document_type: Optional[str] = None,
+    updated_from: Optional[datetime] = None,
+    updated_to: Optional[datetime] = None,
+) -> List[Row]:
+    """Newest-first page of summary columns, continuing after the (updated_at, id) keyset `after`.
+
+    Served from ix_document_records_updated_at_id, or ix_document_records_type_updated_at_id
+    when filtering by type, so deep pages cost the same as the first one.
+    """
+    stmt = select(*DOCUMENT_SUMMARY_COLUMNS)
+    if document_type is not None:
+        stmt = stmt.where(models.DocumentRecord.document_type == document_type)
+    if updated_from is not None:
+        stmt = stmt.where(models.DocumentRecord.updated_at >= updated_from)
+    if updated_to is not None:
+        stmt = stmt.where(models.DocumentRecord.updated_at < updated_to)
+    if after is not None:
+        # Typed explicitly: binds inside tuple_() don't pick up the column type, so they'd miss the SQLite storage format
+        after_updated_at = literal(after[0], type_=models.DocumentRecord.updated_at.type)
+        stmt = stmt.where(tuple_(models.DocumentRecord.updated_at, models.DocumentRecord.id) < tuple_(after_updated_at, after[1]))
+    stmt = stmt.order_by(models.DocumentRecord.updated_at.desc(), models.DocumentRecord.id.desc()).limit(limit)
+    return list((await db.execute(stmt)).all())
+
+def feature_index_rows(document_id: int, features: Optional[Dict[str, Optional[str]]]) -> List[dict]:
+    return [
+        {"document_id": document_id, "kind": kind, "field": field, "value": value}
+        for kind, field, value in index_entries(features)
+    ]
+
+async def insert_document_features(db: AsyncSession, db_records: Sequence[models.DocumentRecord]):
+    # Not committed here: index rows go in the same transaction as the documents they describe
+    rows = [row for db_record in db_records for row in feature_index_rows(db_record.id, db_record.features)]
+    if rows:
+        # Core insert on the table: these rows need no ORM state, and the ORM bulk path is much slower
+        await db.execute(insert(models.DocumentFeature.__table__), rows)
+
+def feature_condition(
+    kind: str,
+    fields: Sequence[str],
+    equals: Optional[str] = None,
+    one_of: Optional[Sequence[str]] = None,
+    prefix: Optional[str] = None,
+    value_from: Optional[str] = None,
+    value_to: Optional[str] = None,
+) -> Select:
+    """Ids of documents with a document_features row matching the given (normalized) value constraints."""
+    stmt = select(models.DocumentFeature.document_id).where(
+        models.DocumentFeature.kind == kind, models.DocumentFeature.field.in_(fields)
+    )
+    if equals is not None:
+        stmt = stmt.where(models.DocumentFeature.value == equals)
+    if one_of is not None:
+        stmt = stmt.where(models.DocumentFeature.value.in_(one_of))
+    if prefix is not None:
+        # A range rather than LIKE, so it is an index range scan on every backend
+        stmt = stmt.where(models.DocumentFeature.value >= prefix, models.DocumentFeature.value < prefix_upper_bound(prefix))
+    if value_from is not None:
+        stmt = stmt.where(models.DocumentFeature.value >= value_from)
+    if value_to is not None:
+        stmt = stmt.where(models.DocumentFeature.value <= value_to)
+    return stmt
+
+async def search_document_summaries(
+    db: AsyncSession,
+    conditions: Sequence[Select],
+    document_type: Optional[str] = None,
+    limit: int = 20,
+) -> List[Row]:
+    """Newest-first summaries of documents matching every feature_condition.
+
+    The conditions are intersected in one subquery over document_features. Without
+    a document_type filter the newest `limit` ids are picked there too, so a broad
+    match (a two-letter name prefix) reads `limit` document rows rather than all of them.
+    """
+    matching_ids = (conditions[0] if len(conditions) == 1 else intersect(*conditions)).subquery()
+    ids = select(matching_ids.c.document_id)
+    if document_type is None:
+        ids = ids.order_by(matching_ids.c.document_id.desc()).limit(limit)
+    stmt = select(*DOCUMENT_SUMMARY_COLUMNS).where(models.DocumentRecord.id.in_(ids))
+    if document_type is not None:
+        stmt = stmt.where(models.DocumentRecord.document_type == document_type)
+    stmt = stmt.order_by(models.DocumentRecord.id.desc()).limit(limit)
+    return list((await db.execute(stmt)).all())
+
+async def get_feature_tokens(db: AsyncSession, fields: Sequence[str], prefix: str, limit: int = 5000) -> List[str]:
+    """Distinct indexed name tokens starting with prefix (candidates for fuzzy matching)."""
+    stmt = (
+        select(models.DocumentFeature.value)
+        .where(
+            models.DocumentFeature.kind == "token",
+            models.DocumentFeature.field.in_(fields),
+            models.DocumentFeature.value >= prefix,
+            models.DocumentFeature.value < prefix_upper_bound(prefix),
+        )
+        .distinct()
+        .limit(limit)
+    )
+    return list((await db.scalars(stmt)).all())
+
+async def create_document_record(db: AsyncSession, record: schemas.DocumentRecordCreate) -> models.DocumentRecord:
     db_record = models.DocumentRecord(
         original_filename=record.original_filename,
-        image_base64=record.image_base64,
+        image_sha256=record.image_sha256,
+        image_mime_type=record.image_mime_type,
+        thumbnail_sha256=record.thumbnail_sha256,
         document_type=record.document_type,
-        features=record.features
+        features=record.features,
+        sources=record.sources
     )
     db.add(db_record)
-    db.commit()
-    db.refresh(db_record)
+    await db.flush()
+    await insert_document_features(db, [db_record])
+    await db.commit()
+    await db.refresh(db_record)
     return db_record
 
-def update_document_record(
-    db: Session, record_id: int, record_update: schemas.DocumentRecordUpdate
+async def create_document_records(db: AsyncSession, records: List[schemas.DocumentRecordCreate]) -> List[models.DocumentRecord]:
+    # One multi-row INSERT ... RETURNING and one commit for the whole group. Rows come back in records' order,
+    # which callers rely on to pair each record with its input
+    stmt = insert(models.DocumentRecord).returning(models.DocumentRecord, sort_by_parameter_order=True)
+    db_records = list((await db.scalars(stmt, [record.model_dump() for record in records])).all())
+    await insert_document_features(db, db_records)
+    await db.commit()
+    return db_records
+
+async def update_document_record(
+    db: AsyncSession, record_id: int, record_update: schemas.DocumentRecordUpdate
 ) -> Optional[models.DocumentRecord]:
-    db_record = get_document_record(db, record_id)
+    db_record = await get_document_record(db, record_id)
     if db_record:
         update_data = record_update.model_dump(exclude_unset=True)
+        # Values changed by hand are no longer any model's answer
+        sources = dict(db_record.sources or {})
+        if "document_type" in update_data and update_data["document_type"] != db_record.document_type:
+            sources["document_type"] = "manual"
+        for field_key, value in (update_data.get("features") or {}).items():
+            if value != (db_record.features or {}).get(field_key):
+                sources[field_key] = "manual"
         for key, value in update_data.items():
             setattr(db_record, key, value)
-        db.commit()
-        db.refresh(db_record)
+        if sources != (db_record.sources or {}):
+            db_record.sources = sources
+        if "features" in update_data:
+            await db.execute(delete(models.DocumentFeature).where(models.DocumentFeature.document_id == record_id))
+            await insert_document_features(db, [db_record])
+        await db.commit()
+        await db.refresh(db_record)
+    return db_record
+
+
+async def get_extraction_cache_entry(db: AsyncSession, cache_key: str) -> Optional[models.ExtractionCacheEntry]:
+    return await db.get(models.ExtractionCacheEntry, cache_key)
+
+async def upsert_extraction_cache_entry(
+    db: AsyncSession, cache_key: str, document_type: str, features: Dict[str, Optional[str]], sources: Dict[str, str]
+) -> models.ExtractionCacheEntry:
+    db_entry = await db.merge(models.ExtractionCacheEntry(
+        cache_key=cache_key, document_type=document_type, features=features, sources=sources
+    ))
+    await db.commit()
+    return db_entry
+
+async def delete_extraction_cache_entries(db: AsyncSession) -> int:
+    result = await db.execute(delete(models.ExtractionCacheEntry))
+    await db.commit()
+    return result.rowcount
+
+
+JOB_PENDING_STATUSES = ("queued", "running")
+
+async def create_job(
+    db: AsyncSession,
+    job_id: str,
+    original_filename: str,
+    image_sha256: str,
+    extraction_mode: str,
+    webhook_url: Optional[str] = None
+) -> models.Job:
+    db_job = models.Job(
+        id=job_id,
+        status="queued",
+        original_filename=original_filename,
+        image_sha256=image_sha256,
+        extraction_mode=extraction_mode,
+        webhook_url=webhook_url,
+        attempts=0,
+        next_attempt_at=datetime.now(timezone.utc)
+    )
+    db.add(db_job)
+    await db.commit()
+    await db.refresh(db_job)
+    return db_job
+
+async def get_job(db: AsyncSession, job_id: str) -> Optional[models.Job]:
+    return await db.get(models.Job, job_id)
+
+async def count_pending_jobs(db: AsyncSession) -> int:
+    return await db.scalar(select(func.count()).select_from(models.Job).where(models.Job.status.in_(JOB_PENDING_STATUSES)))
+
+async def claim_next_job(db: AsyncSession, lease_seconds: float) -> Optional[models.Job]:
+    """Atomically move the next due job to running under a lease, or return None if nothing is due.
+
+    Running jobs whose lease has lapsed were abandoned by a crashed worker and are claimed again.
+    The claim is a conditional UPDATE, so concurrent workers (in or across processes) never share a job.
+    """
+    now = datetime.now(timezone.utc)
+    claimable = or_(
+        and_(models.Job.status == "queued", models.Job.next_attempt_at <= now),
+        and_(models.Job.status == "running", models.Job.lease_expires_at < now),
+    )
+    while True:
+        job_id = await db.scalar(select(models.Job.id).where(claimable).order_by(models.Job.next_attempt_at).limit(1))
+        if job_id is None:
+            return None
+        stmt = (
+            update(models.Job)
+            .where(models.Job.id == job_id, claimable)
+            .values(status="running", attempts=models.Job.attempts + 1, lease_expires_at=now + timedelta(seconds=lease_seconds))
+            .returning(models.Job)
+        )
+        db_job = (await db.scalars(stmt, execution_options={"synchronize_session": False})).first()
+        await db.commit()
+        if db_job is not None:
+            return db_job
+        # Another worker claimed it between the SELECT and the UPDATE; try the next one
+
+def job_held(job_id: str, attempt: int):
+    """Matches the job only while it is still running the given attempt; a worker whose lease lapsed and
+    whose job was claimed again (bumping attempts) no longer matches."""
+    return and_(models.Job.id == job_id, models.Job.status == "running", models.Job.attempts == attempt)
+
+async def update_job(db: AsyncSession, job_id: str, attempt: int, **values) -> bool:
+    """Update a job held under the given attempt; False (and nothing written) if it is no longer held."""
+    result = await db.execute(update(models.Job).where(job_held(job_id, attempt)).values(**values))
+    await db.commit()
+    return result.rowcount > 0
+
+async def fail_job(db: AsyncSession, job_id: str, attempt: int, error: str) -> bool:
+    return await update_job(
+        db, job_id, attempt, status="failed", error=error, lease_expires_at=None, finished_at=datetime.now(timezone.utc)
+    )
+
+async def complete_job(
+    db: AsyncSession, job_id: str, attempt: int, record: schemas.DocumentRecordCreate, field_errors: Dict[str, str]
+) -> Optional[models.DocumentRecord]:
+    """Save the job's document and mark it succeeded, or return None (saving nothing) if it is no longer held."""
+    # The document and the job's success are committed together, so a crash can't leave one without the other
+    db_record = models.DocumentRecord(**record.model_dump())
+    db.add(db_record)
+    await db.flush()
+    await insert_document_features(db, [db_record])
+    result = await db.execute(
+        update(models.Job).where(job_held(job_id, attempt)).values(
+            status="succeeded",
+            document_type=record.document_type,
+            features=record.features,
+            field_errors=field_errors,
+            document_record_id=db_record.id,
+            error=None,
+            lease_expires_at=None,
+            finished_at=datetime.now(timezone.utc)
+        )
+    )
+    if result.rowcount == 0:
+        await db.rollback()
+        return None
+    await db.commit()
+    await db.refresh(db_record)
     return db_record
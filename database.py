@@ -1,18 +1,66 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./id_docs.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Async drivers used by the request path; the sync engine below is kept for
+# startup DDL, migrations and command-line scripts.
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for database backend '{backend}'")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+IS_SQLITE = make_url(DATABASE_URL).get_backend_name() == "sqlite"
+
 # For SQLite, connect_args={"check_same_thread": False} is needed because
 # FastAPI can use multiple threads to interact with the DB, and SQLite by default
 # only allows one thread.
-
 engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
+    DATABASE_URL, connect_args={"check_same_thread": False} if IS_SQLITE else {}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    to_async_url(DATABASE_URL),
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=not IS_SQLITE,
+)
+# expire_on_commit=False: attributes can't be lazily reloaded outside an await, so keep them after commit
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer; NORMAL sync is durable across
+    # application crashes in WAL mode and avoids an fsync per commit.
+    cursor = dbapi_connection.cursor()
+    # Only takes effect on a new, empty database; lets retention.py shrink the file without a full VACUUM
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+if IS_SQLITE:
+    event.listen(engine, "connect", configure_sqlite_connection)
+    event.listen(async_engine.sync_engine, "connect", configure_sqlite_connection)
+
 Base = declarative_base()
 
 # Dependency to get DB session
@@ -21,4 +69,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Dependency to get an async DB session (used by the request handlers)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
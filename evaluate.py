@@ -0,0 +1,364 @@
+"""Evaluate extraction accuracy, latency and token cost over a labelled image manifest.
+
+The manifest is a JSON list in the same shape as verify_classify.EXPECTED_DATA
+(file_path, expected_document_type, expected_features); without one, those
+three cases are used. Documents run concurrently, either in-process against
+the pipeline or over HTTP against a running server.
+
+In-process runs can record upstream responses to a cassette and replay them
+offline, which makes CI runs fast, free and deterministic:
+
+    OPENROUTER_API_KEY=... python evaluate.py --cassette eval_cassette.json --cassette-mode record
+    python evaluate.py --cassette eval_cassette.json --output report.json --compare previous.json
+    python evaluate.py --http http://localhost:8000
+
+Fields match when they are equal after trimming, collapsing whitespace and
+ignoring case. Over HTTP, pair the server with
+`benchmarks/fake_openrouter.py --cassette ...` to replay without a model.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Tokens used by the document being evaluated in the current task
+document_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("document_usage", default=None)
+
+
+def load_manifest(path: Optional[str]) -> List[Dict[str, Any]]:
+    if path is None:
+        from verify_classify import EXPECTED_DATA
+        return EXPECTED_DATA
+    with open(path) as f:
+        return json.load(f)
+
+
+def values_match(actual: Optional[str], expected: Optional[str]) -> bool:
+    if actual is None or expected is None:
+        return actual is expected
+    return " ".join(str(actual).split()).casefold() == " ".join(str(expected).split()).casefold()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class InProcessRunner:
+    def __init__(self, extraction_mode: Optional[str], cassette_path: Optional[str], cassette_mode: str):
+        # Scratch database and blob store unless the caller chose their own
+        scratch = tempfile.mkdtemp(prefix="evaluate-")
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{scratch}/evaluate.db")
+        os.environ.setdefault("BLOB_STORE_DIR", os.path.join(scratch, "blobs"))
+        if cassette_path and cassette_mode == "replay":
+            os.environ.setdefault("OPENROUTER_API_KEY", "cassette-replay")
+        import logging
+        import migrations
+        import server
+        from cassette import Cassette
+
+        logging.getLogger("server").setLevel(logging.WARNING)
+        migrations.setup_schema(server.engine)
+        self.server = server
+        self.extraction_mode = extraction_mode
+        self.cassette = Cassette(cassette_path, cassette_mode) if cassette_path else None
+
+        create = server.client.chat.completions.create
+        if self.cassette is not None:
+            create = self.cassette.wrap(create)
+
+        async def tracked_create(**params):
+            completion = await create(**params)
+            usage, totals = getattr(completion, "usage", None), document_usage.get()
+            if usage is not None and totals is not None:
+                totals["prompt_tokens"] += usage.prompt_tokens or 0
+                totals["completion_tokens"] += usage.completion_tokens or 0
+            return completion
+
+        server.client.chat.completions.create = tracked_create
+
+    async def run(self, filename: str, contents: bytes) -> Dict[str, Any]:
+        prepared_image = await self.server.prepare_image(contents)
+        document, field_errors = await self.server.extract_document(
+            filename, prepared_image, self.extraction_mode, cache="bypass"
+        )
+        return {
+            "document_type": document.document_type,
+            "features": document.features,
+            "field_errors": field_errors,
+            "sources": document.sources,
+        }
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "transport": "in_process",
+            "model": self.server.MODEL_NAME,
+            "model_cascade": self.server.MODEL_CASCADE,
+            "extraction_mode": self.extraction_mode or self.server.EXTRACTION_MODE,
+            "config_fingerprint": self.server.CONFIG_FINGERPRINT,
+            "cassette": {"path": self.cassette.path, "mode": self.cassette.mode, **self.cassette.stats}
+            if self.cassette else None,
+        }
+
+    async def close(self):
+        if self.cassette is not None and self.cassette.stats["recorded"]:
+            self.cassette.save()
+        await self.server.client.close()
+        self.server.image_executor.shutdown(wait=False)
+        await self.server.async_engine.dispose()
+
+
+class HttpRunner:
+    def __init__(self, base_url: str, extraction_mode: Optional[str], timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.extraction_mode = extraction_mode
+        self.client = httpx.AsyncClient(base_url=self.base_url, timeout=timeout)
+
+    async def run(self, filename: str, contents: bytes) -> Dict[str, Any]:
+        params = {"cache": "bypass"}
+        if self.extraction_mode:
+            params["extraction_mode"] = self.extraction_mode
+        response = await self.client.post("/classify", params=params, files={"image": (filename, contents)})
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+        body = response.json()
+        return {
+            "document_type": body["document_type"],
+            "features": body["features"],
+            "field_errors": body.get("field_errors", {}),
+            "sources": body.get("sources") or {},
+        }
+
+    async def token_totals(self) -> Dict[str, int]:
+        # Per-run totals from the server's /metrics; per-document usage isn't visible over HTTP
+        totals = {"prompt_tokens": 0, "completion_tokens": 0}
+        try:
+            text = (await self.client.get("/metrics")).text
+        except httpx.HTTPError:
+            return totals
+        for line in text.splitlines():
+            for kind in ("prompt", "completion"):
+                if line.startswith(f'idclassifier_upstream_tokens_total{{kind="{kind}"}}'):
+                    totals[f"{kind}_tokens"] = int(float(line.split()[-1]))
+        return totals
+
+    def describe(self) -> Dict[str, Any]:
+        return {"transport": "http", "base_url": self.base_url, "extraction_mode": self.extraction_mode or "server default"}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+async def evaluate_case(runner, case: Dict[str, Any], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    path = case["file_path"] if os.path.isabs(case["file_path"]) else os.path.join(REPO_ROOT, case["file_path"])
+    with open(path, "rb") as f:
+        contents = f.read()
+    usage = {"prompt_tokens": 0, "completion_tokens": 0}
+    document_usage.set(usage)
+    result = {"file_path": case["file_path"], "expected_document_type": case["expected_document_type"]}
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            output = await runner.run(os.path.basename(path), contents)
+        except Exception as e:
+            output = None
+            result["error"] = getattr(e, "detail", None) or str(e) or type(e).__name__
+        result["latency_seconds"] = time.perf_counter() - start
+    result["usage"] = usage if isinstance(runner, InProcessRunner) else None
+    if output is None:
+        # A failed document counts against every field it should have produced
+        result["fields"] = {
+            field_key: {"expected": expected, "actual": None, "correct": False, "error": result["error"]}
+            for field_key, expected in case["expected_features"].items()
+        }
+        return result
+
+    result["document_type"] = output["document_type"]
+    result["document_type_correct"] = output["document_type"] == case["expected_document_type"]
+    result["fields"] = {
+        field_key: {
+            "expected": expected,
+            "actual": output["features"].get(field_key),
+            "correct": result["document_type_correct"] and values_match(output["features"].get(field_key), expected),
+            "error": output["field_errors"].get(field_key),
+            "source": output["sources"].get(field_key),
+        }
+        for field_key, expected in case["expected_features"].items()
+    }
+    return result
+
+
+def summarize(results: List[Dict[str, Any]], token_totals: Dict[str, int]) -> Dict[str, Any]:
+    completed = [result for result in results if "error" not in result]
+    per_field: Dict[str, Dict[str, int]] = defaultdict(lambda: {"correct": 0, "total": 0})
+    for result in results:
+        for field_key, outcome in result.get("fields", {}).items():
+            counts = per_field[f"{result['expected_document_type']}.{field_key}"]
+            counts["total"] += 1
+            counts["correct"] += outcome["correct"]
+    failed = [result for result in results if "error" in result]
+    field_total = sum(counts["total"] for counts in per_field.values())
+    field_correct = sum(counts["correct"] for counts in per_field.values())
+    latencies = [result["latency_seconds"] for result in completed]
+    per_type_tokens: Dict[str, List[int]] = defaultdict(list)
+    for result in completed:
+        if result["usage"] is not None:
+            per_type_tokens[result["expected_document_type"]].append(
+                result["usage"]["prompt_tokens"] + result["usage"]["completion_tokens"]
+            )
+    return {
+        "documents": len(results),
+        "errors": len(failed),
+        "document_type_accuracy": sum(result.get("document_type_correct", False) for result in results) / len(results),
+        "field_accuracy": field_correct / field_total if field_total else None,
+        "latency_p50_seconds": percentile(latencies, 0.5),
+        "latency_p95_seconds": percentile(latencies, 0.95),
+        "prompt_tokens": token_totals["prompt_tokens"],
+        "completion_tokens": token_totals["completion_tokens"],
+        "tokens_per_document": (token_totals["prompt_tokens"] + token_totals["completion_tokens"]) / len(completed)
+        if completed else None,
+        "tokens_per_document_by_type": {
+            document_type: statistics.mean(tokens) for document_type, tokens in sorted(per_type_tokens.items())
+        },
+        "fields": {
+            name: {**counts, "accuracy": counts["correct"] / counts["total"]} for name, counts in sorted(per_field.items())
+        },
+    }
+
+
+def format_number(value: Optional[float], spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def print_report(report: Dict[str, Any], previous: Optional[Dict[str, Any]]):
+    summary = report["summary"]
+    before = previous["summary"] if previous else {}
+
+    def delta(key: str, spec: str) -> str:
+        if key not in before or before[key] is None or summary[key] is None:
+            return ""
+        return f"  ({summary[key] - before[key]:+{spec}} vs {previous['run'].get('git_commit') or 'previous'})"
+
+    print(f"\n{'document':<28} {'type':<16} {'ok':>3} {'fields':>7} {'latency':>9} {'tokens':>7}")
+    for result in report["documents"]:
+        fields = result.get("fields", {})
+        correct = sum(outcome["correct"] for outcome in fields.values())
+        tokens = result["usage"]["prompt_tokens"] + result["usage"]["completion_tokens"] if result["usage"] else None
+        status = "ERR" if "error" in result else ("yes" if result["document_type_correct"] else "no")
+        print(
+            f"{os.path.basename(result['file_path']):<28} {result.get('document_type') or '-':<16} {status:>3} "
+            f"{correct:>3}/{len(fields):<3} {result['latency_seconds'] * 1000:>7.0f}ms {format_number(tokens, 'd'):>7}"
+        )
+        if "error" in result:
+            print(f"    error: {result['error']}")
+
+    print(f"\n{'field':<40} {'accuracy':>9} {'previous':>9}")
+    previous_fields = before.get("fields", {})
+    for name, counts in summary["fields"].items():
+        old = previous_fields.get(name, {}).get("accuracy")
+        marker = "" if old is None or old == counts["accuracy"] else ("  improved" if counts["accuracy"] > old else "  REGRESSED")
+        print(f"{name:<40} {counts['correct']:>3}/{counts['total']:<3}  {format_number(old, '.2f'):>9}{marker}")
+
+    print(
+        f"\ndocuments: {summary['documents']}, errors: {summary['errors']}\n"
+        f"document type accuracy: {summary['document_type_accuracy']:.3f}{delta('document_type_accuracy', '.3f')}\n"
+        f"field accuracy: {format_number(summary['field_accuracy'], '.3f')}{delta('field_accuracy', '.3f')}\n"
+        f"latency p50/p95: {format_number(summary['latency_p50_seconds'], '.2f')}s / "
+        f"{format_number(summary['latency_p95_seconds'], '.2f')}s{delta('latency_p50_seconds', '.2f')}\n"
+        f"tokens: {summary['prompt_tokens']} prompt + {summary['completion_tokens']} completion, "
+        f"{format_number(summary['tokens_per_document'], '.0f')} per document{delta('tokens_per_document', '.0f')}"
+    )
+    for document_type, tokens in summary["tokens_per_document_by_type"].items():
+        print(f"  {document_type}: {tokens:.0f} tokens per document")
+
+
+async def main(args) -> int:
+    manifest = load_manifest(args.manifest)
+    if args.http:
+        runner = HttpRunner(args.http, args.extraction_mode, args.timeout)
+        tokens_before = await runner.token_totals()
+    else:
+        runner = InProcessRunner(args.extraction_mode, args.cassette, args.cassette_mode)
+        tokens_before = None
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    start = time.perf_counter()
+    try:
+        results = list(await asyncio.gather(*(evaluate_case(runner, case, semaphore) for case in manifest)))
+        elapsed = time.perf_counter() - start
+        if tokens_before is not None:
+            tokens_after = await runner.token_totals()
+            token_totals = {kind: tokens_after[kind] - tokens_before[kind] for kind in tokens_after}
+        else:
+            token_totals = {
+                kind: sum(result["usage"][kind] for result in results) for kind in ("prompt_tokens", "completion_tokens")
+            }
+        run = {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "manifest": args.manifest or "verify_classify.EXPECTED_DATA",
+            "concurrency": args.concurrency,
+            "elapsed_seconds": elapsed,
+            **runner.describe(),
+        }
+    finally:
+        await runner.close()
+
+    report = {"run": run, "summary": summarize(results, token_totals), "documents": results}
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(report, previous)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+    field_accuracy = report["summary"]["field_accuracy"] or 0.0
+    if args.min_field_accuracy is not None and field_accuracy < args.min_field_accuracy:
+        print(f"Field accuracy {field_accuracy:.3f} is below --min-field-accuracy {args.min_field_accuracy}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--manifest", help="JSON list of {file_path, expected_document_type, expected_features}")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--extraction-mode", choices=["per_field", "single_call"])
+    parser.add_argument("--http", metavar="BASE_URL", help="evaluate a running server instead of the in-process pipeline")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout with --http")
+    parser.add_argument("--cassette", help="cassette file for recording/replaying upstream responses (in-process only)")
+    parser.add_argument("--cassette-mode", choices=["replay", "record", "auto"], default="replay")
+    parser.add_argument("--output", help="write the machine-readable report here")
+    parser.add_argument("--compare", help="a previous --output report to diff against")
+    parser.add_argument("--min-field-accuracy", type=float, help="exit non-zero below this field accuracy")
+    args = parser.parse_args()
+    if args.http and args.cassette:
+        parser.error("--cassette works in-process; over HTTP, run the server against fake_openrouter.py --cassette")
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,203 @@
+"""Streaming export of document records as NDJSON or CSV, for downstream systems.
+
+Records are read in id order, one bounded keyset batch (its own short query)
+at a time, so memory stays flat however big the table is and no read
+transaction is held open for the whole export. Images are left out unless
+asked for; when included they are read from the blob store batch by batch.
+
+    python export.py --format csv [--output documents.csv] [--document-type passport] [--include-images] [--batch-size 500]
+"""
+import argparse
+import base64
+import csv
+import io
+import json
+import logging
+import sys
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from sqlalchemy import Select, select
+from sqlalchemy.orm import Session
+
+import models
+from blobstore import BlobStore
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_BATCH_SIZE = 500
+# With images a row is an image, so batches are capped to keep each one a few MiB
+EXPORT_IMAGE_BATCH_SIZE = 50
+
+EXPORT_COLUMNS = (
+    models.DocumentRecord.id,
+    models.DocumentRecord.original_filename,
+    models.DocumentRecord.document_type,
+    models.DocumentRecord.features,
+    models.DocumentRecord.sources,
+    models.DocumentRecord.image_sha256,
+    models.DocumentRecord.image_mime_type,
+    models.DocumentRecord.created_at,
+    models.DocumentRecord.updated_at,
+)
+# Scalar columns, in CSV order; the configured feature fields follow them
+CSV_COLUMNS = ("id", "original_filename", "document_type", "image_sha256", "image_mime_type", "created_at", "updated_at")
+
+
+def export_batch_query(
+    after_id: int, batch_size: int, document_type: Optional[str] = None, include_images: bool = False
+) -> Select:
+    columns = EXPORT_COLUMNS + ((models.DocumentRecord.image_base64,) if include_images else ())
+    stmt = select(*columns).where(models.DocumentRecord.id > after_id)
+    if document_type is not None:
+        stmt = stmt.where(models.DocumentRecord.document_type == document_type)
+    return stmt.order_by(models.DocumentRecord.id).limit(batch_size)
+
+
+def iter_export_batches(
+    db: Session, batch_size: int = EXPORT_BATCH_SIZE, document_type: Optional[str] = None, include_images: bool = False
+) -> Iterator[List[Dict[str, Any]]]:
+    if include_images:
+        batch_size = min(batch_size, EXPORT_IMAGE_BATCH_SIZE)
+    after_id = 0
+    while True:
+        batch = db.execute(export_batch_query(after_id, batch_size, document_type, include_images)).mappings().all()
+        db.rollback() # End the read transaction between batches
+        if not batch:
+            return
+        after_id = batch[-1]["id"]
+        yield [dict(row) for row in batch]
+
+
+async def aiter_export_batches(
+    session_factory, batch_size: int = EXPORT_BATCH_SIZE, document_type: Optional[str] = None, include_images: bool = False
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """The same batches from an async session_factory; each batch gets its own short-lived session."""
+    if include_images:
+        batch_size = min(batch_size, EXPORT_IMAGE_BATCH_SIZE)
+    after_id = 0
+    while True:
+        async with session_factory() as db:
+            batch = (await db.execute(export_batch_query(after_id, batch_size, document_type, include_images))).mappings().all()
+        if not batch:
+            return
+        after_id = batch[-1]["id"]
+        yield [dict(row) for row in batch]
+
+
+def attach_images(batch: List[Dict[str, Any]], blob_store: BlobStore):
+    """Replace each row's image reference with the base64 image itself. Blocking; reads the blob store."""
+    for row in batch:
+        legacy_image = row.pop("image_base64", None)
+        image_bytes = blob_store.get(row["image_sha256"]) if row["image_sha256"] else None
+        if image_bytes is not None:
+            row["image_base64"] = base64.b64encode(image_bytes).decode("ascii")
+        else:
+            # Rows not yet moved by `migrations.py migrate-image-blobs` still carry a data: URL inline
+            row["image_base64"] = (legacy_image.partition(",")[2] or legacy_image) if legacy_image else None
+
+
+def timestamp(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+class ExportWriter:
+    """Turns row batches into chunks of NDJSON lines or CSV text."""
+
+    def __init__(self, export_format: str, feature_fields: Sequence[str], include_images: bool = False):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{export_format}'; expected one of {EXPORT_FORMATS}")
+        self.export_format = export_format
+        self.feature_fields = list(feature_fields)
+        self.include_images = include_images
+
+    def header(self) -> str:
+        if self.export_format != "csv":
+            return ""
+        columns = list(CSV_COLUMNS) + self.feature_fields + (["image_base64"] if self.include_images else [])
+        return self._csv_lines([columns])
+
+    def batch(self, batch: List[Dict[str, Any]]) -> str:
+        if self.export_format == "ndjson":
+            return "".join(json.dumps(self._serializable(row)) + "\n" for row in batch)
+        return self._csv_lines([self._csv_record(row) for row in batch])
+
+    @staticmethod
+    def _serializable(row: Dict[str, Any]) -> Dict[str, Any]:
+        return {**row, "created_at": timestamp(row["created_at"]), "updated_at": timestamp(row["updated_at"])}
+
+    def _csv_record(self, row: Dict[str, Any]) -> List[Any]:
+        values = self._serializable(row)
+        record = [values[column] for column in CSV_COLUMNS]
+        # Fields of other document types are left empty
+        record += [(row["features"] or {}).get(field_key) for field_key in self.feature_fields]
+        if self.include_images:
+            record.append(row["image_base64"])
+        return record
+
+    @staticmethod
+    def _csv_lines(records: List[List[Any]]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(records)
+        return buffer.getvalue()
+
+
+def configured_feature_fields(feature_extraction_config: Dict[str, dict]) -> List[str]:
+    """Every configured field once, in config order, for the CSV columns."""
+    return list(dict.fromkeys(field_key for config in feature_extraction_config.values() for field_key in config["fields"]))
+
+
+def export_documents(
+    db: Session,
+    output,
+    export_format: str,
+    feature_fields: Sequence[str],
+    blob_store: Optional[BlobStore] = None,
+    document_type: Optional[str] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> int:
+    """Write every document to the text stream output; images are included when blob_store is given."""
+    writer = ExportWriter(export_format, feature_fields, include_images=blob_store is not None)
+    output.write(writer.header())
+    exported = 0
+    for batch in iter_export_batches(db, batch_size, document_type, include_images=blob_store is not None):
+        if blob_store is not None:
+            attach_images(batch, blob_store)
+        output.write(writer.batch(batch))
+        exported += len(batch)
+    return exported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--output", help="File to write (default: stdout)")
+    parser.add_argument("--document-type")
+    parser.add_argument("--include-images", action="store_true", help="Add each normalized image as base64")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    from blobstore import BLOB_STORE_DIR
+    from database import SessionLocal
+    from server import FEATURE_EXTRACTION_CONFIG
+
+    output = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    db = SessionLocal()
+    try:
+        count = export_documents(
+            db,
+            output,
+            args.format,
+            configured_feature_fields(FEATURE_EXTRACTION_CONFIG),
+            blob_store=BlobStore(BLOB_STORE_DIR) if args.include_images else None,
+            document_type=args.document_type,
+            batch_size=args.batch_size,
+        )
+    finally:
+        db.close()
+        if output is not sys.stdout:
+            output.close()
+    logger.info(f"Exported {count} document(s)")
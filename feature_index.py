@@ -0,0 +1,90 @@
+"""Searchable index rows derived from a document's extracted features.
+
+Each document gets rows in the document_features table, keyed (kind, field, value):
+- "value": the whole normalized value of every field, for exact matches on identifiers
+- "token": each word of a name field, for prefix and fuzzy name search
+- "date": date fields parsed to ISO YYYY-MM-DD, for range queries (ISO strings sort as dates)
+
+Normalization folds case, strips accents and drops everything but letters and
+digits, so "D123-456 789" matches "d123456789" and "O'Brien" matches "obrien".
+"""
+import difflib
+import re
+import unicodedata
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+NAME_FIELDS = ("full_name", "first_name", "last_name")
+DATE_FIELDS = ("date_of_birth", "issue_date", "expiration_date", "card_expires_date")
+EXPIRATION_FIELDS = ("expiration_date", "card_expires_date")
+IDENTIFIER_FIELDS = ("license_number", "card_number")
+
+# Formats the model returns despite being asked for YYYY-MM-DD
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d %b %Y", "%d %B %Y", "%b %d, %Y", "%B %d, %Y", "%Y/%m/%d")
+
+IndexEntry = Tuple[str, str, str]  # (kind, field, value)
+
+
+NON_ALPHANUMERIC_ASCII = re.compile(r"[^0-9A-Za-z]+")
+
+
+def normalize(value: str) -> str:
+    if value.isascii():
+        return NON_ALPHANUMERIC_ASCII.sub("", value).lower()
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(char for char in decomposed if char.isalnum()).casefold()
+
+
+def name_tokens(value: str) -> List[str]:
+    return [token for token in (normalize(part) for part in re.split(r"[\s,\-/]+", value)) if token]
+
+
+def parse_date(value: str) -> Optional[str]:
+    cleaned = value.strip()
+    try:
+        # The common case, and far cheaper than strptime
+        return date.fromisoformat(cleaned).isoformat()
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(cleaned, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def index_entries(features: Optional[Dict[str, Optional[str]]]) -> Iterator[IndexEntry]:
+    seen = set()
+    for field, value in (features or {}).items():
+        if not value or not isinstance(value, str):
+            continue
+        entries = [("value", field, normalize(value))]
+        if field in NAME_FIELDS:
+            entries.extend(("token", field, token) for token in name_tokens(value))
+        if field in DATE_FIELDS:
+            entries.append(("date", field, parse_date(value)))
+        for entry in entries:
+            # Rows are unique per document; "Anna Anna" indexes the token once
+            if entry[2] and entry not in seen:
+                seen.add(entry)
+                yield entry
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    """Exclusive upper bound for strings starting with prefix, for index range scans."""
+    return prefix + "\U0010ffff"
+
+
+def similar_tokens(term: str, candidates: List[str], min_similarity: float) -> List[str]:
+    """Candidates that start with term or are within min_similarity of it (difflib ratio)."""
+    matcher = difflib.SequenceMatcher(b=term)
+    similar = []
+    for candidate in candidates:
+        if candidate.startswith(term):
+            similar.append(candidate)
+            continue
+        matcher.set_seq1(candidate)
+        if matcher.real_quick_ratio() >= min_similarity and matcher.ratio() >= min_similarity:
+            similar.append(candidate)
+    return similar
@@ -0,0 +1,52 @@
+"""Format checks on extracted values; the model cascade escalates a field whose value fails one."""
+import re
+from datetime import date
+from typing import Callable, Dict
+
+from feature_index import DATE_FIELDS
+
+# ISO 3166-1 alpha-3
+ISO_ALPHA3_CODES = frozenset("""
+    ABW AFG AGO AIA ALA ALB AND ARE ARG ARM ASM ATA ATF ATG AUS AUT AZE BDI BEL BEN BES BFA BGD BGR BHR BHS BIH
+    BLM BLR BLZ BMU BOL BRA BRB BRN BTN BVT BWA CAF CAN CCK CHE CHL CHN CIV CMR COD COG COK COL COM CPV CRI CUB
+    CUW CXR CYM CYP CZE DEU DJI DMA DNK DOM DZA ECU EGY ERI ESH ESP EST ETH FIN FJI FLK FRA FRO FSM GAB GBR GEO
+    GGY GHA GIB GIN GLP GMB GNB GNQ GRC GRD GRL GTM GUF GUM GUY HKG HMD HND HRV HTI HUN IDN IMN IND IOT IRL IRN
+    IRQ ISL ISR ITA JAM JEY JOR JPN KAZ KEN KGZ KHM KIR KNA KOR KWT LAO LBN LBR LBY LCA LIE LKA LSO LTU LUX LVA
+    MAC MAF MAR MCO MDA MDG MDV MEX MHL MKD MLI MLT MMR MNE MNG MNP MOZ MRT MSR MTQ MUS MWI MYS MYT NAM NCL NER
+    NFK NGA NIC NIU NLD NOR NPL NRU NZL OMN PAK PAN PCN PER PHL PLW PNG POL PRI PRK PRT PRY PSE PYF QAT REU ROU
+    RUS RWA SAU SDN SEN SGP SGS SHN SJM SLB SLE SLV SMR SOM SPM SRB SSD STP SUR SVK SVN SWE SWZ SXM SYC SYR TCA
+    TCD TGO THA TJK TKL TKM TLS TON TTO TUN TUR TUV TWN TZA UGA UKR UMI URY USA UZB VAT VCT VEN VGB VIR VNM VUT
+    WLF WSM YEM ZAF ZMB ZWE
+""".split())
+
+# Codes ICAO Doc 9303 uses on travel documents besides ISO 3166-1: Germany is "D" (padded "D<<" in the MRZ),
+# plus British nationality variants, Kosovo, the EU, UN bodies and the stateless/unspecified codes
+ICAO_NATIONALITY_CODES = frozenset("""
+    D D<< GBD GBN GBO GBP GBS RKS EUE UNO UNA UNK XOM XPO XXA XXB XXC XXX
+""".split())
+
+# EAD eligibility category as printed on the card: a letter, two digits and sometimes a suffix (C09, A05, C03C)
+EAD_CATEGORY_PATTERN = re.compile(r"[ABC]\d{2}[A-Z]?")
+
+
+def is_iso_date(value: str) -> bool:
+    if len(value) != 10:
+        return False
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+FIELD_VALIDATORS: Dict[str, Callable[[str], bool]] = {
+    **{field_key: is_iso_date for field_key in DATE_FIELDS},
+    "country": lambda value: value in ISO_ALPHA3_CODES or value in ICAO_NATIONALITY_CODES,
+    "category": lambda value: EAD_CATEGORY_PATTERN.fullmatch(value) is not None,
+}
+
+
+def is_valid(field_key: str, value: str) -> bool:
+    """Fields without a validator accept any value."""
+    validator = FIELD_VALIDATORS.get(field_key)
+    return validator is None or validator(value)
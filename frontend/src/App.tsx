@@ -1,4 +1,4 @@
-import React, { useState, useEffect, ChangeEvent, FormEvent } from 'react';
+import React, { useState, useEffect, useRef, ChangeEvent, FormEvent } from 'react';
 import './App.css';
 
 // --- Interfaces ---
@@ -10,17 +10,47 @@ interface ExtractedFeatures {
 interface DocumentRecord {
   id: number;
   original_filename: string;
-  image_base64: string; // This is the data URL (e.g., "data:image/png;base64,...")
+  image_sha256: string | null; // Image is served from /documents/{id}/image and /documents/{id}/thumbnail
   document_type: string;
   features: ExtractedFeatures;
   created_at: string; // ISO date string
   updated_at: string; // ISO date string
 }
 
+// Fields from /classify/stream, shown while extraction is still running
+interface StreamingExtraction {
+  document_type: string | null;
+  features: ExtractedFeatures;
+}
+
 const API_BASE_URL = "http://localhost:8000";
 const NOT_FOUND_PLACEHOLDER_DISPLAY = "N/A";
 const HISTORY_LIMIT = 5;
 
+// Calls onEvent for each Server-Sent Event in a fetch response body (EventSource can't POST a file)
+async function readServerSentEvents(response: Response, onEvent: (event: string, data: any) => void) {
+  const reader = response.body!.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = "message";
+      let data = "";
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
 function App() {
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
   const [localImagePreviewUrl, setLocalImagePreviewUrl] = useState<string | null>(null); // For preview of unsaved file
@@ -35,6 +65,21 @@ function App() {
   const [successMessage, setSuccessMessage] = useState<string | null>(null);
   
   const [history, setHistory] = useState<DocumentRecord[]>([]);
+  const [streamingExtraction, setStreamingExtraction] = useState<StreamingExtraction | null>(null);
+  // Aborting the request closes the stream, which makes the server cancel its remaining model calls
+  const extractionAbortRef = useRef<AbortController | null>(null);
+
+  const abortExtraction = () => {
+    if (extractionAbortRef.current) {
+      extractionAbortRef.current.abort();
+      extractionAbortRef.current = null;
+      setIsLoading(false);
+    }
+    setStreamingExtraction(null);
+  };
+
+  // Don't keep paying for an extraction nobody will see
+  useEffect(() => () => extractionAbortRef.current?.abort(), []);
 
   // Fetch initial history
   useEffect(() => {
@@ -45,7 +90,7 @@ function App() {
   useEffect(() => {
     if (currentDocument) {
       setEditedFeatures({ ...currentDocument.features });
-      // Image for currentDocument is its image_base64, not local preview
+      // Image for currentDocument is served by the API, not local preview
       setLocalImagePreviewUrl(null); // Clear local preview if a document is loaded
     } else {
       // If currentDocument is cleared, clear edited features
@@ -68,6 +113,7 @@ function App() {
   };
 
   const resetToUploadState = () => {
+    abortExtraction();
     setSelectedFile(null);
     setLocalImagePreviewUrl(null);
     setCurrentDocument(null); // This will clear editedFeatures via useEffect
@@ -97,6 +143,7 @@ function App() {
   const handleFileChange = (event: ChangeEvent<HTMLInputElement>) => {
     // When a new file is selected, we are in "new upload" mode.
     // Clear any currently loaded document.
+    abortExtraction();
     setCurrentDocument(null);
     setEditedFeatures(null);
     clearMessages();
@@ -126,11 +173,15 @@ function App() {
 
     const formData = new FormData();
     formData.append('image', selectedFile);
+    const abortController = new AbortController();
+    extractionAbortRef.current = abortController;
+    setStreamingExtraction({ document_type: null, features: {} });
 
     try {
-      const response = await fetch(`${API_BASE_URL}/classify`, {
+      const response = await fetch(`${API_BASE_URL}/classify/stream`, {
         method: 'POST',
         body: formData,
+        signal: abortController.signal,
       });
 
       if (!response.ok) {
@@ -138,7 +189,23 @@ function App() {
         throw new Error(errorData.detail || `API Error: ${response.statusText}`);
       }
 
-      const newDocument: DocumentRecord = await response.json();
+      const result: { document?: DocumentRecord; error?: string } = {};
+      await readServerSentEvents(response, (eventName, data) => {
+        if (eventName === 'document_type') {
+          setStreamingExtraction(prev => prev && { ...prev, document_type: data.document_type });
+        } else if (eventName === 'field') {
+          setStreamingExtraction(prev => prev && { ...prev, features: { ...prev.features, [data.field]: data.value } });
+        } else if (eventName === 'document') {
+          result.document = data;
+        } else if (eventName === 'error') {
+          result.error = data.detail;
+        }
+      });
+      if (!result.document) {
+        throw new Error(result.error || 'Extraction stream ended early');
+      }
+      const newDocument = result.document;
+      setStreamingExtraction(null);
       setCurrentDocument(newDocument); // This will set editedFeatures via useEffect
       setSuccessMessage(`Document "${newDocument.original_filename}" processed and saved! ID: ${newDocument.id}`);
       fetchHistory(); // Refresh history
@@ -147,10 +214,15 @@ function App() {
       // localImagePreviewUrl is already null because currentDocument is set
 
     } catch (err: any) {
+      if (err.name === 'AbortError') return; // Cancelled by the user; they've moved on
+      setStreamingExtraction(null);
       setError(`Extraction Error: ${err.message}`);
       console.error("Extraction error:", err);
     } finally {
-      setIsLoading(false);
+      if (extractionAbortRef.current === abortController) {
+        extractionAbortRef.current = null;
+        setIsLoading(false);
+      }
     }
   };
 
@@ -218,7 +290,7 @@ function App() {
   };
 
   // Determine which image URL to show: local preview or from currentDocument
-  const displayImageUrl = localImagePreviewUrl || (currentDocument ? currentDocument.image_base64 : null);
+  const displayImageUrl = localImagePreviewUrl || (currentDocument ? `${API_BASE_URL}/documents/${currentDocument.id}/image` : null);
 
   return (
     <div className="App">
@@ -252,6 +324,27 @@ function App() {
             {selectedFile && !currentDocument && <p className="filename-display">New Upload: {selectedFile.name}</p>}
           </section>
 
+          {streamingExtraction && !currentDocument && (
+            <section className="extraction-results-section">
+              <h2>Extracting...</h2>
+              <p><strong>Document Type:</strong> {streamingExtraction.document_type ? streamingExtraction.document_type.replace(/_/g, ' ').toUpperCase() : 'Classifying...'}</p>
+              <div className="features-grid">
+                {Object.entries(streamingExtraction.features).map(([key, value]) => (
+                  <div key={key} className="feature-item">
+                    <label htmlFor={`feature-${key}`}>{key.replace(/_/g, ' ')}:</label>
+                    <input
+                      type="text"
+                      id={`feature-${key}`}
+                      value={value === null ? NOT_FOUND_PLACEHOLDER_DISPLAY : value}
+                      readOnly
+                      className={value === null ? 'not-found' : ''}
+                    />
+                  </div>
+                ))}
+              </div>
+            </section>
+          )}
+
           {currentDocument && editedFeatures && (
             <section className="extraction-results-section">
               <h2>Extracted Fields</h2>
@@ -288,7 +381,7 @@ function App() {
             <div className="history-grid">
               {history.map((item) => (
                 <div key={item.id} className={`history-item ${currentDocument?.id === item.id ? 'active' : ''}`} onClick={() => handleLoadFromHistory(item)}>
-                  <img src={item.image_base64} alt={item.original_filename} />
+                  <img src={`${API_BASE_URL}/documents/${item.id}/thumbnail`} alt={item.original_filename} loading="lazy" />
                   <p><strong>ID: {item.id}</strong></p>
                   <p><strong>Type:</strong> {item.document_type.replace(/_/g, ' ')}</p>
                   <p title={item.original_filename}>
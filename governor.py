@@ -0,0 +1,401 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import openai
+
+from cassette import CassetteMissError
+from shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth another attempt; anything else 4xx is the request's fault and fails the same way again
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Upstream circuit open after repeated failures; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second refill up to `capacity`. A rate of 0 disables it."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _take(self, amount: float) -> float:
+        """Take amount and return 0 if the bucket holds it, else return the seconds until it will."""
+        self._refill()
+        if self.tokens < amount:
+            return (amount - self.tokens) / self.rate
+        self.tokens -= amount
+        return 0.0
+
+    async def acquire(self, amount: float = 1.0):
+        if self.rate <= 0:
+            return
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        # Waiters are served in arrival order, so a large request isn't starved by a stream of small ones
+        async with self._lock:
+            while (wait := self._take(amount)) > 0:
+                await asyncio.sleep(wait)
+
+    def try_acquire(self, amount: float = 1.0) -> bool:
+        if self.rate <= 0:
+            return True
+        if self._lock.locked():
+            return False
+        # Capped like acquire(), or a request larger than the bucket could never be taken
+        return self._take(min(amount, self.capacity)) == 0
+
+    def adjust(self, amount: float):
+        """Return over-reserved tokens (positive) or charge for under-reserved ones (negative)."""
+        if self.rate > 0:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class SharedTokenBucket(TokenBucket):
+    """A TokenBucket whose level lives in SharedState, so every worker process draws from the same bucket.
+
+    Arrival order is kept within a process; between processes, whoever asks after a refill wins.
+    """
+
+    def __init__(self, rate: float, capacity: float, state: SharedState, slot_prefix: str):
+        super().__init__(rate, capacity)
+        self.state = state
+        self._tokens_slot = f"{slot_prefix}_tokens"
+        self._updated_at_slot = f"{slot_prefix}_updated_at"
+
+    @contextmanager
+    def _shared(self):
+        with self.state.locked():
+            self.tokens = self.state.get(self._tokens_slot)
+            self.updated_at = self.state.get(self._updated_at_slot)
+            if not self.updated_at:  # First use in this deployment: start full
+                self.tokens, self.updated_at = self.capacity, time.monotonic()
+            yield
+            self.state.set(self._tokens_slot, self.tokens)
+            self.state.set(self._updated_at_slot, self.updated_at)
+
+    def _take(self, amount: float) -> float:
+        with self._shared():
+            return super()._take(amount)
+
+    def adjust(self, amount: float):
+        if self.rate > 0:
+            with self._shared():
+                super().adjust(amount)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and fails fast for `reset_timeout` seconds.
+
+    After that one probe request is let through (half-open): success closes the
+    circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def check(self):
+        if self.failure_threshold <= 0 or self.state == "closed":
+            return
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if self.state == "open" and remaining <= 0:
+            self.state = "half_open"
+            logger.info("Upstream circuit half-open; sending a probe request")
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        raise CircuitOpenError(max(remaining, 1.0))
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("Upstream circuit closed")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """The probe was cancelled before it got an answer; let the next caller probe instead."""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.failure_threshold > 0 and (
+            self.state == "half_open" or self.consecutive_failures >= self.failure_threshold
+        ):
+            if self.state != "open":
+                logger.warning(f"Upstream circuit open after {self.consecutive_failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+def parse_retry_after(error: Exception) -> Optional[float]:
+    """Seconds to wait from a Retry-After(-Ms) response header, if the error carries one."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+class UpstreamGovernor:
+    """Wraps a chat-completions `create` call with rate limiting, retries, a circuit breaker and hedging.
+
+    - Requests-per-second and tokens-per-minute buckets throttle callers before they reach upstream.
+      Tokens are reserved from an estimate and corrected from the response's usage.
+    - Retryable failures (429, 5xx, timeouts, connection errors) are retried with jittered
+      exponential backoff. A Retry-After header sets the minimum wait and pauses every caller.
+    - Consecutive failures open the circuit breaker, which fails fast until upstream recovers.
+    - With hedging on, a call slower than `hedge_after` seconds (or the observed p95 latency, for
+      "p95") gets a second identical call, and whichever answers first wins.
+
+    With `shared_state`, the buckets and the Retry-After pause are shared by every worker process
+    of the deployment; concurrency, the breaker and hedging stay per process.
+    """
+
+    def __init__(
+        self,
+        create: Callable[..., Awaitable[Any]],
+        max_concurrency: int = 16,
+        requests_per_second: float = 0.0,
+        request_burst: Optional[float] = None,
+        tokens_per_minute: float = 0.0,
+        max_retries: int = 3,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 20.0,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge_after: Optional[str] = None,
+        shared_state: Optional[SharedState] = None,
+    ):
+        self._create = create
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # Any one-second window sees at most requests_per_second + request_burst calls
+        if request_burst is None:
+            request_burst = requests_per_second / 2
+        self.shared_state = shared_state
+        if shared_state is not None:
+            self.request_bucket = SharedTokenBucket(requests_per_second, max(1.0, request_burst), shared_state, "request")
+            self.token_bucket = SharedTokenBucket(tokens_per_minute / 60, tokens_per_minute, shared_state, "llm")
+        else:
+            self.request_bucket = TokenBucket(requests_per_second, max(1.0, request_burst))
+            self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge_after = hedge_after
+        self._latencies: Deque[float] = deque(maxlen=500)
+        self._local_paused_until = 0.0
+        self.error_counts: Dict[str, int] = {}
+        self.stats = {
+            "requests": 0, "attempts": 0, "retries": 0, "failures": 0,
+            "circuit_rejections": 0, "hedges": 0, "hedge_wins": 0, "throttled_seconds": 0.0,
+        }
+
+    @property
+    def _paused_until(self) -> float:
+        if self.shared_state is not None:
+            return self.shared_state.get("paused_until")
+        return self._local_paused_until
+
+    def _pause_until(self, until: float):
+        if self.shared_state is None:
+            self._local_paused_until = max(self._local_paused_until, until)
+            return
+        with self.shared_state.locked():
+            self.shared_state.set("paused_until", max(self.shared_state.get("paused_until"), until))
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge_after:
+            return None
+        if self.hedge_after == "p95":
+            # Not enough history to know what "slow" means yet
+            if len(self._latencies) < 20:
+                return None
+            return sorted(self._latencies)[int(len(self._latencies) * 0.95)]
+        return float(self.hedge_after)
+
+    async def create(self, estimated_tokens: int = 0, **params) -> Any:
+        self.stats["requests"] += 1
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.breaker.check()
+            except CircuitOpenError:
+                self.stats["circuit_rejections"] += 1
+                raise
+            try:
+                # Inside the try, so a caller cancelled while throttled still releases a half-open probe
+                await self._throttle(estimated_tokens)
+                completion = await self._hedged(params, estimated_tokens)
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except Exception as e:
+                error_class = type(e).__name__
+                self.error_counts[error_class] = self.error_counts.get(error_class, 0) + 1
+                if not is_retryable(e):
+                    # The request was at fault, not upstream; still release a half-open probe
+                    if isinstance(e, openai.APIStatusError):
+                        self.breaker.record_success()
+                    elif isinstance(e, CassetteMissError):
+                        # Replay never reached upstream, so it says nothing about upstream's health
+                        self.breaker.release_probe()
+                    else:
+                        self.breaker.record_failure()
+                    self.stats["failures"] += 1
+                    raise
+                # A 429 means upstream is up but wants us slower; the pause below handles that
+                if getattr(e, "status_code", None) == 429:
+                    self.breaker.release_probe()
+                else:
+                    self.breaker.record_failure()
+                retry_after = parse_retry_after(e)
+                delay = self.retry_base_delay * 2 ** attempt * random.uniform(0.5, 1.5)
+                if retry_after is not None:
+                    if retry_after > self.retry_max_delay:
+                        self.stats["failures"] += 1
+                        raise
+                    delay = max(delay, retry_after)
+                    # Everyone backs off, not just this caller
+                    self._pause_until(time.monotonic() + retry_after)
+                if attempt == self.max_retries:
+                    self.stats["failures"] += 1
+                    raise
+                delay = min(delay, self.retry_max_delay)
+                self.stats["retries"] += 1
+                logger.warning(f"Upstream call failed ({type(e).__name__}: {e}); retry {attempt + 1} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            usage = getattr(completion, "usage", None)
+            if usage is not None and getattr(usage, "total_tokens", None) and estimated_tokens:
+                self.token_bucket.adjust(estimated_tokens - usage.total_tokens)
+            return completion
+
+    async def _throttle(self, estimated_tokens: int):
+        started = time.monotonic()
+        pause = self._paused_until - started
+        if pause > 0:
+            await asyncio.sleep(pause)
+        await self.request_bucket.acquire(1)
+        if estimated_tokens:
+            await self.token_bucket.acquire(estimated_tokens)
+        self.stats["throttled_seconds"] += time.monotonic() - started
+
+    async def _attempt(self, params: Dict[str, Any]) -> Any:
+        async with self.semaphore:
+            self.stats["attempts"] += 1
+            started = time.monotonic()
+            completion = await self._create(**params)
+            self._latencies.append(time.monotonic() - started)
+            return completion
+
+    def _try_reserve_hedge(self, estimated_tokens: int) -> bool:
+        """Take a request and estimated_tokens for a hedge, both or neither."""
+        if not self.request_bucket.try_acquire(1):
+            return False
+        if estimated_tokens and not self.token_bucket.try_acquire(estimated_tokens):
+            self.request_bucket.adjust(1)
+            return False
+        return True
+
+    def _settle_loser(self, loser: asyncio.Task, estimated_tokens: int):
+        """The winner's tokens are reconciled by create(); the losing call's estimate stays charged, since upstream
+        may have billed the prompt before it was cancelled, unless it finished and reported its real usage."""
+        if not estimated_tokens or not loser.done() or loser.cancelled() or loser.exception() is not None:
+            return
+        usage = getattr(loser.result(), "usage", None)
+        if usage is not None and getattr(usage, "total_tokens", None):
+            self.token_bucket.adjust(estimated_tokens - usage.total_tokens)
+
+    async def _hedged(self, params: Dict[str, Any], estimated_tokens: int) -> Any:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._attempt(params)
+
+        primary = asyncio.create_task(self._attempt(params))
+        hedge: Optional[asyncio.Task] = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            # Only hedge with spare rate capacity; a hedge must never push us into a 429
+            if not done and self._try_reserve_hedge(estimated_tokens):
+                self.stats["hedges"] += 1
+                hedge = asyncio.create_task(self._attempt(params))
+            pending = {primary, hedge} - {None}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.stats["hedge_wins"] += 1
+                        if hedge is not None:
+                            self._settle_loser(primary if task is hedge else hedge, estimated_tokens)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            primary.cancel()
+            if hedge is not None:
+                hedge.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        return {
+            **self.stats,
+            "circuit_state": self.breaker.state,
+            "latency_p50_seconds": latencies[len(latencies) // 2] if latencies else None,
+            "latency_p95_seconds": latencies[int(len(latencies) * 0.95)] if latencies else None,
+            "hedge_delay_seconds": self.hedge_delay(),
+        }
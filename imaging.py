@@ -0,0 +1,99 @@
+import io
+import logging
+from typing import BinaryIO, Tuple, Union
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+class ImageRejectedError(ValueError):
+    """The upload is not a usable image (corrupt, unsupported, or too large to decode safely)."""
+
+
+def flatten_to_rgb(image: Image.Image) -> Image.Image:
+    if image.mode in ("P", "PA", "LA", "RGBA"):
+        # Flatten transparency onto white rather than letting it turn black
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode not in ("RGB", "L"):
+        return image.convert("RGB")
+    return image
+
+
+def normalize_image(
+    source: Union[bytes, BinaryIO],
+    max_dimension: int = 1600,
+    max_pixels: int = 40_000_000,
+    output_format: str = "JPEG",
+    quality: int = 85
+) -> Tuple[bytes, str]:
+    """Apply EXIF orientation, downscale and re-encode an uploaded image.
+
+    CPU-bound; call it from a worker thread, not the event loop. `source` is
+    the upload's bytes or a seekable file holding them; a file is only read in
+    full when its original bytes are kept. Returns the bytes to send upstream
+    and their MIME type. The original bytes are kept when re-encoding would not
+    make them smaller and nothing needed rotating or resizing.
+    """
+    stream = io.BytesIO(source) if isinstance(source, bytes) else source
+    stream.seek(0, io.SEEK_END)
+    original_size = stream.tell()
+    stream.seek(0)
+    try:
+        image = Image.open(stream)
+    except Exception as e:
+        raise ImageRejectedError(f"Invalid image file: {e}")
+
+    # Image.open only parses the header, so this rejects decompression bombs before any pixels are decoded
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageRejectedError(
+            f"Image dimensions {width}x{height} exceed the {max_pixels:,} pixel limit"
+        )
+
+    try:
+        source_format = image.format
+        orientation = image.getexif().get(0x0112, 1)
+        needs_resize = max(width, height) > max_dimension
+        if needs_resize:
+            # Lets the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding, which is far cheaper than a full decode
+            scale = max_dimension / max(width, height)
+            image.draft("RGB", (int(width * scale), int(height * scale)))
+        image = ImageOps.exif_transpose(image)
+        if needs_resize:
+            image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        image = flatten_to_rgb(image)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=output_format, quality=quality, optimize=True)
+    except Image.DecompressionBombError as e:
+        raise ImageRejectedError(str(e))
+    except Exception as e:
+        raise ImageRejectedError(f"Invalid image file: {e}")
+
+    normalized = buffer.getvalue()
+    if not needs_resize and orientation == 1 and source_format in PASSTHROUGH_FORMATS and len(normalized) >= original_size:
+        if isinstance(source, bytes):
+            return source, PASSTHROUGH_FORMATS[source_format]
+        stream.seek(0)
+        return stream.read(), PASSTHROUGH_FORMATS[source_format]
+    logger.debug(f"Normalized {source_format} {width}x{height} ({original_size:,} B) to {image.size} ({len(normalized):,} B)")
+    return normalized, OUTPUT_MIME_TYPES[output_format]
+
+
+def make_thumbnail(contents: bytes, max_dimension: int = 256, quality: int = 75) -> bytes:
+    """Small JPEG preview for history lists. CPU-bound like normalize_image."""
+    image = Image.open(io.BytesIO(contents))
+    image.draft("RGB", (max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    image = flatten_to_rgb(image)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
@@ -0,0 +1,311 @@
+import asyncio
+import contextlib
+import ipaddress
+import logging
+import random
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Collection, Dict, Optional, Set, Tuple
+
+import httpcore
+import httpx
+
+import crud
+import models
+import schemas
+from database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Called by the pipeline as results arrive: (document_type, {field_key: value})
+ProgressCallback = Callable[[str, Dict[str, Optional[str]]], None]
+# Runs one job and returns what would otherwise be saved by /classify
+JobProcessor = Callable[
+    [models.Job, ProgressCallback], Awaitable[Tuple[schemas.DocumentRecordCreate, Dict[str, str]]]
+]
+
+WEBHOOK_TIMEOUT_SECONDS = 10.0
+WEBHOOK_ATTEMPTS = 3
+
+
+class PermanentJobError(Exception):
+    """A failure that retrying won't fix (bad image, unsupported document type)."""
+
+
+class WebhookURLError(ValueError):
+    """A webhook URL the server won't POST to."""
+
+
+async def check_webhook_url(url: str, allowed_hosts: Collection[str] = ()) -> Optional[str]:
+    """Raise WebhookURLError unless url is an http(s) URL that is safe to POST job results to.
+
+    With allowed_hosts, the host must be one of them (internal receivers can be listed there), and None is
+    returned. Otherwise every address the host resolves to must be public, so a webhook can't reach loopback,
+    private, link-local (cloud metadata) or other internal addresses, and the checked address to connect to
+    is returned.
+    """
+    try:
+        parsed = httpx.URL(url)
+    except httpx.InvalidURL as e:
+        raise WebhookURLError(f"Invalid webhook URL: {e}")
+    if parsed.scheme not in ("http", "https") or not parsed.host:
+        raise WebhookURLError("webhook_url must be an http(s) URL")
+    host = parsed.host.lower()
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise WebhookURLError(f"Webhook host '{host}' is not in JOB_WEBHOOK_ALLOWED_HOSTS")
+        return None
+    try:
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, parsed.port or 0, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise WebhookURLError(f"Webhook host '{host}' does not resolve: {e}")
+    for *_, sockaddr in addresses:
+        # Scope ids (fe80::1%eth0) aren't part of the address
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not address.is_global:
+            raise WebhookURLError(f"Webhook host '{host}' resolves to a non-public address ({address})")
+    return str(ipaddress.ip_address(addresses[0][4][0].split("%")[0]))
+
+
+class PinnedAddressBackend(httpcore.AsyncNetworkBackend):
+    """Connects to one already-checked IP address whatever the host, so a DNS answer that changes after the
+    check (DNS rebinding) can't redirect the connection. The Host header, TLS SNI and certificate check still
+    use the URL's host."""
+
+    def __init__(self, address: str):
+        self.address = address
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        return await self._backend.connect_tcp(
+            self.address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+        )
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        raise httpcore.ConnectError("Webhooks are never delivered over a Unix socket")
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
+
+
+def pinned_transport(address: str) -> httpx.AsyncHTTPTransport:
+    transport = httpx.AsyncHTTPTransport()
+    # httpx has no resolver hook, but the httpcore pool it wraps takes a network backend
+    transport._pool = httpcore.AsyncConnectionPool(
+        ssl_context=httpx.create_ssl_context(), network_backend=PinnedAddressBackend(address)
+    )
+    return transport
+
+
+class JobProgress:
+    """Collects partial results for a running job and writes them to its row, at most once per interval."""
+
+    def __init__(self, job_id: str, attempt: int, interval: float):
+        self.job_id = job_id
+        self.attempt = attempt
+        self.interval = interval
+        self.document_type: Optional[str] = None
+        self.features: Dict[str, Optional[str]] = {}
+        self._last_flush = 0.0
+        self._pending: Optional[asyncio.Task] = None
+
+    def report(self, document_type: str, features: Dict[str, Optional[str]]):
+        self.document_type = document_type
+        self.features.update(features)
+        # One write in flight at a time; it picks up whatever has arrived by the time it runs
+        if self._pending is None or self._pending.done():
+            delay = max(0.0, self._last_flush + self.interval - asyncio.get_running_loop().time())
+            self._pending = asyncio.create_task(self._flush(delay))
+
+    async def _flush(self, delay: float):
+        await asyncio.sleep(delay)
+        self._last_flush = asyncio.get_running_loop().time()
+        try:
+            async with AsyncSessionLocal() as db:
+                await crud.update_job(
+                    db, self.job_id, self.attempt, document_type=self.document_type, features=dict(self.features)
+                )
+        except Exception as e:
+            logger.warning(f"Could not record progress for job {self.job_id}: {e}")
+
+    async def close(self):
+        if self._pending is not None:
+            self._pending.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._pending
+
+
+class JobWorkerPool:
+    """Processes rows of the jobs table with a fixed number of concurrent workers.
+
+    Workers claim due jobs under a lease that they renew while working, so a
+    job held by a worker that died (or a server that restarted) is picked up
+    again once its lease lapses. Failures are retried with exponential backoff
+    up to max_attempts. Several pools, in one process or many, can share a
+    database.
+    """
+
+    def __init__(
+        self,
+        process: JobProcessor,
+        max_attempts: int = 3,
+        retry_base_delay: float = 5.0,
+        lease_seconds: float = 120.0,
+        poll_interval: float = 1.0,
+        progress_interval: float = 1.0,
+        webhook_allowed_hosts: Collection[str] = (),
+    ):
+        self.process = process
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.progress_interval = progress_interval
+        self.webhook_allowed_hosts = webhook_allowed_hosts
+        self._wakeup = asyncio.Event()
+        self._workers: Set[asyncio.Task] = set()
+        self._webhooks: Set[asyncio.Task] = set()
+
+    def notify(self):
+        """Wake idle workers now instead of at their next poll (jobs submitted in this process)."""
+        self._wakeup.set()
+
+    def start(self, workers: int):
+        for n in range(workers):
+            self._workers.add(asyncio.create_task(self._worker(), name=f"job-worker-{n}"))
+        logger.info(f"Started {workers} job worker(s)")
+
+    async def stop(self):
+        # Interrupted jobs keep their lease and are retried by whichever worker claims them next
+        tasks = self._workers | self._webhooks
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers.clear()
+        self._webhooks.clear()
+
+    async def run_forever(self, workers: int):
+        self.start(workers)
+        try:
+            await asyncio.gather(*self._workers)
+        finally:
+            await self.stop()
+
+    async def _worker(self):
+        while True:
+            # Cleared before claiming, so a job submitted after the claim still wakes this worker
+            self._wakeup.clear()
+            try:
+                async with AsyncSessionLocal() as db:
+                    job = await crud.claim_next_job(db, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Could not claim a job: {e}")
+                job = None
+            if job is None:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                continue
+            await self._run(job)
+
+    async def _run(self, job: models.Job):
+        logger.info(f"Job {job.id}: attempt {job.attempts} of {self.max_attempts}")
+        if job.attempts > self.max_attempts:
+            # Its last attempt never finished, e.g. the image keeps crashing the worker
+            await self._fail(job, "Job was interrupted on its final attempt")
+            return
+
+        progress = JobProgress(job.id, job.attempts, self.progress_interval)
+        heartbeat = asyncio.create_task(self._keep_lease(job))
+        try:
+            document, field_errors = await self.process(job, progress.report)
+            await progress.close()
+            async with AsyncSessionLocal() as db:
+                db_record = await crud.complete_job(db, job.id, job.attempts, document, field_errors)
+        except PermanentJobError as e:
+            await progress.close()
+            await self._fail(job, str(e))
+            return
+        except Exception as e:
+            await progress.close()
+            await self._retry_or_fail(job, e)
+            return
+        finally:
+            heartbeat.cancel()
+        if db_record is None:
+            logger.warning(f"Job {job.id}: lease lost during attempt {job.attempts}; result discarded")
+            return
+        logger.info(f"Job {job.id}: succeeded")
+        self._notify_webhook(job.id)
+
+    async def _retry_or_fail(self, job: models.Job, error: Exception):
+        message = getattr(error, "detail", None) or str(error) or type(error).__name__
+        if job.attempts >= self.max_attempts:
+            await self._fail(job, message)
+            return
+        # Exponential backoff with jitter, so a burst of failures doesn't retry in lockstep
+        delay = self.retry_base_delay * 2 ** (job.attempts - 1) * random.uniform(0.5, 1.5)
+        logger.warning(f"Job {job.id}: attempt {job.attempts} failed ({message}); retrying in {delay:.1f}s")
+        async with AsyncSessionLocal() as db:
+            await crud.update_job(
+                db, job.id, job.attempts,
+                status="queued",
+                error=message,
+                lease_expires_at=None,
+                next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=delay)
+            )
+
+    async def _fail(self, job: models.Job, error: str):
+        logger.warning(f"Job {job.id}: failed ({error})")
+        async with AsyncSessionLocal() as db:
+            if not await crud.fail_job(db, job.id, job.attempts, error):
+                logger.warning(f"Job {job.id}: lease lost during attempt {job.attempts}; failure not recorded")
+                return
+        self._notify_webhook(job.id)
+
+    async def _keep_lease(self, job: models.Job):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                async with AsyncSessionLocal() as db:
+                    renewed = await crud.update_job(
+                        db, job.id, job.attempts, lease_expires_at=datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)
+                    )
+            except Exception as e:
+                logger.warning(f"Could not renew the lease on job {job.id}: {e}")
+                continue
+            if not renewed:
+                # Another worker has it now; whatever this attempt produces is discarded
+                logger.warning(f"Job {job.id}: lease lost during attempt {job.attempts}")
+                return
+
+    def _notify_webhook(self, job_id: str):
+        # Delivered in the background so a slow receiver doesn't hold up a worker
+        task = asyncio.create_task(self._deliver_webhook(job_id))
+        self._webhooks.add(task)
+        task.add_done_callback(self._webhooks.discard)
+
+    async def _deliver_webhook(self, job_id: str):
+        async with AsyncSessionLocal() as db:
+            job = await crud.get_job(db, job_id)
+        if job is None or not job.webhook_url:
+            return
+        # Checked again at delivery, since what the host resolves to may have changed since submission,
+        # and the connection goes to the address that was checked rather than to a fresh lookup
+        try:
+            address = await check_webhook_url(job.webhook_url, self.webhook_allowed_hosts)
+        except WebhookURLError as e:
+            logger.warning(f"Job {job_id}: webhook not delivered: {e}")
+            return
+        payload = schemas.JobResponse.model_validate(job).model_dump(mode="json")
+        transport = pinned_transport(address) if address is not None else None
+        async with httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SECONDS, transport=transport) as http_client:
+            for attempt in range(1, WEBHOOK_ATTEMPTS + 1):
+                try:
+                    response = await http_client.post(job.webhook_url, json=payload)
+                    response.raise_for_status()
+                    logger.info(f"Job {job_id}: webhook delivered")
+                    return
+                except httpx.HTTPError as e:
+                    logger.warning(f"Job {job_id}: webhook attempt {attempt} failed: {e}")
+                    if attempt < WEBHOOK_ATTEMPTS:
+                        await asyncio.sleep(2 ** attempt)
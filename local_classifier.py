@@ -0,0 +1,79 @@
+import io
+import json
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from imaging import flatten_to_rgb
+
+logger = logging.getLogger(__name__)
+
+# Inputs to the model: a small grayscale thumbnail, per-channel colour histograms and the aspect ratio
+THUMBNAIL_SIZE = (24, 16)
+HISTOGRAM_BINS = 8
+FEATURE_DIMENSION = THUMBNAIL_SIZE[0] * THUMBNAIL_SIZE[1] + 3 * HISTOGRAM_BINS + 1
+
+
+def extract_image_features(contents: bytes) -> np.ndarray:
+    """Fixed-length float32 feature vector for one image. Shared by training and inference."""
+    image = Image.open(io.BytesIO(contents))
+    image.draft("RGB", (THUMBNAIL_SIZE[0] * 8, THUMBNAIL_SIZE[1] * 8))
+    image = flatten_to_rgb(ImageOps.exif_transpose(image)).convert("RGB")
+    width, height = image.size
+
+    # Landscape-normalized so an ID photographed sideways still looks like an ID
+    grayscale = image.convert("L")
+    if height > width:
+        grayscale = grayscale.rotate(90, expand=True)
+    thumbnail = np.asarray(grayscale.resize(THUMBNAIL_SIZE, Image.Resampling.BILINEAR), dtype=np.float32) / 255.0
+
+    small = np.asarray(image.resize((64, 64), Image.Resampling.BILINEAR))
+    histograms = [
+        np.histogram(small[:, :, channel], bins=HISTOGRAM_BINS, range=(0, 256))[0] / (64 * 64)
+        for channel in range(3)
+    ]
+    aspect_ratio = np.array([min(width, height) / max(width, height)], dtype=np.float32)
+    return np.concatenate([thumbnail.ravel(), *histograms, aspect_ratio]).astype(np.float32)
+
+
+class LocalDocumentClassifier:
+    """CPU document-type classifier backed by an ONNX model exported by train_local_classifier.py.
+
+    The model maps a [N, FEATURE_DIMENSION] float tensor to [N, len(labels)]
+    probabilities; labels are stored in the model's metadata. predict() is
+    CPU-bound and thread-safe, so run it in a worker pool.
+    """
+
+    def __init__(self, model_path: str):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        # Parallelism comes from the worker pool, not from inside one tiny inference
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.labels: List[str] = json.loads(metadata["labels"])
+        self.input_name = self.session.get_inputs()[0].name
+        with open(model_path, "rb") as f:
+            self.model_bytes = f.read()
+
+    def predict(self, contents: bytes) -> Tuple[str, float]:
+        features = extract_image_features(contents)[np.newaxis, :]
+        probabilities = self.session.run(None, {self.input_name: features})[0][0]
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+
+
+def load_local_classifier(model_path: Optional[str]) -> Optional[LocalDocumentClassifier]:
+    if not model_path:
+        return None
+    try:
+        classifier = LocalDocumentClassifier(model_path)
+    except Exception as e:
+        logger.error(f"Could not load local classifier from '{model_path}', falling back to the LLM: {e}")
+        return None
+    logger.info(f"Loaded local document classifier from '{model_path}' (labels: {classifier.labels})")
+    return classifier
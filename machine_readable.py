@@ -0,0 +1,300 @@
+"""Local decoding of the machine-readable parts of ID documents, so their fields skip the model.
+
+- Passports (TD3) and US EAD cards (TD1) carry an ICAO 9303 machine-readable
+  zone, read here with OCR. A value is only used when a check digit covering it
+  validates; names and country codes have none, so they are left to the model.
+- US driver's licenses carry an AAMVA PDF417 barcode on the back. The barcode's
+  Reed-Solomon error correction means a decoded payload is what was printed,
+  so every field it holds is used once its dates parse.
+
+Both readers are optional dependencies (zxing-cpp and rapidocr-onnxruntime);
+load_machine_readable_decoder enables whichever is installed.
+"""
+import io
+import logging
+import re
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from imaging import flatten_to_rgb
+
+logger = logging.getLogger(__name__)
+
+# The MRZ sits in the lower part of the page or card; only that band is searched for text
+MRZ_SEARCH_BAND = 0.5
+# OCR recognition input height; MRZ lines are scaled to it
+MRZ_LINE_HEIGHT = 64
+
+# OCR confusions, corrected by what the position may hold
+DIGIT_FOR_LETTER = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "Z": "2", "S": "5", "G": "6", "B": "8"})
+LETTER_FOR_DIGIT = str.maketrans({"0": "O", "1": "I", "2": "Z", "5": "S", "6": "G", "8": "B"})
+
+
+class MachineReadableResult(NamedTuple):
+    document_type: str
+    features: Dict[str, str]  # Only the validated values
+    source: str  # "mrz" or "pdf417"
+
+
+def check_digit(value: str) -> str:
+    """ICAO 9303 check digit: weights 7, 3, 1 over digits, letters (A=10) and fillers (<=0)."""
+    total = 0
+    for i, char in enumerate(value):
+        if char.isdigit():
+            number = int(char)
+        elif "A" <= char <= "Z":
+            number = ord(char) - ord("A") + 10
+        else:
+            number = 0
+        total += number * (7, 3, 1)[i % 3]
+    return str(total % 10)
+
+
+def numeric(value: str) -> str:
+    return value.translate(DIGIT_FOR_LETTER)
+
+
+def alphabetic(value: str) -> str:
+    return value.translate(LETTER_FOR_DIGIT)
+
+
+def fit_line(line: str, length: int) -> Optional[str]:
+    """Stretch or shrink the longest filler run so an OCR'd line has its nominal length.
+
+    OCR drops and repeats '<' far more often than other characters; check digits
+    catch a wrong guess.
+    """
+    line = re.sub(r"\s+", "", line.upper()).replace("«", "<")
+    if len(line) == length:
+        return line
+    runs = list(re.finditer(r"<+", line))
+    if not runs:
+        return None
+    longest = max(runs, key=lambda run: len(run.group()))
+    filler = len(longest.group()) + length - len(line)
+    if filler < 1:
+        return None
+    return line[:longest.start()] + "<" * filler + line[longest.end():]
+
+
+def mrz_date(value: str, future: bool) -> Optional[str]:
+    """YYMMDD to ISO. Expiry dates are taken as this century; birth dates as the latest one not in the future."""
+    if not value.isdigit():
+        return None
+    year, month, day = int(value[:2]), int(value[2:4]), int(value[4:6])
+    today = date.today()
+    century = 2000 if future or 2000 + year <= today.year else 1900
+    try:
+        return date(century + year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def checked(value: str, digit: str) -> bool:
+    return digit == check_digit(value) or (digit == "<" and not value.strip("<"))
+
+
+def parse_td3(line1: str, line2: str) -> Optional[MachineReadableResult]:
+    """Passport data page: 2 lines of 44."""
+    if alphabetic(line1[0]) != "P":
+        return None
+    document_number, document_number_check = line2[0:9], numeric(line2[9])
+    birth, birth_check = numeric(line2[13:19]), numeric(line2[19])
+    expiry, expiry_check = numeric(line2[21:27]), numeric(line2[27])
+    personal_number, personal_number_check = line2[28:42], numeric(line2[42])
+    composite = numeric(line2[43])
+    composite_valid = checked(
+        document_number + document_number_check + birth + birth_check + expiry + expiry_check + personal_number + personal_number_check,
+        composite
+    )
+    features = {}
+    if (composite_valid or checked(birth, birth_check)) and (value := mrz_date(birth, future=False)):
+        features["date_of_birth"] = value
+    if (composite_valid or checked(expiry, expiry_check)) and (value := mrz_date(expiry, future=True)):
+        features["expiration_date"] = value
+    if not features:
+        return None
+    return MachineReadableResult("passport", features, "mrz")
+
+
+def parse_td1(line1: str, line2: str, line3: str) -> Optional[MachineReadableResult]:
+    """US Employment Authorization Document back: 3 lines of 30."""
+    if alphabetic(line1[0:2]) != "IA" or alphabetic(line1[2:5]) != "USA":
+        return None
+    # The card number (e.g. SRC0000000773) is in the optional data, covered only by the composite digit
+    optional_data = alphabetic(line1[15:18]) + numeric(line1[18:28]) + line1[28:30]
+    document_number, document_number_check = line1[5:14], numeric(line1[14])
+    expiry, expiry_check = numeric(line2[8:14]), numeric(line2[14])
+    composite_valid = checked(
+        document_number + document_number_check + optional_data + numeric(line2[0:7]) + numeric(line2[8:15]) + line2[18:29],
+        numeric(line2[29])
+    )
+
+    features = {}
+    card_number = re.fullmatch(r"[A-Z]{3}\d{10}<*", optional_data)
+    if composite_valid and card_number:
+        features["card_number"] = optional_data.rstrip("<")
+    elif checked(document_number, document_number_check) and document_number.strip("<"):
+        features["card_number"] = document_number.strip("<")
+    if (composite_valid or checked(expiry, expiry_check)) and (value := mrz_date(expiry, future=True)):
+        features["card_expires_date"] = value
+    if not features:
+        return None
+    return MachineReadableResult("ead_card", features, "mrz")
+
+
+def parse_mrz(lines: List[str]) -> Optional[MachineReadableResult]:
+    """Validated fields from OCR'd text lines, top to bottom; other text around the zone is ignored."""
+    candidates = [line for line in lines if line.count("<") >= 2]
+    for first in range(len(candidates) - 1):
+        line1, line2 = fit_line(candidates[first], 44), fit_line(candidates[first + 1], 44)
+        if line1 and line2 and (result := parse_td3(line1, line2)):
+            return result
+    for first in range(len(candidates) - 2):
+        fitted = [fit_line(line, 30) for line in candidates[first:first + 3]]
+        if all(fitted) and (result := parse_td1(*fitted)):
+            return result
+    return None
+
+
+# AAMVA element IDs; DCT and DAB are the given names and surname in version 1-3 cards
+AAMVA_FIELDS = {
+    "DAQ": "license_number",
+    "DBB": "date_of_birth",
+    "DBD": "issue_date",
+    "DBA": "expiration_date",
+    "DAC": "first_name",
+    "DCT": "first_name",
+    "DCS": "last_name",
+    "DAB": "last_name",
+}
+AAMVA_DATE_FIELDS = ("date_of_birth", "issue_date", "expiration_date")
+
+
+def aamva_date(value: str, canadian: bool) -> Optional[str]:
+    """US cards encode MMDDCCYY, Canadian ones CCYYMMDD."""
+    if len(value) != 8 or not value.isdigit():
+        return None
+    year, month, day = (value[0:4], value[4:6], value[6:8]) if canadian else (value[4:8], value[0:2], value[2:4])
+    try:
+        return date(int(year), int(month), int(day)).isoformat()
+    except ValueError:
+        return None
+
+
+def parse_aamva(payload: str) -> Optional[MachineReadableResult]:
+    """Fields from a driver's license PDF417 payload (AAMVA DL/ID card design standard)."""
+    if not payload.startswith("@") or ("ANSI " not in payload[:32] and "AAMVA" not in payload[:32]):
+        return None
+    elements: Dict[str, str] = {}
+    for line in re.split(r"[\n\r\x1e]+", payload):
+        if not re.match(r"D[A-Z]{2}", line):
+            # The first element of a subfile follows the header and its "DL"/"ID" designator on the same line
+            line = re.sub(r"^.*?(?:DL|ID)(?=D[A-Z]{2})", "", line)
+        if len(line) > 3 and re.match(r"D[A-Z]{2}", line):
+            elements.setdefault(line[:3], line[3:].strip())
+    canadian = elements.get("DCG") == "CAN"
+    features = {}
+    for element, field_key in AAMVA_FIELDS.items():
+        value = elements.get(element)
+        if not value or value.upper() in ("NONE", "UNAVL") or field_key in features:
+            continue
+        if field_key in AAMVA_DATE_FIELDS:
+            value = aamva_date(value, canadian)
+            if value is None:
+                continue
+        elif field_key == "first_name":
+            # Version 1-3 DCT holds every given name; the form asks for the first one
+            value = value.replace(",", " ").split()[0]
+        features[field_key] = value
+    if "license_number" not in features:
+        return None
+    return MachineReadableResult("drivers_license", features, "pdf417")
+
+
+class MachineReadableDecoder:
+    """Finds and validates a PDF417 barcode or MRZ in an image. decode() is CPU-bound; run it in a worker pool."""
+
+    def __init__(self, read_barcodes: bool = True, read_mrz: bool = True):
+        self.zxingcpp = None
+        self.ocr = None
+        if read_barcodes:
+            import zxingcpp
+
+            self.zxingcpp = zxingcpp
+        if read_mrz:
+            from rapidocr_onnxruntime import RapidOCR
+
+            # Parallelism comes from the worker pool; downscaling for detection keeps it well under a second
+            self.ocr = RapidOCR(
+                det_limit_side_len=960, det_limit_type="max",
+                det_intra_op_num_threads=1, rec_intra_op_num_threads=1, cls_intra_op_num_threads=1
+            )
+
+    @property
+    def backends(self) -> List[str]:
+        return [name for name, reader in (("pdf417", self.zxingcpp), ("mrz", self.ocr)) if reader is not None]
+
+    def decode(self, contents: bytes) -> Optional[MachineReadableResult]:
+        image = flatten_to_rgb(ImageOps.exif_transpose(Image.open(io.BytesIO(contents)))).convert("RGB")
+        if self.zxingcpp is not None:
+            result = self.decode_barcode(image)
+            if result is not None:
+                return result
+        if self.ocr is not None:
+            return parse_mrz(self.read_mrz_lines(image))
+        return None
+
+    def decode_barcode(self, image: Image.Image) -> Optional[MachineReadableResult]:
+        barcodes = self.zxingcpp.read_barcodes(
+            image, formats=self.zxingcpp.BarcodeFormat.PDF417, text_mode=self.zxingcpp.TextMode.Plain
+        )
+        for barcode in barcodes:
+            result = parse_aamva(barcode.text)
+            if result is not None:
+                return result
+        return None
+
+    def read_mrz_lines(self, image: Image.Image) -> List[str]:
+        """Text of the long, thin lines in the bottom band, top to bottom."""
+        width, height = image.size
+        band = image.crop((0, int(height * (1 - MRZ_SEARCH_BAND)), width, height))
+        boxes, _ = self.ocr(np.asarray(band)[:, :, ::-1], use_cls=False, use_rec=False)
+        lines: List[Tuple[int, str]] = []
+        for box in boxes if boxes is not None else []:
+            (left, top), (right, bottom) = np.asarray(box).min(axis=0).astype(int), np.asarray(box).max(axis=0).astype(int)
+            # An MRZ line spans most of the document and is far wider than it is tall
+            if right - left < width / 2 or right - left < 10 * (bottom - top):
+                continue
+            padding = max(2, (bottom - top) // 4)
+            crop = band.crop((max(0, left - padding), max(0, top - padding), min(width, right + padding), bottom + padding))
+            crop = crop.resize((max(1, crop.width * MRZ_LINE_HEIGHT // crop.height), MRZ_LINE_HEIGHT), Image.Resampling.LANCZOS)
+            recognized, _ = self.ocr(np.asarray(crop)[:, :, ::-1], use_det=False, use_cls=False)
+            if recognized:
+                lines.append((top, recognized[0][0]))
+        return [text for _, text in sorted(lines)]
+
+
+def load_machine_readable_decoder(enabled: bool) -> Optional[MachineReadableDecoder]:
+    if not enabled:
+        return None
+    available = {}
+    for name, module in (("read_barcodes", "zxingcpp"), ("read_mrz", "rapidocr_onnxruntime")):
+        try:
+            __import__(module)
+            available[name] = True
+        except ImportError:
+            logger.info(f"'{module}' is not installed; {name.replace('_', ' ')} is disabled.")
+            available[name] = False
+    if not any(available.values()):
+        return None
+    try:
+        decoder = MachineReadableDecoder(**available)
+    except Exception as e:
+        logger.error(f"Could not load the machine-readable decoder, falling back to the LLM: {e}")
+        return None
+    logger.info(f"Loaded machine-readable decoder ({', '.join(decoder.backends)})")
+    return decoder
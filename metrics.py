@@ -0,0 +1,176 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Recording is a dict update under the GIL, cheap enough for the request path.
+Metrics are per process. Everything is recorded from the event loop thread,
+so no locking is needed.
+"""
+import bisect
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Seconds; spans a local JSON parse up to a slow multi-call upstream pipeline
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label_value(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[LabelValues, float] = defaultdict(float)
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        self.values[labelvalues] += amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labelvalues, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, labelvalues)} {format_value(value)}"
+
+
+class Histogram:
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: a count per bucket (non-cumulative; summed when rendering), the total and the count
+        self.bucket_counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = defaultdict(float)
+        self.counts: Dict[LabelValues, int] = defaultdict(int)
+
+    def observe(self, value: float, *labelvalues: str):
+        counts = self.bucket_counts.get(labelvalues)
+        if counts is None:
+            counts = self.bucket_counts[labelvalues] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labelvalues] += value
+        self.counts[labelvalues] += 1
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labelvalues, counts in sorted(self.bucket_counts.items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{format_value(upper_bound)}"'
+                yield f"{self.name}_bucket{format_labels(self.labelnames, labelvalues, le)} {cumulative}"
+            labels = format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {format_value(self.sums[labelvalues])}"
+            yield f"{self.name}_count{labels} {self.counts[labelvalues]}"
+
+
+def render_samples(
+    name: str, metric_type: str, documentation: str, samples: Iterable[Tuple[Dict[str, str], float]]
+) -> Iterator[str]:
+    """Render values owned elsewhere (cache and governor stats) as one metric family."""
+    yield f"# HELP {name} {documentation}"
+    yield f"# TYPE {name} {metric_type}"
+    for labels, value in samples:
+        yield f"{name}{format_labels(list(labels), list(labels.values()))} {format_value(value)}"
+
+
+STAGE_SECONDS = Histogram(
+    "idclassifier_stage_duration_seconds",
+    "Time spent in each request pipeline stage.",
+    ("stage",),
+)
+FIELD_SECONDS = Histogram(
+    "idclassifier_field_extraction_duration_seconds",
+    "Time for one per-field upstream extraction call, including waiting for a concurrency slot.",
+    ("document_type", "field"),
+)
+UPSTREAM_TOKENS = Counter(
+    "idclassifier_upstream_tokens_total",
+    "Tokens reported in completion.usage by the upstream model.",
+    ("kind",),
+)
+DOCUMENTS = Counter(
+    "idclassifier_documents_total",
+    "Documents extracted (including cache hits), by document type.",
+    ("document_type",),
+)
+FIELD_RESULTS = Counter(
+    "idclassifier_field_results_total",
+    "Fields produced by the extraction pipeline, by outcome (found, not_found or error).",
+    ("document_type", "field", "outcome"),
+)
+DECODED_FIELDS = Counter(
+    "idclassifier_decoded_fields_total",
+    "Field values taken from a document's MRZ or barcode instead of the model, by source (mrz or pdf417).",
+    ("document_type", "field", "source"),
+)
+MODEL_CALLS_SAVED = Histogram(
+    "idclassifier_model_calls_saved",
+    "Upstream calls a document did not need because of its decoded MRZ or barcode.",
+    ("document_type",),
+    buckets=(0, 1, 2, 3, 4, 5, 6, 7),
+)
+CASCADE_RESULTS = Counter(
+    "idclassifier_cascade_results_total",
+    "Model cascade answers by call (classification or field), tier (0 = fastest), model and outcome "
+    "(accepted, invalid, not_found or error); accepted over all answers at a tier is its hit rate.",
+    ("call", "tier", "model", "outcome"),
+)
+UPSTREAM_ERRORS = Counter(
+    "idclassifier_upstream_errors_total",
+    "Failed upstream calls that reached the caller, by exception class.",
+    ("error_class",),
+)
+
+REGISTRY = (
+    STAGE_SECONDS, FIELD_SECONDS, UPSTREAM_TOKENS, DOCUMENTS, FIELD_RESULTS, DECODED_FIELDS, MODEL_CALLS_SAVED,
+    CASCADE_RESULTS, UPSTREAM_ERRORS
+)
+
+# Stage name -> seconds for the current request; only set when the Server-Timing header is enabled
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+def render(extra: Iterable[str] = ()) -> str:
+    lines = [line for metric in REGISTRY for line in metric.render()]
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
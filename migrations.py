@@ -0,0 +1,164 @@
+"""Schema upgrades and data migrations that create_all can't do on an existing database.
+
+upgrade() is idempotent and runs at server startup. Data backfills run from
+the command line:
+
+    python migrations.py migrate-image-blobs [--batch-size 200] [--vacuum]
+    python migrations.py rebuild-feature-index [--batch-size 5000]
+"""
+import argparse
+import base64
+import logging
+from typing import Dict
+
+from sqlalchemy import delete, insert, inspect, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models
+from blobstore import BLOB_STORE_DIR, BlobStore
+from crud import feature_index_rows
+from imaging import make_thumbnail
+
+logger = logging.getLogger(__name__)
+
+# Columns added after a table was first created: table -> {column: DDL type}
+ADDED_COLUMNS: Dict[str, Dict[str, str]] = {
+    "document_records": {
+        "image_sha256": "VARCHAR",
+        "image_mime_type": "VARCHAR",
+        "thumbnail_sha256": "VARCHAR",
+        "sources": "JSON",
+    },
+    "extraction_cache": {
+        "sources": "JSON",
+    },
+}
+ADDED_INDEXES = {
+    "ix_document_records_image_sha256": "CREATE INDEX IF NOT EXISTS ix_document_records_image_sha256 ON document_records (image_sha256)",
+    "ix_document_records_updated_at_id": "CREATE INDEX IF NOT EXISTS ix_document_records_updated_at_id ON document_records (updated_at, id)",
+    "ix_document_records_type_updated_at_id": (
+        "CREATE INDEX IF NOT EXISTS ix_document_records_type_updated_at_id ON document_records (document_type, updated_at, id)"
+    ),
+}
+
+
+def upgrade(engine: Engine):
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table_name, columns in ADDED_COLUMNS.items():
+            existing = {column["name"] for column in inspector.get_columns(table_name)}
+            for column_name, column_type in columns.items():
+                if column_name not in existing:
+                    logger.info(f"Adding column {table_name}.{column_name}")
+                    connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+        for ddl in ADDED_INDEXES.values():
+            connection.execute(text(ddl))
+
+
+def setup_schema(engine: Engine):
+    """Create missing tables, then upgrade existing ones. Run once per deployment start, before serving."""
+    models.Base.metadata.create_all(bind=engine)
+    upgrade(engine)
+
+
+def migrate_image_blobs(db: Session, blob_store: BlobStore, batch_size: int = 200) -> int:
+    """Move inline base64 images into the blob store, one committed batch at a time."""
+    migrated = 0
+    while True:
+        batch = (
+            db.query(models.DocumentRecord.id, models.DocumentRecord.image_base64)
+            .filter(models.DocumentRecord.image_base64.isnot(None))
+            .order_by(models.DocumentRecord.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            return migrated
+        for record_id, image_base64 in batch:
+            header, _, encoded = image_base64.partition(",")
+            if not encoded: # Bare base64 without a data: prefix
+                header, encoded = "", header
+            mime_type = header[len("data:"):].split(";")[0] if header.startswith("data:") else "application/octet-stream"
+            image_bytes = base64.b64decode(encoded)
+            thumbnail_sha256 = None
+            try:
+                thumbnail_sha256 = blob_store.put(make_thumbnail(image_bytes))
+            except Exception as e:
+                logger.warning(f"Could not build thumbnail for document {record_id}: {e}")
+            db.execute(
+                update(models.DocumentRecord)
+                .where(models.DocumentRecord.id == record_id)
+                .values(
+                    image_sha256=blob_store.put(image_bytes),
+                    image_mime_type=mime_type,
+                    thumbnail_sha256=thumbnail_sha256,
+                    image_base64=None,
+                    # Set explicitly so the onupdate default doesn't reorder the history list
+                    updated_at=models.DocumentRecord.updated_at,
+                )
+            )
+        db.commit()
+        migrated += len(batch)
+        logger.info(f"Migrated {migrated} image(s) to the blob store")
+
+def rebuild_feature_index(db: Session, batch_size: int = 5000) -> int:
+    """Regenerate document_features from every document's features, one committed batch at a time.
+
+    Each batch replaces the index rows for its id range, so search keeps working
+    (with the old rows) for documents the rebuild hasn't reached yet.
+    """
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = db.execute(
+            select(models.DocumentRecord.id, models.DocumentRecord.features)
+            .where(models.DocumentRecord.id > last_id)
+            .order_by(models.DocumentRecord.id)
+            .limit(batch_size)
+        ).all()
+        stale = delete(models.DocumentFeature).where(models.DocumentFeature.document_id > last_id)
+        if not batch:
+            db.execute(stale)
+            db.commit()
+            return indexed
+        db.execute(stale.where(models.DocumentFeature.document_id <= batch[-1].id))
+        rows = [row for record_id, features in batch for row in feature_index_rows(record_id, features)]
+        if rows:
+            db.execute(insert(models.DocumentFeature.__table__), rows)
+        db.commit()
+        last_id = batch[-1].id
+        indexed += len(batch)
+        logger.info(f"Indexed features of {indexed} document(s)")
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Database migrations for the ID classifier.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    blob_parser = subcommands.add_parser("migrate-image-blobs", help="Move inline base64 images to the blob store")
+    blob_parser.add_argument("--batch-size", type=int, default=200)
+    blob_parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards so the SQLite file shrinks")
+    index_parser = subcommands.add_parser("rebuild-feature-index", help="Rebuild the document_features search index")
+    index_parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_schema(engine)
+    if args.command == "migrate-image-blobs":
+        db = SessionLocal()
+        try:
+            count = migrate_image_blobs(db, BlobStore(BLOB_STORE_DIR), batch_size=args.batch_size)
+        finally:
+            db.close()
+        print(f"Migrated {count} image(s) to {BLOB_STORE_DIR}")
+        if args.vacuum and engine.dialect.name == "sqlite":
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.execute(text("VACUUM"))
+    elif args.command == "rebuild-feature-index":
+        db = SessionLocal()
+        try:
+            count = rebuild_feature_index(db, batch_size=args.batch_size)
+        finally:
+            db.close()
+        print(f"Indexed the features of {count} document(s)")
@@ -1,17 +1,96 @@
-from sqlalchemy import Column, Integer, String, Text, JSON, DateTime
+from sqlalchemy import Column, ForeignKey, Index, Integer, PrimaryKeyConstraint, String, Text, JSON, DateTime
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.sql import func # for server_default=func.now()
 from database import Base
 
+# SQLite stores timestamps as text and compares them as strings. func.now() writes
+# 'YYYY-MM-DD HH:MM:SS', so bound parameters must use the same format (no microseconds)
+# or range and cursor comparisons against equal timestamps go wrong.
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
+
 class DocumentRecord(Base):
     __tablename__ = "document_records"
 
     id = Column(Integer, primary_key=True, index=True)
     original_filename = Column(String, index=True)
-    image_base64 = Column(Text)  # Base64 can be very long
+    image_base64 = Column(Text, nullable=True)  # Legacy inline image; migrations.py moves it to the blob store
+    image_sha256 = Column(String, index=True)  # Key of the normalized image in the blob store
+    image_mime_type = Column(String)
+    thumbnail_sha256 = Column(String)
     document_type = Column(String, index=True)
     features = Column(JSON)      # Store the features dictionary as JSON
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
+    sources = Column(JSON, nullable=True)  # document_type/field -> model, local decoder or "manual" that produced it
+    created_at = Column(Timestamp, server_default=func.now())
+    updated_at = Column(Timestamp, onupdate=func.now(), server_default=func.now())
+
+    __table_args__ = (
+        # Keyset pagination: newest first, id breaks ties between rows updated in the same second
+        Index("ix_document_records_updated_at_id", "updated_at", "id"),
+        Index("ix_document_records_type_updated_at_id", "document_type", "updated_at", "id"),
+    )
 
     def __repr__(self):
         return f"<DocumentRecord(id={self.id}, name='{self.original_filename}', type='{self.document_type}')>"
+
+
+class DocumentFeature(Base):
+    """Search index over DocumentRecord.features; rows are derived by feature_index.index_entries."""
+    __tablename__ = "document_features"
+
+    kind = Column(String, nullable=False)  # "value", "token" or "date"
+    field = Column(String, nullable=False)
+    value = Column(String, nullable=False)  # Normalized value, name token or ISO date
+    document_id = Column(Integer, ForeignKey("document_records.id", ondelete="CASCADE"), nullable=False)
+
+    __table_args__ = (
+        # The key is the lookup index: every search is an equality or range on value within one (kind, field).
+        # Without a rowid, SQLite stores the rows in that order instead of keeping a second copy in an index.
+        PrimaryKeyConstraint("kind", "field", "value", "document_id"),
+        Index("ix_document_features_document_id", "document_id"),
+        {"sqlite_with_rowid": False},
+    )
+
+
+class ExtractionCacheEntry(Base):
+    __tablename__ = "extraction_cache"
+
+    cache_key = Column(String, primary_key=True)  # sha256 of image bytes + model + prompt/config fingerprint
+    document_type = Column(String)
+    features = Column(JSON)
+    sources = Column(JSON, nullable=True)
+    created_at = Column(Timestamp, server_default=func.now())
+
+    def __repr__(self):
+        return f"<ExtractionCacheEntry(key='{self.cache_key[:12]}', type='{self.document_type}')>"
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True)  # Random hex; handed to clients, so not guessable like an autoincrement id
+    status = Column(String, nullable=False)  # queued, running, succeeded or failed
+    original_filename = Column(String)
+    image_sha256 = Column(String)  # Key of the uploaded (not yet normalized) image in the blob store
+    extraction_mode = Column(String)
+    webhook_url = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(Timestamp)  # Queued jobs aren't picked up before this (retry backoff)
+    lease_expires_at = Column(Timestamp, nullable=True)  # A running job whose lease lapsed belongs to a dead worker
+    document_type = Column(String, nullable=True)
+    features = Column(JSON, nullable=True)  # Partial while running, final once succeeded
+    field_errors = Column(JSON, nullable=True)
+    document_record_id = Column(Integer, ForeignKey("document_records.id"), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(Timestamp, server_default=func.now())
+    updated_at = Column(Timestamp, onupdate=func.now(), server_default=func.now())
+    finished_at = Column(Timestamp, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+    def __repr__(self):
+        return f"<Job(id='{self.id}', status='{self.status}', attempts={self.attempts})>"
@@ -0,0 +1,216 @@
+"""Image retention: purge the images of documents past their retention period, then give the space back.
+
+Documents older than the cutoff lose their image and thumbnail (or, with
+--delete-documents, are deleted outright along with their search index rows).
+Finished jobs older than the cutoff lose their uploaded image. Each batch is
+its own short transaction, so request handlers are never kept waiting for
+more than one batch. Blobs are deleted once no document or job refers to them;
+--sweep-blobs also removes any other unreferenced blob.
+
+On SQLite the freed pages are then released by incremental vacuum, a few at a
+time, and the file shrinks once the WAL is checkpointed. That needs
+auto_vacuum=INCREMENTAL, which new databases get from database.py; an existing
+database is converted once with a full VACUUM (--enable-incremental-vacuum),
+which does lock it for its duration. Run it from cron:
+
+    python retention.py --days 90 [--delete-documents] [--batch-size 500]
+    python retention.py --sweep-blobs
+    python retention.py --enable-incremental-vacuum
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Dict, Iterable, Set
+
+from sqlalchemy import delete, or_, select, text, union, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models
+from blobstore import BLOB_STORE_DIR, BlobStore
+
+logger = logging.getLogger(__name__)
+
+RETENTION_BATCH_SIZE = 500
+# A blob stored again this recently may belong to a request that hasn't saved its row yet
+BLOB_GRACE_SECONDS = 300
+VACUUM_PAGES_PER_STEP = 1000
+FINISHED_JOB_STATUSES = ("succeeded", "failed")
+
+
+def referenced_digests(db: Session, digests: Set[str]) -> Set[str]:
+    """The subset of digests some document or job still points to."""
+    if not digests:
+        return set()
+    stmt = union(
+        select(models.DocumentRecord.image_sha256).where(models.DocumentRecord.image_sha256.in_(digests)),
+        select(models.DocumentRecord.thumbnail_sha256).where(models.DocumentRecord.thumbnail_sha256.in_(digests)),
+        select(models.Job.image_sha256).where(models.Job.image_sha256.in_(digests)),
+    )
+    return set(db.scalars(stmt).all())
+
+
+def delete_unreferenced_blobs(db: Session, blob_store: BlobStore, digests: Iterable[str], started: float) -> int:
+    candidates = {digest for digest in digests if digest}
+    unreferenced = candidates - referenced_digests(db, candidates)
+    db.rollback() # End the read transaction
+    return sum(blob_store.delete(digest, unless_written_since=started - BLOB_GRACE_SECONDS) for digest in unreferenced)
+
+
+def purge_document_images(
+    db: Session,
+    blob_store: BlobStore,
+    cutoff: datetime,
+    batch_size: int = RETENTION_BATCH_SIZE,
+    delete_documents: bool = False,
+    pause_seconds: float = 0.0,
+) -> Dict[str, int]:
+    """Purge documents created before cutoff (naive UTC), one committed batch at a time. Returns counts."""
+    started = time.time()
+    counts = {"documents": 0, "jobs": 0, "blobs": 0}
+    last_id = 0
+    while True:
+        stmt = select(
+            models.DocumentRecord.id, models.DocumentRecord.image_sha256, models.DocumentRecord.thumbnail_sha256
+        ).where(models.DocumentRecord.created_at < cutoff, models.DocumentRecord.id > last_id)
+        if not delete_documents:
+            stmt = stmt.where(or_(
+                models.DocumentRecord.image_sha256.isnot(None),
+                models.DocumentRecord.thumbnail_sha256.isnot(None),
+                models.DocumentRecord.image_base64.isnot(None),
+            ))
+        batch = db.execute(stmt.order_by(models.DocumentRecord.id).limit(batch_size)).all()
+        if not batch:
+            db.rollback()
+            break
+        ids = [row.id for row in batch]
+        if delete_documents:
+            # Deleted explicitly: SQLite doesn't enforce the foreign keys, so ON DELETE CASCADE never fires
+            db.execute(delete(models.DocumentFeature).where(models.DocumentFeature.document_id.in_(ids)))
+            db.execute(update(models.Job).where(models.Job.document_record_id.in_(ids)).values(document_record_id=None))
+            db.execute(delete(models.DocumentRecord).where(models.DocumentRecord.id.in_(ids)))
+        else:
+            db.execute(
+                update(models.DocumentRecord)
+                .where(models.DocumentRecord.id.in_(ids))
+                .values(
+                    image_sha256=None,
+                    thumbnail_sha256=None,
+                    image_base64=None,
+                    # Set explicitly so the onupdate default doesn't reorder the history list
+                    updated_at=models.DocumentRecord.updated_at,
+                )
+            )
+        db.commit()
+        last_id = ids[-1]
+        counts["documents"] += len(batch)
+        digests = [digest for row in batch for digest in (row.image_sha256, row.thumbnail_sha256)]
+        counts["blobs"] += delete_unreferenced_blobs(db, blob_store, digests, started)
+        logger.info(f"Purged {counts['documents']} document(s), {counts['blobs']} blob(s)")
+        time.sleep(pause_seconds)
+
+    while True:
+        batch = db.execute(
+            select(models.Job.id, models.Job.image_sha256)
+            .where(
+                models.Job.created_at < cutoff,
+                models.Job.status.in_(FINISHED_JOB_STATUSES),
+                models.Job.image_sha256.isnot(None),
+            )
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            db.rollback()
+            break
+        db.execute(update(models.Job).where(models.Job.id.in_([row.id for row in batch])).values(image_sha256=None))
+        db.commit()
+        counts["jobs"] += len(batch)
+        counts["blobs"] += delete_unreferenced_blobs(db, blob_store, [row.image_sha256 for row in batch], started)
+        time.sleep(pause_seconds)
+    return counts
+
+
+def sweep_orphaned_blobs(db: Session, blob_store: BlobStore, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """Delete every blob no document or job refers to, such as those a purge skipped as recently stored."""
+    started = time.time()
+    removed = 0
+    digests = blob_store.digests()
+    while batch := list(islice(digests, batch_size)):
+        removed += delete_unreferenced_blobs(db, blob_store, batch, started)
+    return removed
+
+
+def release_free_pages(engine: Engine, pages_per_step: int = VACUUM_PAGES_PER_STEP, pause_seconds: float = 0.0) -> int:
+    """Incrementally vacuum a SQLite database's free pages; returns the number released (0 elsewhere)."""
+    if engine.dialect.name != "sqlite":
+        return 0
+    released = 0
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if connection.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+            logger.warning("auto_vacuum isn't INCREMENTAL; run `python retention.py --enable-incremental-vacuum` once to shrink the file.")
+            return 0
+        free_pages = connection.execute(text("PRAGMA freelist_count")).scalar()
+        while free_pages:
+            # Each step is its own short write transaction, so writers get in between steps. executescript
+            # because the sqlite3 module's execute() steps the pragma once, which releases a single page
+            connection.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({pages_per_step});")
+            remaining = connection.execute(text("PRAGMA freelist_count")).scalar()
+            if remaining >= free_pages:
+                break
+            released += free_pages - remaining
+            free_pages = remaining
+            time.sleep(pause_seconds)
+        # PASSIVE never waits on readers or blocks writers; a busy WAL is truncated by a later checkpoint
+        connection.execute(text("PRAGMA wal_checkpoint(PASSIVE)")).fetchall()
+    return released
+
+
+def enable_incremental_vacuum(engine: Engine):
+    """Switch an existing SQLite database to auto_vacuum=INCREMENTAL. Runs a full VACUUM, which locks the database."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+        connection.execute(text("VACUUM"))
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, engine
+    from migrations import setup_schema
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, help="Retention period; documents created earlier are purged")
+    parser.add_argument("--delete-documents", action="store_true", help="Delete the documents too, not only their images")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds to yield to other writers between batches")
+    parser.add_argument("--sweep-blobs", action="store_true", help="Also delete any unreferenced blob (walks the whole blob store)")
+    parser.add_argument("--no-vacuum", action="store_true", help="Skip releasing the freed pages")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true", help="Convert an existing SQLite database (full VACUUM)")
+    args = parser.parse_args()
+    if args.days is None and not (args.sweep_blobs or args.enable_incremental_vacuum):
+        parser.error("--days is required")
+
+    setup_schema(engine)
+    if args.enable_incremental_vacuum and engine.dialect.name == "sqlite":
+        enable_incremental_vacuum(engine)
+        print("auto_vacuum is now INCREMENTAL")
+    blob_store = BlobStore(BLOB_STORE_DIR)
+    db = SessionLocal()
+    try:
+        if args.days is not None:
+            cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=args.days)
+            counts = purge_document_images(db, blob_store, cutoff, args.batch_size, args.delete_documents, args.pause)
+            action = "Deleted" if args.delete_documents else "Purged the images of"
+            print(f"{action} {counts['documents']} document(s) created before {cutoff:%Y-%m-%d %H:%M} UTC; "
+                  f"cleared {counts['jobs']} job upload(s) and removed {counts['blobs']} blob(s)")
+        if args.sweep_blobs:
+            print(f"Removed {sweep_orphaned_blobs(db, blob_store, args.batch_size)} unreferenced blob(s)")
+    finally:
+        db.close()
+    if args.days is not None and not args.no_vacuum:
+        size_before = os.path.getsize(engine.url.database) if engine.dialect.name == "sqlite" else 0
+        pages = release_free_pages(engine, pause_seconds=args.pause)
+        if pages:
+            print(f"Released {pages} free page(s); database file {size_before:,} -> {os.path.getsize(engine.url.database):,} bytes")
@@ -1,29 +1,82 @@
-from pydantic import BaseModel, ConfigDict
-from typing import Dict, Optional, List
+from pydantic import BaseModel, ConfigDict, create_model
+from typing import Dict, Optional, List, Type
 from datetime import datetime
 
 # Base schema for features, can be extended if specific feature keys are known/enforced
 class FeaturesModel(BaseModel):
     model_config = ConfigDict(extra='allow') # Allows arbitrary key-value pairs
 
+def build_features_model(document_type: str, fields: List[str]) -> Type[BaseModel]:
+    # Every configured field is required (null allowed), so a missing key is a validation error
+    field_definitions = {field_key: (Optional[str], ...) for field_key in fields}
+    model_name = "".join(part.capitalize() for part in document_type.split("_")) + "Features"
+    return create_model(model_name, __config__=ConfigDict(extra='ignore', strict=True), **field_definitions)
+
 class DocumentRecordBase(BaseModel):
     original_filename: str
     document_type: str
     features: Dict[str, Optional[str]] # Allows any string keys, values are string or null
 
 class DocumentRecordCreate(DocumentRecordBase):
-    image_base64: str # Required when creating a new record
+    image_sha256: str # Blob store keys; the image bytes themselves never go in the row
+    image_mime_type: str
+    thumbnail_sha256: str
+    sources: Dict[str, str] = {} # document_type/field -> the model (or local decoder) that produced it
 
 class DocumentRecordUpdate(BaseModel): # All fields optional for update
     document_type: Optional[str] = None
     features: Optional[Dict[str, Optional[str]]] = None
-    # original_filename and image_base64 are not typically updated directly here.
+    # original_filename and the image are not typically updated directly here.
     # Re-uploading an image would likely create a new record or be a more complex operation.
 
 class DocumentRecordResponse(DocumentRecordBase):
     id: int
-    image_base64: str # Return image for frontend history display
+    image_sha256: Optional[str] = None # Image itself is served from /documents/{id}/image and /documents/{id}/thumbnail
+    sources: Optional[Dict[str, str]] = None # Null for documents saved before provenance was recorded
     created_at: datetime
     updated_at: datetime
+    field_errors: Dict[str, str] = {} # Per-field extraction failures; only populated on /classify
 
     model_config = ConfigDict(from_attributes=True) # Pydantic V2 for ORM mode (formerly orm_mode)
+
+
+class DocumentSummary(BaseModel): # Listing projection: never carries image data
+    id: int
+    original_filename: str
+    document_type: str
+    features: Dict[str, Optional[str]]
+    created_at: datetime
+    updated_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+class DocumentSummaryPage(BaseModel):
+    items: List[DocumentSummary]
+    next_cursor: Optional[str] = None # Pass back as ?cursor= for the next page; null on the last page
+
+
+class BatchItemResult(BaseModel): # One NDJSON line from POST /classify/batch
+    index: int # Position of the image in the upload (zip members are numbered in archive order)
+    filename: str
+    status: str # "ok" or "error"
+    document: Optional[DocumentRecordResponse] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+
+class JobResponse(BaseModel): # POST /jobs and GET /jobs/{id}; also the webhook payload
+    id: str
+    status: str # queued, running, succeeded or failed
+    original_filename: Optional[str] = None
+    extraction_mode: Optional[str] = None
+    attempts: int
+    document_type: Optional[str] = None
+    features: Optional[Dict[str, Optional[str]]] = None # Fields extracted so far while running
+    field_errors: Optional[Dict[str, str]] = None
+    document_record_id: Optional[int] = None # Set once succeeded; the saved document is at /documents/{id}
+    error: Optional[str] = None # Last failure; kept while a retry is queued
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,48 @@
+"""Production launcher: set up the database once, then serve server:app from N worker processes.
+
+The schema is created and upgraded here, before any worker starts, so workers
+skip it (DB_SCHEMA_SETUP=false). The workers share one listening socket, and
+their upstream rate limits, cache invalidation and readiness count go through a
+shared state file (see shared_state.py). GET /ready answers 200 once every
+worker is warm.
+
+    python serve.py [--workers 4] [--host 0.0.0.0] [--port 8000]
+"""
+import argparse
+import logging
+import os
+import tempfile
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+
+def main(workers: int, host: str, port: int):
+    from database import engine
+    from migrations import setup_schema
+    from shared_state import SharedState
+
+    setup_schema(engine)
+    engine.dispose() # Each worker opens its own connections
+    shared_state_path = os.getenv("SHARED_STATE_PATH") or os.path.join(tempfile.mkdtemp(prefix="id-classifier-"), "state")
+    # Recreated on every start, so no rate-limit levels or worker heartbeats carry over from an earlier run
+    SharedState.create(shared_state_path).close()
+    # Inherited by the worker processes, which read them when they import server
+    os.environ.update({
+        "DB_SCHEMA_SETUP": "false",
+        "SHARED_STATE_PATH": shared_state_path,
+        "SERVE_WORKERS": str(workers),
+    })
+    logger.info(f"Starting {workers} worker(s) on {host}:{port}; shared state in {shared_state_path}")
+    uvicorn.run("server:app", host=host, port=port, workers=workers)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    main(args.workers, args.host, args.port)
@@ -1,33 +1,172 @@
 import os
+import asyncio
 import base64
+import hashlib
+import io
 import json
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Depends
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+from contextvars import ContextVar
+from functools import cached_property
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Depends, Query, Response
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from openai import AsyncOpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
-from PIL import Image
-import io
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
 import logging
-from typing import List
-from sqlalchemy.orm import Session
+from typing import Awaitable, BinaryIO, Callable, Dict, List, Literal, Optional, Tuple, TypeVar, Union
+from PIL import Image
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 import crud
+import metrics
 import models
+from cache import ExtractionCache, make_cache_key
+from imaging import OUTPUT_MIME_TYPES, ImageRejectedError, make_thumbnail, normalize_image
+from blobstore import BLOB_STORE_DIR, BlobStore
+from uploads import (
+    IMAGE_MIME_TYPES, ZIP_MIME_TYPE, BodySizeLimitMiddleware, ReceivedUpload, UnsupportedUploadError,
+    UploadTooLargeError, receive_upload, received_from_bytes
+)
+from local_classifier import load_local_classifier
+from machine_readable import MachineReadableResult, load_machine_readable_decoder
+import feature_index
+from field_validation import is_valid
+from governor import CircuitBreaker, CircuitOpenError, UpstreamGovernor
+from jobs import JobWorkerPool, PermanentJobError, ProgressCallback, WebhookURLError, check_webhook_url
+import migrations
+from export import EXPORT_MEDIA_TYPES, ExportWriter, aiter_export_batches, attach_images, configured_feature_fields
 import schemas
-from database import SessionLocal, engine, get_db
+from database import AsyncSessionLocal, async_engine, engine, get_async_db
+from shared_state import load_shared_state
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-models.Base.metadata.create_all(bind=engine)
 
 load_dotenv()
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_SITE_URL = os.getenv("OPENROUTER_SITE_URL", "http://localhost:8000")
 OPENROUTER_APP_NAME = os.getenv("OPENROUTER_APP_NAME", "ID Classifier App")
-OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
-MODEL_NAME = "google/gemini-2.5-flash-preview"
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1") # Point at a local fake for testing
+MODEL_NAME = os.getenv("MODEL_NAME", "google/gemini-2.5-flash-preview")
+# Comma-separated, fastest/cheapest first. A field whose answer fails validation (field_validation.py) or comes back
+# not found is asked again of the next model; the last model's answer stands. Defaults to MODEL_NAME alone.
+MODEL_CASCADE = [model.strip() for model in os.getenv("MODEL_CASCADE", MODEL_NAME).split(",") if model.strip()]
 
 NOT_FOUND_PLACEHOLDER = "VALUE_NOT_FOUND"
 
+# Caps on in-flight upstream calls: one shared across the whole process, one per /classify request.
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "16"))
+FIELD_EXTRACTION_CONCURRENCY = int(os.getenv("FIELD_EXTRACTION_CONCURRENCY", "8"))
+FIELD_EXTRACTION_TIMEOUT_SECONDS = float(os.getenv("FIELD_EXTRACTION_TIMEOUT_SECONDS", "30"))
+
+# Upstream governor: rate limits (0 disables), retries, circuit breaker and hedging; see governor.py.
+# UPSTREAM_HEDGE_AFTER is a number of seconds, "p95" to track observed latency, or empty to disable.
+UPSTREAM_REQUESTS_PER_SECOND = float(os.getenv("UPSTREAM_REQUESTS_PER_SECOND", "20"))
+UPSTREAM_REQUEST_BURST = float(os.getenv("UPSTREAM_REQUEST_BURST", str(UPSTREAM_REQUESTS_PER_SECOND / 2)))
+UPSTREAM_TOKENS_PER_MINUTE = float(os.getenv("UPSTREAM_TOKENS_PER_MINUTE", "0"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_RETRY_BASE_DELAY_SECONDS = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+UPSTREAM_RETRY_MAX_DELAY_SECONDS = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY_SECONDS", "20"))
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_RESET_SECONDS = float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", "30"))
+UPSTREAM_HEDGE_AFTER = os.getenv("UPSTREAM_HEDGE_AFTER", "")
+# Reserved per image against the tokens-per-minute bucket until the response reports real usage
+# (Gemini bills 258 tokens per 768px tile; a 1600x1200 image is 6 tiles)
+UPSTREAM_IMAGE_TOKEN_ESTIMATE = int(os.getenv("UPSTREAM_IMAGE_TOKEN_ESTIMATE", "1548"))
+# A worker's upstream calls share pooled HTTP/2 connections (HTTP/1.1 if the h2 package isn't installed)
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "true").lower() in ("1", "true", "yes")
+UPSTREAM_KEEPALIVE_SECONDS = float(os.getenv("UPSTREAM_KEEPALIVE_SECONDS", "300"))
+
+# Multi-worker deployments (serve.py): the schema is set up once by the launcher rather than by every worker
+# (DB_SCHEMA_SETUP=false), and rate limits, cache invalidation and readiness go through a file all workers map.
+DB_SCHEMA_SETUP = os.getenv("DB_SCHEMA_SETUP", "true").lower() in ("1", "true", "yes")
+shared_state = load_shared_state(os.getenv("SHARED_STATE_PATH"))
+# /ready waits for this many warm workers. Each warm worker heartbeats every WARM_HEARTBEAT_SECONDS, and one silent
+# for three intervals (crashed, or wedged) no longer counts
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "1"))
+WARM_HEARTBEAT_SECONDS = float(os.getenv("WARM_HEARTBEAT_SECONDS", "1.0"))
+
+# "per_field": one classification call plus one call per field.
+# "single_call": one call returning document_type and every field as JSON; per-field calls only as fallback.
+EXTRACTION_MODES = ("per_field", "single_call")
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "per_field")
+if EXTRACTION_MODE not in EXTRACTION_MODES:
+    raise ValueError(f"EXTRACTION_MODE must be one of {EXTRACTION_MODES}, got '{EXTRACTION_MODE}'")
+
+# Optional ONNX pre-classifier (see train_local_classifier.py). In per_field mode a prediction at or
+# above the threshold replaces the upstream classification call; anything less falls back to the LLM.
+LOCAL_CLASSIFIER_MODEL = os.getenv("LOCAL_CLASSIFIER_MODEL")
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.9"))
+local_classifier = load_local_classifier(LOCAL_CLASSIFIER_MODEL)
+
+# Passport/EAD machine-readable zones and license PDF417 barcodes are decoded on CPU first; their check-digit-valid
+# values skip the model (and so does classification). Needs the optional zxing-cpp and/or rapidocr-onnxruntime packages.
+MACHINE_READABLE_DECODE = os.getenv("MACHINE_READABLE_DECODE", "true").lower() in ("1", "true", "yes")
+machine_readable_decoder = load_machine_readable_decoder(MACHINE_READABLE_DECODE)
+
+# POST /classify/batch: documents processed at once per batch, and how successful results are grouped into commits
+BATCH_MAX_DOCUMENTS = int(os.getenv("BATCH_MAX_DOCUMENTS", "500"))
+BATCH_DOCUMENT_CONCURRENCY = int(os.getenv("BATCH_DOCUMENT_CONCURRENCY", "8"))
+BATCH_COMMIT_SIZE = int(os.getenv("BATCH_COMMIT_SIZE", "25"))
+BATCH_COMMIT_INTERVAL_SECONDS = float(os.getenv("BATCH_COMMIT_INTERVAL_SECONDS", "1.0"))
+# Cap on a batch's images once zips are expanded (413 beyond it). Images wait in temporary files, not memory,
+# until their turn; each keeps up to BATCH_SPOOL_MEMORY_BYTES in memory before spilling to disk.
+BATCH_MAX_TOTAL_BYTES = int(os.getenv("BATCH_MAX_TOTAL_BYTES", str(1024 * 1024 * 1024)))
+BATCH_SPOOL_MEMORY_BYTES = int(os.getenv("BATCH_SPOOL_MEMORY_BYTES", str(256 * 1024)))
+
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "1024"))
+EXTRACTION_CACHE_PERSIST = os.getenv("EXTRACTION_CACHE_PERSIST", "true").lower() in ("1", "true", "yes")
+# Uploads are EXIF-rotated, downscaled and re-encoded in a thread pool before being sent upstream
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1600"))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "40000000"))
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+if IMAGE_OUTPUT_FORMAT not in OUTPUT_MIME_TYPES:
+    raise ValueError(f"IMAGE_OUTPUT_FORMAT must be one of {tuple(OUTPUT_MIME_TYPES)}, got '{IMAGE_OUTPUT_FORMAT}'")
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+# Largest accepted image (413 beyond it; zip members count individually), and largest request body of any kind,
+# refused while it arrives. Uploads are hashed and sniffed in one streaming pass; their content decides the format.
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(256 * 1024 * 1024)))
+
+blob_store = BlobStore(BLOB_STORE_DIR)
+# A document's image never changes, so clients may cache it for as long as they like
+BLOB_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# POST /jobs: queued jobs run on JOB_WORKERS in-process workers (0 leaves them to `python worker.py`).
+# Submissions beyond JOB_MAX_QUEUE_DEPTH queued or running jobs get a 429.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_QUEUE_DEPTH = int(os.getenv("JOB_MAX_QUEUE_DEPTH", "1000"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_DELAY_SECONDS = float(os.getenv("JOB_RETRY_BASE_DELAY_SECONDS", "5"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+# Comma-separated hosts webhook_url may point at. Empty allows any host that resolves only to public addresses.
+JOB_WEBHOOK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+
+# /documents/search?fuzzy=true: minimum difflib similarity between a searched and an indexed name word
+SEARCH_FUZZY_MIN_SIMILARITY = float(os.getenv("SEARCH_FUZZY_MIN_SIMILARITY", "0.8"))
+
+# Set while a job or /classify/stream request runs, so the document type and fields are reported as they arrive
+extraction_progress: ContextVar[Optional[ProgressCallback]] = ContextVar("extraction_progress", default=None)
+
+# Adds a Server-Timing header with the per-stage breakdown of each request (also exported at /metrics)
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
+extraction_cache = ExtractionCache(
+    max_entries=EXTRACTION_CACHE_MAX_ENTRIES, persist=EXTRACTION_CACHE_PERSIST, shared_state=shared_state
+)
+
 app = FastAPI(
     title="ID Document Classifier and Extractor",
     description="Upload an image to classify, extract features, and save edits.",
@@ -38,6 +177,8 @@ origins = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
 ]
+# Added first so CORS stays outermost and 413s still carry CORS headers
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=UPLOAD_MAX_REQUEST_BYTES)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -46,13 +187,65 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+if SERVER_TIMING_HEADER:
+    @app.middleware("http")
+    async def add_server_timing_header(request: Request, call_next):
+        timings = {}
+        token = metrics.request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            metrics.request_timings.reset(token)
+        timings["total"] = time.perf_counter() - start
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+        return response
+
+
+
+def make_upstream_http_client() -> httpx.AsyncClient:
+    http2 = UPSTREAM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("UPSTREAM_HTTP2 is set but the h2 package isn't installed; using HTTP/1.1.")
+            http2 = False
+    # Connections are kept for reuse; over HTTP/1.1 one per concurrent call, over HTTP/2 calls share them
+    return DefaultAsyncHttpxClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONCURRENCY,
+            max_keepalive_connections=UPSTREAM_MAX_CONCURRENCY,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_SECONDS,
+        ),
+    )
+
+
 client = AsyncOpenAI(
     base_url=OPENROUTER_BASE_URL,
     api_key=OPENROUTER_API_KEY,
     default_headers={
         "HTTP-Referer": OPENROUTER_SITE_URL,
         "X-Title": OPENROUTER_APP_NAME,
-    }
+    },
+    max_retries=0, # Retries are the governor's job, so they respect its rate limits and circuit breaker
+    http_client=make_upstream_http_client(),
+)
+upstream = UpstreamGovernor(
+    # Looked up per call, so client.chat.completions.create can be swapped out in benchmarks
+    lambda **params: client.chat.completions.create(**params),
+    max_concurrency=UPSTREAM_MAX_CONCURRENCY,
+    requests_per_second=UPSTREAM_REQUESTS_PER_SECOND,
+    request_burst=UPSTREAM_REQUEST_BURST,
+    tokens_per_minute=UPSTREAM_TOKENS_PER_MINUTE,
+    max_retries=UPSTREAM_MAX_RETRIES,
+    retry_base_delay=UPSTREAM_RETRY_BASE_DELAY_SECONDS,
+    retry_max_delay=UPSTREAM_RETRY_MAX_DELAY_SECONDS,
+    breaker=CircuitBreaker(UPSTREAM_BREAKER_FAILURES, UPSTREAM_BREAKER_RESET_SECONDS),
+    hedge_after=UPSTREAM_HEDGE_AFTER or None,
+    shared_state=shared_state,
 )
 
 VALID_DOCUMENT_TYPES = ["passport", "drivers_license", "ead_card"]
@@ -62,7 +255,7 @@ FEATURE_EXTRACTION_CONFIG = {
         "display_names": {
             "full_name": "full name (given name then surname)",
             "date_of_birth": "date of birth (in YYYY-MM-DD format)",
-            "country": "issuing country (short code)",
+            "country": "issuing country (ISO 3166-1 alpha-3 code, e.g. USA)",
             "issue_date": "issue date (in YYYY-MM-DD format)",
             "expiration_date": "expiration date (in YYYY-MM-DD format)"
         }
@@ -89,19 +282,116 @@ FEATURE_EXTRACTION_CONFIG = {
         }
     }
 }
-async def get_image_content(image_file: UploadFile):
-    contents = await image_file.read()
+STRUCTURED_FEATURE_MODELS = {
+    document_type: schemas.build_features_model(document_type, config["fields"])
+    for document_type, config in FEATURE_EXTRACTION_CONFIG.items()
+}
+
+CLASSIFICATION_PROMPT = (
+    "Analyze the provided image. Is it a passport, a driver's license, or an EAD card (Employment Authorization Document)? "
+    "Respond with ONLY one of the following lowercase snake_case strings: 'passport', 'drivers_license', or 'ead_card'. "
+    "Do not include any other text, explanation, or punctuation."
+)
+
+
+def get_config_fingerprint() -> str:
+    # Any change to prompts or field config changes this, so stale cache entries stop matching
+    prompt_material = {
+        "image_normalization": [IMAGE_MAX_DIMENSION, IMAGE_OUTPUT_FORMAT, IMAGE_QUALITY],
+        "classification_prompt": CLASSIFICATION_PROMPT,
+        "structured_prompt": get_structured_extraction_prompt(),
+        "field_prompts": {
+            document_type: [
+                get_single_feature_prompt(
+                    document_type.replace("_", " "),
+                    field_key,
+                    config["display_names"].get(field_key, field_key.replace("_", " "))
+                )
+                for field_key in config["fields"]
+            ]
+            for document_type, config in FEATURE_EXTRACTION_CONFIG.items()
+        },
+    }
+    if machine_readable_decoder is not None:
+        prompt_material["machine_readable"] = machine_readable_decoder.backends
+    if local_classifier is not None:
+        prompt_material["local_classifier"] = [
+            hashlib.sha256(local_classifier.model_bytes).hexdigest(), LOCAL_CLASSIFIER_THRESHOLD
+        ]
+    return hashlib.sha256(json.dumps(prompt_material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class PreparedImage:
+    def __init__(self, original_sha256: str, normalized: bytes, mime_type: str):
+        self.original_sha256 = original_sha256 # Hash of the upload as received; the cache key is computed from it
+        self.normalized = normalized # What is sent upstream and stored in the blob store
+        self.mime_type = mime_type
+
+    @cached_property
+    def data_url(self) -> str:
+        # Built on first use, so cache hits never base64-encode the image
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.normalized).decode('ascii')}"
+
+
+def encode_image_for_upstream(source: Union[bytes, BinaryIO], sha256: Optional[str] = None) -> PreparedImage:
+    if sha256 is None:
+        sha256 = hashlib.sha256(source).hexdigest()
+    normalized, mime_type = normalize_image(
+        source,
+        max_dimension=IMAGE_MAX_DIMENSION,
+        max_pixels=IMAGE_MAX_PIXELS,
+        output_format=IMAGE_OUTPUT_FORMAT,
+        quality=IMAGE_QUALITY
+    )
+    return PreparedImage(sha256, normalized, mime_type)
+
+
+def upload_error(e: ValueError) -> HTTPException:
+    logger.warning(f"Rejected upload: {e}")
+    if isinstance(e, UploadTooLargeError):
+        return HTTPException(status_code=413, detail=str(e))
+    return HTTPException(status_code=415, detail=str(e))
+
+
+async def receive_image_upload(image_file: UploadFile) -> ReceivedUpload:
+    """Hash, measure and sniff the spooled upload in a worker thread, without reading it into memory."""
     try:
-        Image.open(io.BytesIO(contents)).verify()
-    except Exception as e:
-        logger.error(f"Invalid image file: {e}")
-        raise HTTPException(status_code=400, detail=f"Invalid image file: {e}")
+        with metrics.stage("upload_read"):
+            return await asyncio.get_running_loop().run_in_executor(
+                image_executor, receive_upload, image_file.file, UPLOAD_MAX_BYTES
+            )
+    except (UploadTooLargeError, UnsupportedUploadError) as e:
+        raise upload_error(e)
+
+
+async def get_image_content(image_file: UploadFile) -> PreparedImage:
+    received = await receive_image_upload(image_file)
+    return await prepare_received_image(received.file, received.sha256)
+
+
+async def prepare_image(contents: bytes) -> PreparedImage:
+    """prepare_received_image for an image already in memory (batch items, job blobs), with the same checks."""
+    try:
+        received = await asyncio.get_running_loop().run_in_executor(
+            image_executor, received_from_bytes, contents, UPLOAD_MAX_BYTES
+        )
+    except (UploadTooLargeError, UnsupportedUploadError) as e:
+        raise upload_error(e)
+    return await prepare_received_image(contents, received.sha256)
+
+
+async def prepare_received_image(source: Union[bytes, BinaryIO], sha256: str) -> PreparedImage:
+    loop = asyncio.get_running_loop()
+    try:
+        with metrics.stage("image_encode"):
+            return await loop.run_in_executor(image_executor, encode_image_for_upstream, source, sha256)
+    except ImageRejectedError as e:
+        logger.error(f"Rejected upload: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
 
-    if image_file.content_type not in ["image/jpeg", "image/png", "image/webp"]:
-        logger.warning(f"Unsupported image type: {image_file.content_type}. Proceeding...")
 
-    base64_image = base64.b64encode(contents).decode("utf-8")
-    return f"data:{image_file.content_type};base64,{base64_image}"
+def store_image_blobs(normalized: bytes) -> Tuple[str, str]:
+    return blob_store.put(normalized), blob_store.put(make_thumbnail(normalized))
 
 
 def get_single_feature_prompt(document_type_display: str, feature_name_key: str, feature_display_name: str) -> str:
@@ -114,7 +404,75 @@ def get_single_feature_prompt(document_type_display: str, feature_name_key: str,
         f"respond with the exact string: {NOT_FOUND_PLACEHOLDER}"
     )
 
-async def call_gemini_vision_api(prompt: str, base64_image_data_url: str):
+def get_structured_extraction_prompt() -> str:
+    field_lines = []
+    for document_type, config in FEATURE_EXTRACTION_CONFIG.items():
+        field_descriptions = ", ".join(
+            f'"{field_key}": {config["display_names"].get(field_key, field_key.replace("_", " "))}'
+            for field_key in config["fields"]
+        )
+        field_lines.append(f'- if "{document_type}": {field_descriptions}')
+    return (
+        "Analyze the provided image. Is it a passport, a driver's license, or an EAD card (Employment Authorization Document)? "
+        "Then extract the fields listed for that document type. "
+        "Respond with ONLY a JSON object of the form "
+        '{"document_type": "<type>", "features": {"<field>": "<value>", ...}} '
+        "where <type> is one of 'passport', 'drivers_license', or 'ead_card', and features has exactly these keys:\n"
+        + "\n".join(field_lines) + "\n"
+        "Every value must be a string. "
+        f"If a field is not visible, unreadable, or cannot be found, use the exact string: {NOT_FOUND_PLACEHOLDER}"
+    )
+
+
+def parse_structured_extraction(raw_response: str) -> Tuple[Optional[str], Dict[str, Optional[str]], List[str]]:
+    """Parse and validate a single-call extraction response.
+
+    Returns (document_type, features, fields_needing_fallback). document_type is
+    None when the response is unusable, in which case callers should fall back
+    to the per-field pipeline entirely.
+    """
+    cleaned = raw_response.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.strip("`")
+        cleaned = cleaned[len("json"):] if cleaned.lower().startswith("json") else cleaned
+    try:
+        payload = json.loads(cleaned)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Structured extraction response is not valid JSON: {e}")
+        return None, {}, []
+    if not isinstance(payload, dict):
+        return None, {}, []
+
+    document_type = str(payload.get("document_type", "")).strip().lower().replace(" ", "_")
+    if document_type not in VALID_DOCUMENT_TYPES:
+        logger.warning(f"Structured extraction returned unexpected document type: '{document_type}'")
+        return None, {}, []
+
+    raw_features = payload.get("features")
+    if not isinstance(raw_features, dict):
+        raw_features = {}
+    fields_needing_fallback = []
+    try:
+        STRUCTURED_FEATURE_MODELS[document_type].model_validate(raw_features)
+    except ValidationError as e:
+        fields_needing_fallback = sorted({str(error["loc"][0]) for error in e.errors() if error["loc"]})
+
+    features = {}
+    for field_key in FEATURE_EXTRACTION_CONFIG[document_type]["fields"]:
+        if field_key in fields_needing_fallback:
+            continue
+        value = (raw_features[field_key] or "").strip('"').strip("'").strip()
+        features[field_key] = None if value == NOT_FOUND_PLACEHOLDER or not value else value
+    return document_type, features, fields_needing_fallback
+
+
+async def call_gemini_vision_api(
+    prompt: str,
+    base64_image_data_url: str,
+    max_tokens: int = 250,
+    response_format: Optional[dict] = None,
+    model: str = MODEL_NAME
+):
     messages = [
         {
             "role": "user",
@@ -125,103 +483,913 @@ async def call_gemini_vision_api(prompt: str, base64_image_data_url: str):
         }
     ]
     completion_params = {
-        "model": MODEL_NAME,
+        "model": model,
         "messages": messages,
-        "max_tokens": 250,
+        "max_tokens": max_tokens,
         "temperature": 0.1,
     }
-    logger.info(f"Sending request to Gemini. Prompt: '{prompt[:150]}...'")
+    if response_format:
+        completion_params["response_format"] = response_format
+    # Prompts are fixed text but responses are document contents (PII), so both stay at DEBUG
+    logger.debug(f"Sending request to Gemini. Prompt: '{prompt[:150]}...'")
+    estimated_tokens = len(prompt) // 4 + UPSTREAM_IMAGE_TOKEN_ESTIMATE + max_tokens
     try:
-        completion = await client.chat.completions.create(**completion_params)
+        completion = await upstream.create(estimated_tokens=estimated_tokens, **completion_params)
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            metrics.UPSTREAM_TOKENS.inc("prompt", amount=usage.prompt_tokens or 0)
+            metrics.UPSTREAM_TOKENS.inc("completion", amount=usage.completion_tokens or 0)
         response_content = completion.choices[0].message.content.strip()
-        logger.info(f"Received response from Gemini: '{response_content}'")
+        logger.debug(f"Received response from Gemini: '{response_content}'")
         return response_content
+    except CircuitOpenError as e:
+        metrics.UPSTREAM_ERRORS.inc(type(e).__name__)
+        logger.error(f"Not calling Gemini API: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
     except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(type(e).__name__)
         logger.error(f"Error calling Gemini API: {e}")
         raise HTTPException(status_code=503, detail=f"Error communicating with AI model: {str(e)}")
 
-@app.post("/classify", response_model=schemas.DocumentRecordResponse)
-async def classify_and_extract_and_save(
-    request: Request,
-    image: UploadFile = File(...),
-    db: Session = Depends(get_db)
-):
-    logger.info(f"Received request for /classify from {request.client.host}")
+def report_extraction_progress(document_type: str, features: Dict[str, Optional[str]]):
+    report_progress = extraction_progress.get()
+    if report_progress is not None:
+        report_progress(document_type, features)
 
-    if not OPENROUTER_API_KEY:
-        logger.error("OpenRouter API key not configured.")
-        raise HTTPException(status_code=500, detail="Server configuration error: API key missing.")
 
-    original_filename = image.filename if image.filename else "uploaded_image.png" # Ensure a default
-    base64_image_data_url = await get_image_content(image)
+CascadeAnswer = TypeVar("CascadeAnswer")
 
-    # --- Step 1: Classify Document Type ---
-    classification_prompt = (
-        "Analyze the provided image. Is it a passport, a driver's license, or an EAD card (Employment Authorization Document)? "
-        "Respond with ONLY one of the following lowercase snake_case strings: 'passport', 'drivers_license', or 'ead_card'. "
-        "Do not include any other text, explanation, or punctuation."
+
+async def ask_model_cascade(
+    call: str,
+    description: str,
+    ask: Callable[[str], Awaitable[CascadeAnswer]],
+    outcome: Callable[[CascadeAnswer], str],
+    first_tier: int = 0
+) -> Tuple[CascadeAnswer, str]:
+    """Ask each MODEL_CASCADE tier from first_tier until outcome() is "accepted"; returns the answer and its model.
+
+    Upstream errors are not escalated: they propagate as they would with one model.
+    """
+    for tier in range(first_tier, len(MODEL_CASCADE)):
+        model = MODEL_CASCADE[tier]
+        try:
+            answer = await ask(model)
+        except BaseException:
+            metrics.CASCADE_RESULTS.inc(call, str(tier), model, "error")
+            raise
+        answer_outcome = outcome(answer)
+        metrics.CASCADE_RESULTS.inc(call, str(tier), model, answer_outcome)
+        if answer_outcome == "accepted" or tier == len(MODEL_CASCADE) - 1:
+            return answer, model
+        logger.info(f"Escalating {description} from {model} to {MODEL_CASCADE[tier + 1]} ({answer_outcome})")
+    raise ValueError(f"first_tier {first_tier} is past the end of MODEL_CASCADE")
+
+
+def field_outcome(field_key: str, value: Optional[str]) -> str:
+    if value is None:
+        return "not_found"
+    return "accepted" if is_valid(field_key, value) else "invalid"
+
+
+async def extract_single_feature(
+    document_type: str,
+    field_key: str,
+    base64_image_data_url: str,
+    request_semaphore: asyncio.Semaphore,
+    first_tier: int = 0
+) -> Tuple[Optional[str], str]:
+    """The field's value (None if not found) and the model that produced it."""
+    config = FEATURE_EXTRACTION_CONFIG[document_type]
+    feature_display_name = config["display_names"].get(field_key, field_key.replace("_", " "))
+    extraction_prompt = get_single_feature_prompt(
+        document_type.replace("_", " "),
+        field_key,
+        feature_display_name
+    )
+
+    async def ask(model: str) -> Optional[str]:
+        start = time.perf_counter()
+        with metrics.stage("field_extraction"):
+            async with request_semaphore:
+                raw_feature_value = await asyncio.wait_for(
+                    call_gemini_vision_api(extraction_prompt, base64_image_data_url, model=model),
+                    timeout=FIELD_EXTRACTION_TIMEOUT_SECONDS
+                )
+        metrics.FIELD_SECONDS.observe(time.perf_counter() - start, document_type, field_key)
+        cleaned_value = raw_feature_value.strip('"').strip("'").strip()
+        if cleaned_value == NOT_FOUND_PLACEHOLDER or not cleaned_value:
+            return None
+        return cleaned_value
+
+    cleaned_value, model = await ask_model_cascade(
+        "field", f"'{field_key}' for {document_type}", ask,
+        lambda value: field_outcome(field_key, value), first_tier
+    )
+    report_extraction_progress(document_type, {field_key: cleaned_value})
+    return cleaned_value, model
+
+
+async def extract_features(
+    document_type: str,
+    base64_image_data_url: str,
+    max_concurrency: int = FIELD_EXTRACTION_CONCURRENCY,
+    fields: Optional[List[str]] = None,
+    first_tier: int = 0
+) -> Tuple[Dict[str, Optional[str]], Dict[str, str], Dict[str, str]]:
+    """Extract every configured field (or just `fields`) concurrently.
+
+    Returns the features dict (failed fields map to None), a dict of field
+    name -> error message for the fields whose upstream call failed, and a dict
+    of field name -> model for the fields that got an answer.
+    """
+    fields_to_extract = fields if fields is not None else FEATURE_EXTRACTION_CONFIG[document_type]["fields"]
+    request_semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    results = await asyncio.gather(
+        *(extract_single_feature(document_type, field_key, base64_image_data_url, request_semaphore, first_tier)
+          for field_key in fields_to_extract),
+        return_exceptions=True
+    )
+
+    extracted_features = {}
+    field_errors = {}
+    sources = {}
+    for field_key, result in zip(fields_to_extract, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.TimeoutError):
+                error_message = f"timed out after {FIELD_EXTRACTION_TIMEOUT_SECONDS}s"
+            elif isinstance(result, HTTPException):
+                error_message = str(result.detail)
+            else:
+                error_message = str(result) or type(result).__name__
+            logger.warning(f"Extraction of field '{field_key}' for {document_type} failed: {error_message}")
+            extracted_features[field_key] = None
+            field_errors[field_key] = error_message
+        else:
+            extracted_features[field_key], sources[field_key] = result
+    return extracted_features, field_errors, sources
+
+
+async def classify_document_type(base64_image_data_url: str) -> Tuple[str, str]:
+    """The document type and the model that classified it."""
+    async def ask(model: str) -> str:
+        with metrics.stage("classification"):
+            raw_doc_type = await call_gemini_vision_api(CLASSIFICATION_PROMPT, base64_image_data_url, model=model)
+        return raw_doc_type.strip().lower().replace(" ", "_")
+
+    document_type, model = await ask_model_cascade(
+        "classification", "classification", ask,
+        lambda document_type: "accepted" if document_type in VALID_DOCUMENT_TYPES else "invalid"
     )
-    raw_doc_type = await call_gemini_vision_api(classification_prompt, base64_image_data_url)
-    document_type = raw_doc_type.strip().lower().replace(" ", "_")
 
     if document_type not in VALID_DOCUMENT_TYPES:
-        logger.warning(f"Classification failed or returned unexpected type: '{document_type}' from raw: '{raw_doc_type}'")
+        logger.warning(f"Classification failed or returned unexpected type: '{document_type}' from {model}")
         # Try to save with an 'unknown' type or a default? Or fail? For now, fail.
         raise HTTPException(
             status_code=422,
             detail=f"Could not classify or unsupported document type: '{document_type}'. Expected one of {VALID_DOCUMENT_TYPES}."
         )
-    logger.info(f"Classified document as: {document_type}")
+    logger.info(f"Classified document as: {document_type} ({model})")
+    return document_type, model
+
+
+async def classify_document_type_locally(image_bytes: bytes) -> Optional[str]:
+    """Document type from the local classifier, or None when it is disabled, unsure or fails."""
+    if local_classifier is None:
+        return None
+    try:
+        with metrics.stage("local_classification"):
+            document_type, confidence = await asyncio.get_running_loop().run_in_executor(
+                image_executor, local_classifier.predict, image_bytes
+            )
+    except Exception as e:
+        logger.warning(f"Local classifier failed, falling back to the LLM: {e}")
+        return None
+    if document_type not in VALID_DOCUMENT_TYPES or confidence < LOCAL_CLASSIFIER_THRESHOLD:
+        logger.info(f"Local classifier unsure ({document_type}, {confidence:.3f}); falling back to the LLM.")
+        return None
+    logger.info(f"Locally classified document as: {document_type} ({confidence:.3f})")
+    return document_type
 
-    # --- Step 2: Extract Features Individually ---
-    config = FEATURE_EXTRACTION_CONFIG[document_type]
-    fields_to_extract = config["fields"]
-    display_names_map = config["display_names"]
-    document_type_display_for_prompt = document_type.replace("_", " ")
-    extracted_features = {}
 
-    for field_key in fields_to_extract:
-        feature_display_name = display_names_map.get(field_key, field_key.replace("_", " "))
-        extraction_prompt = get_single_feature_prompt(
-            document_type_display_for_prompt,
-            field_key,
-            feature_display_name
+async def decode_machine_readable(image_bytes: bytes) -> Optional[MachineReadableResult]:
+    """Validated fields from the document's MRZ or barcode, or None when there is none (or decoding is disabled)."""
+    if machine_readable_decoder is None:
+        return None
+    try:
+        with metrics.stage("machine_readable_decode"):
+            decoded = await asyncio.get_running_loop().run_in_executor(
+                image_executor, machine_readable_decoder.decode, image_bytes
+            )
+    except Exception as e:
+        logger.warning(f"Machine-readable decoding failed, falling back to the LLM: {e}")
+        return None
+    if decoded is None or decoded.document_type not in VALID_DOCUMENT_TYPES:
+        return None
+    fields = FEATURE_EXTRACTION_CONFIG[decoded.document_type]["fields"]
+    decoded = decoded._replace(features={key: value for key, value in decoded.features.items() if key in fields})
+    logger.info(f"Decoded {sorted(decoded.features)} for {decoded.document_type} from the {decoded.source}")
+    for field_key in decoded.features:
+        metrics.DECODED_FIELDS.inc(decoded.document_type, field_key, decoded.source)
+    return decoded
+
+
+# (document_type, features, field_errors, sources); sources maps "document_type" and each answered field to the
+# model (or local decoder/classifier) that produced it
+PipelineResult = Tuple[str, Dict[str, Optional[str]], Dict[str, str], Dict[str, str]]
+
+
+async def extract_structured(base64_image_data_url: str) -> PipelineResult:
+    """Classify and extract in one call to the fastest model, falling back per field only where needed.
+
+    Malformed fields are asked for individually from the start of the cascade;
+    fields that came back not found or failed validation from the next model on.
+    """
+    model = MODEL_CASCADE[0]
+    with metrics.stage("structured_extraction"):
+        raw_response = await call_gemini_vision_api(
+            get_structured_extraction_prompt(),
+            base64_image_data_url,
+            max_tokens=1000,
+            response_format={"type": "json_object"},
+            model=model
         )
-        raw_feature_value = await call_gemini_vision_api(extraction_prompt, base64_image_data_url)
-        cleaned_value = raw_feature_value.strip('"').strip("'").strip()
+    document_type, extracted_features, fields_needing_fallback = parse_structured_extraction(raw_response)
+    if document_type is None:
+        metrics.CASCADE_RESULTS.inc("classification", "0", model, "invalid")
+        logger.warning("Structured extraction unusable; falling back to per-field extraction.")
+        return await extract_per_field(base64_image_data_url)
+    metrics.CASCADE_RESULTS.inc("classification", "0", model, "accepted")
 
-        if cleaned_value == NOT_FOUND_PLACEHOLDER or not cleaned_value:
-            extracted_features[field_key] = None
-        else:
-            extracted_features[field_key] = cleaned_value
+    sources = {"document_type": model}
+    fields_to_escalate = []
+    for field_key, value in extracted_features.items():
+        outcome = field_outcome(field_key, value)
+        metrics.CASCADE_RESULTS.inc("field", "0", model, outcome)
+        if value is not None:
+            sources[field_key] = model
+        if outcome != "accepted" and len(MODEL_CASCADE) > 1:
+            fields_to_escalate.append(field_key)
+    # Escalated fields are reported once their final value is known: progress events aren't revised
+    report_extraction_progress(document_type, {
+        field_key: value for field_key, value in extracted_features.items() if field_key not in fields_to_escalate
+    })
+
+    field_errors = {}
+    if fields_needing_fallback:
+        logger.info(f"Structured extraction missing or malformed fields {fields_needing_fallback}; extracting individually.")
+        fallback_features, field_errors, fallback_sources = await extract_features(
+            document_type, base64_image_data_url, fields=fields_needing_fallback
+        )
+        extracted_features.update(fallback_features)
+        sources.update(fallback_sources)
+    if fields_to_escalate:
+        logger.info(f"Structured extraction not found or invalid for {fields_to_escalate}; escalating to {MODEL_CASCADE[1]}.")
+        escalated_features, escalation_errors, escalated_sources = await extract_features(
+            document_type, base64_image_data_url, fields=fields_to_escalate, first_tier=1
+        )
+        # A failed escalation keeps the fastest model's answer
+        for field_key in escalation_errors:
+            escalated_features.pop(field_key)
+        extracted_features.update(escalated_features)
+        sources.update(escalated_sources)
+    ordered_features = {
+        field_key: extracted_features.get(field_key)
+        for field_key in FEATURE_EXTRACTION_CONFIG[document_type]["fields"]
+    }
+    return document_type, ordered_features, field_errors, sources
+
+
+async def extract_per_field(
+    base64_image_data_url: str,
+    document_type: Optional[str] = None,
+    known_features: Optional[Dict[str, str]] = None,
+    known_sources: Optional[Dict[str, str]] = None
+) -> PipelineResult:
+    """known_features (decoded locally) are kept as they are; only the other fields are asked for.
+
+    known_sources records where a given document_type and the known_features came from.
+    """
+    sources = dict(known_sources or {})
+    if document_type is None:
+        document_type, sources["document_type"] = await classify_document_type(base64_image_data_url)
+    known_features = known_features or {}
+    report_extraction_progress(document_type, dict(known_features))
+    fields = FEATURE_EXTRACTION_CONFIG[document_type]["fields"]
+    remaining_fields = [field_key for field_key in fields if field_key not in known_features]
+    extracted_features, field_errors = {}, {}
+    if remaining_fields:
+        extracted_features, field_errors, extracted_sources = await extract_features(
+            document_type, base64_image_data_url, fields=remaining_fields
+        )
+        sources.update(extracted_sources)
+    extracted_features.update(known_features)
+    return document_type, {field_key: extracted_features.get(field_key) for field_key in fields}, field_errors, sources
+
+
+async def run_extraction_pipeline(
+    base64_image_data_url: str,
+    extraction_mode: Optional[str] = None,
+    document_type: Optional[str] = None,
+    decoded: Optional[MachineReadableResult] = None
+) -> PipelineResult:
+    """A known document_type (e.g. from the local classifier) skips classification in per_field mode.
+
+    Decoded machine-readable fields are used as they are and skip classification
+    too. The remaining fields are asked for one by one, unless single_call mode
+    would need fewer calls.
+    """
+    extraction_mode = extraction_mode or EXTRACTION_MODE
+    use_decoded = False
+    if decoded is not None:
+        fields = FEATURE_EXTRACTION_CONFIG[decoded.document_type]["fields"]
+        remaining_calls = len([field_key for field_key in fields if field_key not in decoded.features])
+        # Calls saved against the same mode without decoding: the classification and per-field calls, or the one structured call
+        baseline_calls = 1 if extraction_mode == "single_call" else 1 + len(fields)
+        use_decoded = remaining_calls < baseline_calls
+        metrics.MODEL_CALLS_SAVED.observe(baseline_calls - remaining_calls if use_decoded else 0, decoded.document_type)
+        decoded_sources = {field_key: decoded.source for field_key in decoded.features}
+
+    if use_decoded:
+        document_type, extracted_features, field_errors, sources = await extract_per_field(
+            base64_image_data_url, decoded.document_type, decoded.features,
+            {"document_type": decoded.source, **decoded_sources}
+        )
+    elif extraction_mode == "single_call":
+        document_type, extracted_features, field_errors, sources = await extract_structured(base64_image_data_url)
+        if decoded is not None and decoded.document_type == document_type:
+            extracted_features.update(decoded.features)
+            sources.update(decoded_sources)
+            field_errors = {key: error for key, error in field_errors.items() if key not in decoded.features}
+    else:
+        known_sources = {"document_type": "local_classifier"} if document_type is not None else None
+        document_type, extracted_features, field_errors, sources = await extract_per_field(
+            base64_image_data_url, document_type, known_sources=known_sources
+        )
+
+    if field_errors and len(field_errors) == len(extracted_features):
+        raise HTTPException(
+            status_code=503,
+            detail=f"Error communicating with AI model: every field extraction failed ({field_errors})"
+        )
+    for field_key, value in extracted_features.items():
+        outcome = "error" if field_key in field_errors else "not_found" if value is None else "found"
+        metrics.FIELD_RESULTS.inc(document_type, field_key, outcome)
     logger.info(f"Successfully extracted features for {document_type}")
+    return document_type, extracted_features, field_errors, sources
 
-    # --- Step 3: Save to Database ---
+
+CONFIG_FINGERPRINT = get_config_fingerprint()
+
+
+async def extract_document(
+    original_filename: str,
+    prepared_image: PreparedImage,
+    extraction_mode: Optional[str] = None,
+    cache: str = "use"
+) -> Tuple[schemas.DocumentRecordCreate, Dict[str, str]]:
+    """Run (or reuse from cache) the extraction pipeline and store the image blobs; no DB write."""
+    # --- Steps 1 & 2: Classify Document Type and Extract Features ---
+    extraction_mode = extraction_mode or EXTRACTION_MODE
+    cache_key = make_cache_key(prepared_image.original_sha256, ",".join(MODEL_CASCADE), CONFIG_FINGERPRINT, extraction_mode)
+
+    async def compute():
+        decoded = await decode_machine_readable(prepared_image.normalized)
+        # The single structured call classifies for free, so the local model only pays off per field
+        local_document_type = None
+        if extraction_mode == "per_field" and decoded is None:
+            local_document_type = await classify_document_type_locally(prepared_image.normalized)
+        return await run_extraction_pipeline(prepared_image.data_url, extraction_mode, local_document_type, decoded)
+
+    document_type, extracted_features, field_errors, sources = await extraction_cache.get_or_compute(
+        cache_key, compute, mode=cache
+    )
+
+    metrics.DOCUMENTS.inc(document_type)
+
+    with metrics.stage("blob_write"):
+        image_sha256, thumbnail_sha256 = await asyncio.get_running_loop().run_in_executor(
+            image_executor, store_image_blobs, prepared_image.normalized
+        )
     document_to_create = schemas.DocumentRecordCreate(
         original_filename=original_filename,
-        image_base64=base64_image_data_url, # This includes the data:mime;base64 prefix
+        image_sha256=image_sha256,
+        image_mime_type=prepared_image.mime_type,
+        thumbnail_sha256=thumbnail_sha256,
         document_type=document_type,
-        features=extracted_features
+        features=extracted_features,
+        sources=sources
     )
-    db_document_record = crud.create_document_record(db=db, record=document_to_create)
+    return document_to_create, field_errors
+
+
+@app.post("/classify", response_model=schemas.DocumentRecordResponse)
+async def classify_and_extract_and_save(
+    request: Request,
+    image: UploadFile = File(...),
+    extraction_mode: Optional[Literal["per_field", "single_call"]] = None, # Defaults to EXTRACTION_MODE
+    cache: Literal["use", "bypass", "refresh"] = "use",
+    db: AsyncSession = Depends(get_async_db)
+):
+    logger.info(f"Received request for /classify from {request.client.host}")
+
+    if not OPENROUTER_API_KEY:
+        logger.error("OpenRouter API key not configured.")
+        raise HTTPException(status_code=500, detail="Server configuration error: API key missing.")
+
+    original_filename = image.filename if image.filename else "uploaded_image.png" # Ensure a default
+    prepared_image = await get_image_content(image)
+    document_to_create, field_errors = await extract_document(original_filename, prepared_image, extraction_mode, cache)
+
+    # --- Step 3: Save to Database ---
+    with metrics.stage("db_write"):
+        db_document_record = await crud.create_document_record(db=db, record=document_to_create)
     logger.info(f"Saved document record with ID: {db_document_record.id}")
-    
-    return db_document_record # response_model handles conversion to DocumentRecordResponse
+    db_document_record.field_errors = field_errors
+
+    # Serialized here rather than by response_model so the stage can be timed
+    with metrics.stage("response_serialization"):
+        body = schemas.DocumentRecordResponse.model_validate(db_document_record).model_dump_json()
+    return Response(content=body, media_type="application/json")
+
+
+def spool_batch_item(source: BinaryIO) -> BinaryIO:
+    spooled = tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_MEMORY_BYTES)
+    shutil.copyfileobj(source, spooled)
+    spooled.seek(0)
+    return spooled
+
+
+# A batch image waiting in its temporary file, or the error it already failed with (a per-item error line)
+BatchItem = Tuple[str, Union[BinaryIO, HTTPException]]
+
+
+def close_batch_items(items: List[BatchItem]):
+    for _, item in items:
+        if not isinstance(item, HTTPException):
+            item.close()
+
+
+def batch_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Batch images exceed the {BATCH_MAX_TOTAL_BYTES:,} byte limit once unzipped.")
+
+
+def expand_batch_upload(filename: str, file: BinaryIO, max_total_bytes: int) -> Tuple[List[BatchItem], int]:
+    """The images in one batch part, spooled to temporary files, and their total size.
+
+    A part is an image itself or a zip of them (detected by content, not name). An image over UPLOAD_MAX_BYTES
+    becomes a 413 item of its own. max_total_bytes is what is left of the batch's BATCH_MAX_TOTAL_BYTES; the
+    caller closes the returned files.
+    """
+    try:
+        # Anything else is passed through to fail as its own batch item
+        received = receive_upload(file, UPLOAD_MAX_REQUEST_BYTES, accepted=None)
+        if received.mime_type != ZIP_MIME_TYPE:
+            if received.size > UPLOAD_MAX_BYTES:
+                return [(filename, upload_error(UploadTooLargeError(f"'{filename}' exceeds the {UPLOAD_MAX_BYTES:,} byte limit")))], 0
+            if received.size > max_total_bytes:
+                raise batch_too_large()
+            return [(filename, spool_batch_item(file))], received.size
+        with zipfile.ZipFile(file) as archive:
+            members = [
+                member for member in archive.infolist()
+                if not member.is_dir()
+                and not member.filename.startswith("__MACOSX/")
+                and not os.path.basename(member.filename).startswith(".")
+            ]
+            if len(members) > BATCH_MAX_DOCUMENTS:
+                raise HTTPException(status_code=413, detail=f"Batch has {len(members)} images; the limit is {BATCH_MAX_DOCUMENTS}.")
+            # Checked before decompressing anything; reads stop at the declared size, so a forged header can't exceed it
+            total_size = sum(member.file_size for member in members if member.file_size <= UPLOAD_MAX_BYTES)
+            if total_size > max_total_bytes:
+                raise batch_too_large()
+            items = []
+            try:
+                for member in members:
+                    member_name = os.path.basename(member.filename)
+                    if member.file_size > UPLOAD_MAX_BYTES:
+                        items.append((member_name, upload_error(UploadTooLargeError(
+                            f"'{member.filename}' in '{filename}' exceeds the {UPLOAD_MAX_BYTES:,} byte limit"
+                        ))))
+                        continue
+                    with archive.open(member) as source:
+                        items.append((member_name, spool_batch_item(source)))
+            except BaseException:
+                close_batch_items(items)
+                raise
+            return items, total_size
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Invalid zip file '{filename}': {e}")
+    except (UploadTooLargeError, UnsupportedUploadError) as e:
+        raise upload_error(e)
+
+
+async def extract_batch_item(
+    index: int,
+    filename: str,
+    spooled: Union[BinaryIO, HTTPException],
+    extraction_mode: Optional[str],
+    cache: str,
+    document_semaphore: asyncio.Semaphore
+) -> Tuple[int, str, Optional[Tuple[schemas.DocumentRecordCreate, Dict[str, str]]], Optional[HTTPException]]:
+    if isinstance(spooled, HTTPException):
+        return index, filename, None, spooled
+    async with document_semaphore:
+        try:
+            # Only the images being worked on are held in memory
+            with spooled:
+                contents = await asyncio.get_running_loop().run_in_executor(image_executor, spooled.read)
+            prepared_image = await prepare_image(contents)
+            return index, filename, await extract_document(filename, prepared_image, extraction_mode, cache), None
+        except HTTPException as e:
+            return index, filename, None, e
+        except Exception as e:
+            logger.exception(f"Unexpected error processing batch item {index} ('{filename}')")
+            return index, filename, None, HTTPException(status_code=500, detail=str(e))
+
+
+async def stream_batch_results(items: List[BatchItem], extraction_mode: Optional[str], cache: str):
+    """Yield one NDJSON line per image, in completion order.
+
+    Successful extractions are buffered and inserted in groups of BATCH_COMMIT_SIZE
+    (or whatever has accumulated after BATCH_COMMIT_INTERVAL_SECONDS of no new
+    completions); their lines are emitted once the group is committed.
+    """
+    document_semaphore = asyncio.Semaphore(BATCH_DOCUMENT_CONCURRENCY)
+    pending = {
+        asyncio.create_task(extract_batch_item(index, filename, spooled, extraction_mode, cache, document_semaphore))
+        for index, (filename, spooled) in enumerate(items)
+    }
+    buffered = []
+
+    async def flush():
+        records = [document for _, _, (document, _) in buffered]
+        try:
+            with metrics.stage("db_write"):
+                async with AsyncSessionLocal() as db:
+                    db_records = await crud.create_document_records(db, records)
+        except Exception as e:
+            logger.error(f"Bulk insert of {len(records)} batch document(s) failed: {e}")
+            lines = [
+                schemas.BatchItemResult(index=index, filename=filename, status="error", status_code=500, error=f"Database error: {e}")
+                for index, filename, _ in buffered
+            ]
+        else:
+            lines = []
+            for (index, filename, (_, field_errors)), db_record in zip(buffered, db_records):
+                db_record.field_errors = field_errors
+                lines.append(schemas.BatchItemResult(
+                    index=index, filename=filename, status="ok",
+                    document=schemas.DocumentRecordResponse.model_validate(db_record)
+                ))
+        buffered.clear()
+        return [line.model_dump_json() + "\n" for line in lines]
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=BATCH_COMMIT_INTERVAL_SECONDS if buffered else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                index, filename, extracted, error = task.result()
+                if error is not None:
+                    yield schemas.BatchItemResult(
+                        index=index, filename=filename, status="error", status_code=error.status_code, error=str(error.detail)
+                    ).model_dump_json() + "\n"
+                else:
+                    buffered.append((index, filename, extracted))
+            if buffered and (len(buffered) >= BATCH_COMMIT_SIZE or not done or not pending):
+                for line in await flush():
+                    yield line
+    finally:
+        # Client went away mid-stream: stop scheduling work nobody will read
+        for task in pending:
+            task.cancel()
+        # Items whose task never got to them still hold their temporary file
+        close_batch_items(items)
+
+
+@app.post("/classify/batch")
+async def classify_batch(
+    request: Request,
+    images: List[UploadFile] = File(...), # Image files and/or zip archives of images
+    extraction_mode: Optional[Literal["per_field", "single_call"]] = None,
+    cache: Literal["use", "bypass", "refresh"] = "use"
+):
+    logger.info(f"Received request for /classify/batch from {request.client.host} with {len(images)} upload(s)")
+
+    if not OPENROUTER_API_KEY:
+        logger.error("OpenRouter API key not configured.")
+        raise HTTPException(status_code=500, detail="Server configuration error: API key missing.")
+
+    # Copy everything up front: upload files are closed once this handler returns
+    loop = asyncio.get_running_loop()
+    items = []
+    total_size = 0
+    try:
+        for upload in images:
+            part_items, part_size = await loop.run_in_executor(
+                image_executor, expand_batch_upload, upload.filename or "uploaded_image.png", upload.file,
+                BATCH_MAX_TOTAL_BYTES - total_size
+            )
+            items.extend(part_items)
+            total_size += part_size
+            if len(items) > BATCH_MAX_DOCUMENTS:
+                raise HTTPException(status_code=413, detail=f"Batch has {len(items)} images; the limit is {BATCH_MAX_DOCUMENTS}.")
+    except BaseException:
+        close_batch_items(items)
+        raise
+
+    return StreamingResponse(stream_batch_results(items, extraction_mode, cache), media_type="application/x-ndjson")
+
+
+def sse_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+async def stream_extraction_events(
+    original_filename: str,
+    prepared_image: PreparedImage,
+    extraction_mode: Optional[str],
+    cache: str
+):
+    """Yield SSE events: document_type once it is known, one field event per value, then the saved document.
+
+    Extraction runs in its own task so this generator can forward progress as
+    it arrives. If the client disconnects, the generator is closed and the task
+    cancelled, which aborts the remaining upstream calls.
+    """
+    progress: asyncio.Queue = asyncio.Queue()
+
+    async def extract():
+        extraction_progress.set(lambda document_type, features: progress.put_nowait((document_type, features)))
+        return await extract_document(original_filename, prepared_image, extraction_mode, cache)
+
+    task = asyncio.create_task(extract())
+    task.add_done_callback(lambda _: progress.put_nowait(None))
+    sent_document_type = None
+    sent_fields = set()
+
+    def progress_events(document_type: str, features: Dict[str, Optional[str]], field_errors: Dict[str, str]):
+        nonlocal sent_document_type
+        if document_type != sent_document_type:
+            sent_document_type = document_type
+            yield sse_event("document_type", json.dumps({"document_type": document_type}))
+        for field_key, value in features.items():
+            if field_key not in sent_fields:
+                sent_fields.add(field_key)
+                data = {"field": field_key, "value": value}
+                if field_key in field_errors:
+                    data["error"] = field_errors[field_key]
+                yield sse_event("field", json.dumps(data))
+
+    try:
+        while (update := await progress.get()) is not None:
+            for event in progress_events(*update, {}):
+                yield event
+        try:
+            document_to_create, field_errors = task.result()
+        except HTTPException as e:
+            yield sse_event("error", json.dumps({"status_code": e.status_code, "detail": e.detail}))
+            return
+        except Exception as e:
+            logger.exception(f"Unexpected error streaming extraction of '{original_filename}'")
+            yield sse_event("error", json.dumps({"status_code": 500, "detail": str(e)}))
+            return
+        # Cache hits report no progress, and failed fields never do; send whatever is still missing
+        for event in progress_events(document_to_create.document_type, document_to_create.features, field_errors):
+            yield event
+
+        with metrics.stage("db_write"):
+            async with AsyncSessionLocal() as db:
+                db_document_record = await crud.create_document_record(db=db, record=document_to_create)
+        logger.info(f"Saved document record with ID: {db_document_record.id}")
+        db_document_record.field_errors = field_errors
+        yield sse_event("document", schemas.DocumentRecordResponse.model_validate(db_document_record).model_dump_json())
+    finally:
+        if not task.done():
+            logger.info(f"Client disconnected; cancelling extraction of '{original_filename}'")
+            task.cancel()
+
+
+@app.post("/classify/stream")
+async def classify_stream(
+    request: Request,
+    image: UploadFile = File(...),
+    extraction_mode: Optional[Literal["per_field", "single_call"]] = None,
+    cache: Literal["use", "bypass", "refresh"] = "use"
+):
+    """/classify as Server-Sent Events, so clients can show each field as soon as it is extracted."""
+    logger.info(f"Received request for /classify/stream from {request.client.host}")
+
+    if not OPENROUTER_API_KEY:
+        logger.error("OpenRouter API key not configured.")
+        raise HTTPException(status_code=500, detail="Server configuration error: API key missing.")
+
+    original_filename = image.filename if image.filename else "uploaded_image.png"
+    # Unreadable uploads still fail with a plain HTTP error, before the stream starts
+    prepared_image = await get_image_content(image)
+    return StreamingResponse(
+        stream_extraction_events(original_filename, prepared_image, extraction_mode, cache),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def process_job(job: models.Job, report_progress: Callable) -> Tuple[schemas.DocumentRecordCreate, Dict[str, str]]:
+    contents = await asyncio.get_running_loop().run_in_executor(image_executor, blob_store.get, job.image_sha256)
+    if contents is None:
+        raise PermanentJobError(f"Uploaded image {job.image_sha256} is missing from the blob store")
+    token = extraction_progress.set(report_progress)
+    try:
+        prepared_image = await prepare_image(contents)
+        return await extract_document(job.original_filename, prepared_image, job.extraction_mode)
+    except HTTPException as e:
+        # Client errors (unreadable image, unsupported document type) fail the same way on every attempt
+        if e.status_code < 500 and e.status_code != 429:
+            raise PermanentJobError(e.detail) from e
+        raise
+    finally:
+        extraction_progress.reset(token)
+
+
+job_pool = JobWorkerPool(
+    process_job,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retry_base_delay=JOB_RETRY_BASE_DELAY_SECONDS,
+    lease_seconds=JOB_LEASE_SECONDS,
+    poll_interval=JOB_POLL_INTERVAL_SECONDS,
+    webhook_allowed_hosts=JOB_WEBHOOK_ALLOWED_HOSTS,
+)
+
+
+@app.post("/jobs", response_model=schemas.JobResponse, status_code=202)
+async def submit_job(
+    response: Response,
+    file: UploadFile = File(...),
+    extraction_mode: Optional[Literal["per_field", "single_call"]] = Query(None),
+    webhook_url: Optional[str] = Query(None, description="POSTed the final job JSON when the job succeeds or fails"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Queue a document for classification and return at once; poll GET /jobs/{id} for the result."""
+    if webhook_url is not None:
+        try:
+            await check_webhook_url(webhook_url, JOB_WEBHOOK_ALLOWED_HOSTS)
+        except WebhookURLError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if await crud.count_pending_jobs(db) >= JOB_MAX_QUEUE_DEPTH:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Job queue is full ({JOB_MAX_QUEUE_DEPTH} pending); retry later",
+            headers={"Retry-After": str(max(1, int(JOB_RETRY_BASE_DELAY_SECONDS * 2)))}
+        )
+
+    # Normalizing here rejects unreadable images with a 400 now rather than as a failed job later.
+    # The original upload is what's stored, so the worker's cache key matches /classify's.
+    received = await receive_image_upload(file)
+    await prepare_received_image(received.file, received.sha256)
+    image_sha256 = await asyncio.get_running_loop().run_in_executor(
+        image_executor, blob_store.put_file, received.file, received.sha256
+    )
+    db_job = await crud.create_job(
+        db,
+        job_id=uuid.uuid4().hex,
+        original_filename=file.filename or "uploaded_image.png",
+        image_sha256=image_sha256,
+        extraction_mode=extraction_mode or EXTRACTION_MODE,
+        webhook_url=webhook_url
+    )
+    job_pool.notify()
+    response.headers["Location"] = f"/jobs/{db_job.id}"
+    return db_job
+
+
+@app.get("/jobs/{job_id}", response_model=schemas.JobResponse)
+async def read_job(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    db_job = await crud.get_job(db, job_id)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return db_job
+
+
+@app.get("/cache/stats")
+async def read_cache_stats():
+    return extraction_cache.snapshot()
+
+
+# Filled in by warm_up(); /ready reports it
+warm_up_checks: Dict[str, str] = {}
+worker_warm = asyncio.Event()
+
+
+async def warm_up():
+    """Pay this worker's first-request costs before it reports ready: database connection, image codecs and thread
+    pool, local models, and the upstream connection (opened by GET /models, which costs no quota)."""
+    started = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(text("SELECT 1"))
+        warm_up_checks["database"] = "ok"
+        sample = io.BytesIO()
+        Image.new("RGB", (256, 160), "white").save(sample, format="PNG")
+        prepared_image = await prepare_image(sample.getvalue())
+        await decode_machine_readable(prepared_image.normalized)
+        await classify_document_type_locally(prepared_image.normalized)
+        warm_up_checks["image_pipeline"] = "ok"
+    except Exception as e:
+        # The worker stays unready, and /ready shows why
+        logger.error(f"Warm-up failed: {e}")
+        warm_up_checks["error"] = str(e)
+        return
+    try:
+        await asyncio.wait_for(client.models.list(), timeout=FIELD_EXTRACTION_TIMEOUT_SECONDS)
+        warm_up_checks["upstream"] = "ok"
+    except Exception as e:
+        # Upstream being down is the governor's to handle; keeping every worker out of rotation wouldn't help
+        logger.warning(f"Could not open the upstream connection during warm-up: {e}")
+        warm_up_checks["upstream"] = f"unreachable ({type(e).__name__})"
+    worker_warm.set()
+    if shared_state is not None:
+        app.state.warm_heartbeat_task = asyncio.create_task(keep_warm_heartbeat())
+    logger.info(f"Worker warm after {time.perf_counter() - started:.2f}s: {warm_up_checks}")
+
+
+async def keep_warm_heartbeat():
+    while True:
+        try:
+            shared_state.heartbeat(os.getpid(), time.monotonic(), 3 * WARM_HEARTBEAT_SECONDS)
+        except Exception as e:
+            logger.warning(f"Could not record the warm-worker heartbeat: {e}")
+        await asyncio.sleep(WARM_HEARTBEAT_SECONDS)
+
+
+@app.get("/ready")
+async def read_readiness():
+    """200 once this worker is warm and, under serve.py, so are all SERVE_WORKERS workers; 503 until then."""
+    if shared_state is not None:
+        warm_workers = shared_state.live_workers(time.monotonic(), 3 * WARM_HEARTBEAT_SECONDS)
+    else:
+        warm_workers = int(worker_warm.is_set())
+    body = {"checks": warm_up_checks, "warm_workers": warm_workers, "workers": SERVE_WORKERS}
+    if not worker_warm.is_set() or warm_workers < SERVE_WORKERS:
+        return JSONResponse({"status": "warming", **body}, status_code=503)
+    return {"status": "ready", **body}
+
+
+@app.get("/upstream/stats")
+async def read_upstream_stats():
+    return upstream.snapshot()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """Prometheus text format. Counters are per process."""
+    governor_stats = upstream.snapshot()
+    extra = [
+        *metrics.render_samples(
+            "idclassifier_extraction_cache_events_total", "counter", "Extraction cache lookups and stores, by event.",
+            (({"event": event}, count) for event, count in extraction_cache.stats.items())
+        ),
+        *metrics.render_samples(
+            "idclassifier_upstream_calls_total", "counter", "Upstream governor activity, by event.",
+            (({"event": event}, governor_stats[event]) for event in
+             ("requests", "attempts", "retries", "failures", "circuit_rejections", "hedges", "hedge_wins"))
+        ),
+        *metrics.render_samples(
+            "idclassifier_upstream_attempt_errors_total", "counter",
+            "Failed upstream attempts (including ones later retried), by exception class.",
+            (({"error_class": error_class}, count) for error_class, count in sorted(upstream.error_counts.items()))
+        ),
+        *metrics.render_samples(
+            "idclassifier_upstream_circuit_open", "gauge", "1 while the upstream circuit breaker is open or half-open.",
+            [({}, 0 if governor_stats["circuit_state"] == "closed" else 1)]
+        ),
+    ]
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.delete("/cache")
+async def invalidate_cache():
+    removed = await extraction_cache.invalidate()
+    logger.info(f"Invalidated extraction cache ({removed} persisted entries removed)")
+    return {"removed": removed}
 
 
 @app.put("/documents/{document_id}", response_model=schemas.DocumentRecordResponse)
 async def update_document_features(
     document_id: int,
     document_update: schemas.DocumentRecordUpdate, # This will contain 'features' and/or 'document_type'
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    logger.info(f"Received request to update document ID: {document_id} with data: {document_update.model_dump()}")
-    db_document_record = crud.get_document_record(db, record_id=document_id)
+    logger.info(f"Received request to update document ID: {document_id} (fields: {sorted(document_update.model_dump(exclude_unset=True))})")
+    db_document_record = await crud.get_document_record(db, record_id=document_id)
     if not db_document_record:
         logger.warning(f"Document ID {document_id} not found for update.")
         raise HTTPException(status_code=404, detail="Document not found")
 
-    updated_record = crud.update_document_record(db=db, record_id=document_id, record_update=document_update)
+    updated_record = await crud.update_document_record(db=db, record_id=document_id, record_update=document_update)
     if not updated_record: # Should ideally not happen if get_document_record found it
         logger.error(f"Failed to update document ID {document_id} despite it being found.")
         raise HTTPException(status_code=500, detail="Error updating document")
@@ -230,38 +1398,206 @@ async def update_document_features(
     return updated_record
 
 
+def encode_cursor(updated_at: datetime, record_id: int) -> str:
+    raw = json.dumps([updated_at.isoformat(), record_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        updated_at, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(updated_at), int(record_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def as_utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    # Stored timestamps are naive UTC (func.now() on SQLite)
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@app.get("/documents/search", response_model=List[schemas.DocumentSummary])
+async def search_documents(
+    name: Optional[str] = Query(None, description="Every word must start a word of first_name, last_name or full_name"),
+    fuzzy: bool = Query(False, description="Also match name words within SEARCH_FUZZY_MIN_SIMILARITY (first two letters must match)"),
+    number: Optional[str] = Query(None, description="Exact license or card number; case, spaces and dashes are ignored"),
+    match: List[str] = Query([], description="Exact field:value matches, e.g. category:C09"),
+    date_of_birth_from: Optional[date] = None,
+    date_of_birth_to: Optional[date] = None,
+    expires_from: Optional[date] = Query(None, description="expiration_date or card_expires_date on or after"),
+    expires_to: Optional[date] = None,
+    document_type: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Newest-first document summaries matching every given criterion, served from the document_features index."""
+    conditions = []
+    for term in feature_index.name_tokens(name or ""):
+        if not fuzzy:
+            conditions.append(crud.feature_condition("token", feature_index.NAME_FIELDS, prefix=term))
+            continue
+        candidates = await crud.get_feature_tokens(db, feature_index.NAME_FIELDS, term[:2])
+        tokens = feature_index.similar_tokens(term, candidates, SEARCH_FUZZY_MIN_SIMILARITY)
+        if not tokens:
+            return []
+        conditions.append(crud.feature_condition("token", feature_index.NAME_FIELDS, one_of=tokens))
+    if number:
+        conditions.append(crud.feature_condition("value", feature_index.IDENTIFIER_FIELDS, equals=feature_index.normalize(number)))
+    for item in match:
+        field, separator, value = item.partition(":")
+        if not separator or not field or not value:
+            raise HTTPException(status_code=400, detail=f"match must look like field:value, got '{item}'")
+        conditions.append(crud.feature_condition("value", [field], equals=feature_index.normalize(value)))
+    if date_of_birth_from or date_of_birth_to:
+        conditions.append(crud.feature_condition(
+            "date", ["date_of_birth"],
+            value_from=date_of_birth_from.isoformat() if date_of_birth_from else None,
+            value_to=date_of_birth_to.isoformat() if date_of_birth_to else None,
+        ))
+    if expires_from or expires_to:
+        conditions.append(crud.feature_condition(
+            "date", feature_index.EXPIRATION_FIELDS,
+            value_from=expires_from.isoformat() if expires_from else None,
+            value_to=expires_to.isoformat() if expires_to else None,
+        ))
+    if not conditions:
+        raise HTTPException(status_code=400, detail="Give at least one search criterion; use /documents/summaries to list everything.")
+    logger.info(f"Received document search with {len(conditions)} criteria. Limit: {limit}, Type: {document_type}")
+    return await crud.search_document_summaries(db, conditions, document_type=document_type, limit=limit)
+
+
+@app.get("/documents/summaries", response_model=schemas.DocumentSummaryPage)
+async def read_document_summaries(
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=200),
+    document_type: Optional[str] = None,
+    updated_from: Optional[datetime] = None,
+    updated_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    logger.info(f"Received request to list document summaries. Limit: {limit}, Type: {document_type}")
+    rows = await crud.get_document_summaries(
+        db,
+        limit=limit + 1, # One extra row tells us whether there is a next page
+        after=decode_cursor(cursor) if cursor else None,
+        document_type=document_type,
+        updated_from=as_utc_naive(updated_from),
+        updated_to=as_utc_naive(updated_to),
+    )
+    next_cursor = encode_cursor(rows[limit - 1].updated_at, rows[limit - 1].id) if len(rows) > limit else None
+    return schemas.DocumentSummaryPage(items=rows[:limit], next_cursor=next_cursor)
+
+
+@app.get("/documents/export")
+async def export_documents(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    document_type: Optional[str] = None,
+    include_images: bool = False,
+    batch_size: int = Query(500, ge=1, le=5000)
+):
+    """Every document, streamed in id order; see export.py. Each batch is read in its own short query."""
+    logger.info(f"Received request to export documents. Format: {format}, Type: {document_type}, Images: {include_images}")
+    writer = ExportWriter(format, configured_feature_fields(FEATURE_EXTRACTION_CONFIG), include_images)
+
+    async def body():
+        yield writer.header()
+        async for batch in aiter_export_batches(AsyncSessionLocal, batch_size, document_type, include_images):
+            if include_images:
+                await asyncio.get_running_loop().run_in_executor(image_executor, attach_images, batch, blob_store)
+            yield writer.batch(batch)
+
+    headers = {"Content-Disposition": f'attachment; filename="documents.{format}"'}
+    return StreamingResponse(body(), media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
+
+
 @app.get("/documents/", response_model=List[schemas.DocumentRecordResponse])
 async def read_all_documents(
     skip: int = 0,
     limit: int = 10, # Default to fetching 10 most recent
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     logger.info(f"Received request to list documents. Skip: {skip}, Limit: {limit}")
-    documents = crud.get_document_records(db, skip=skip, limit=limit)
+    documents = await crud.get_document_records(db, skip=skip, limit=limit)
     return documents
 
 
 @app.get("/documents/{document_id}", response_model=schemas.DocumentRecordResponse)
 async def read_single_document(
     document_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     logger.info(f"Received request to fetch document ID: {document_id}")
-    db_document = crud.get_document_record(db, record_id=document_id)
+    db_document = await crud.get_document_record(db, record_id=document_id)
     if db_document is None:
         logger.warning(f"Document ID {document_id} not found.")
         raise HTTPException(status_code=404, detail="Document not found")
     return db_document
 
 
+def blob_response(request: Request, digest: Optional[str], media_type: str) -> Response:
+    if not digest or not blob_store.exists(digest):
+        raise HTTPException(status_code=404, detail="Image not found (legacy rows need `python migrations.py migrate-image-blobs`)")
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": BLOB_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(blob_store.path_for(digest), media_type=media_type, headers=headers)
+
+
+@app.get("/documents/{document_id}/image")
+async def read_document_image(
+    document_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    db_document = await crud.get_document_record(db, record_id=document_id)
+    if db_document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return blob_response(request, db_document.image_sha256, db_document.image_mime_type or "application/octet-stream")
+
+
+@app.get("/documents/{document_id}/thumbnail")
+async def read_document_thumbnail(
+    document_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    db_document = await crud.get_document_record(db, record_id=document_id)
+    if db_document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return blob_response(request, db_document.thumbnail_sha256, "image/jpeg")
+
+
+@app.on_event("startup")
+async def startup_event():
+    if DB_SCHEMA_SETUP:
+        migrations.setup_schema(engine)
+    if JOB_WORKERS > 0:
+        job_pool.start(JOB_WORKERS)
+    # Held so the task isn't garbage collected; serving starts right away and /ready reports when it's done
+    app.state.warm_up_task = asyncio.create_task(warm_up())
+
+
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Application shutting down. Closing OpenAI client.")
+    if shared_state is not None:
+        heartbeat = getattr(app.state, "warm_heartbeat_task", None)
+        if heartbeat is not None:
+            heartbeat.cancel()
+        shared_state.remove_worker(os.getpid())
+    await job_pool.stop()
     await client.close()
+    image_executor.shutdown(wait=False)
+    await async_engine.dispose()
 
 if __name__ == "__main__":
     import uvicorn
     if not OPENROUTER_API_KEY:
         print("ERROR: OPENROUTER_API_KEY environment variable not set.")
     else:
-        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) # Use "main:app" for uvicorn
+        # Development server with auto-reload; run `python serve.py --workers N` in production
+        uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=True)
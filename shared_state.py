@@ -0,0 +1,113 @@
+"""State shared by the worker processes of one deployment, in a small memory-mapped file.
+
+serve.py creates the file (SHARED_STATE_PATH) before starting its workers. It
+stands in for an external store such as Redis: every worker maps the same
+file, and each read-modify-write holds an exclusive flock on it. The upstream
+governor keeps its token buckets and Retry-After pause here, so rate limits
+hold for the deployment rather than per worker. The extraction cache keeps its
+invalidation generation here. Warm workers keep a heartbeat in a table of
+(pid, time) entries, so a worker that crashed stops counting as warm once its
+heartbeat goes stale, and its restarted replacement counts once. Values are
+doubles. Times are time.monotonic(), which is system-wide on Linux. Unix only
+(fcntl).
+"""
+import fcntl
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+SLOTS = (
+    "request_tokens", "request_updated_at",  # governor requests-per-second bucket
+    "llm_tokens", "llm_updated_at",  # governor tokens-per-minute bucket
+    "paused_until",  # governor Retry-After pause
+    "cache_generation",  # bumped by ExtractionCache.invalidate
+)
+SLOT_SIZE = struct.calcsize("d")
+# Followed by this many (pid, heartbeat time) entries, one per warm worker
+WORKER_TABLE_SIZE = 256
+WORKER_ENTRY_SIZE = struct.calcsize("dd")
+
+
+class SharedState:
+    """Named float slots in a file mapped by every worker; starts zeroed."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = len(SLOTS) * SLOT_SIZE + WORKER_TABLE_SIZE * WORKER_ENTRY_SIZE
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)  # New bytes read as zero
+        self._map = mmap.mmap(self._fd, size)
+
+    @classmethod
+    def create(cls, path: str) -> "SharedState":
+        """A fresh, zeroed state file at path, replacing any left by an earlier run."""
+        if os.path.exists(path):
+            os.unlink(path)
+        return cls(path)
+
+    @contextmanager
+    def locked(self) -> Iterator["SharedState"]:
+        # Held for a few loads and stores, so blocking the event loop on it is cheaper than a thread hop
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield self
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def get(self, slot: str) -> float:
+        return struct.unpack_from("d", self._map, SLOTS.index(slot) * SLOT_SIZE)[0]
+
+    def set(self, slot: str, value: float):
+        struct.pack_into("d", self._map, SLOTS.index(slot) * SLOT_SIZE, value)
+
+    def add(self, slot: str, amount: float) -> float:
+        with self.locked():
+            value = self.get(slot) + amount
+            self.set(slot, value)
+        return value
+
+    def _worker_entry(self, index: int) -> Tuple[int, float]:
+        pid, beat = struct.unpack_from("dd", self._map, len(SLOTS) * SLOT_SIZE + index * WORKER_ENTRY_SIZE)
+        return int(pid), beat
+
+    def _set_worker_entry(self, index: int, pid: int, beat: float):
+        struct.pack_into("dd", self._map, len(SLOTS) * SLOT_SIZE + index * WORKER_ENTRY_SIZE, pid, beat)
+
+    def heartbeat(self, pid: int, now: float, ttl: float):
+        """Record that worker pid is alive and warm, reusing its entry or one whose heartbeat is older than ttl."""
+        with self.locked():
+            free = None
+            for index in range(WORKER_TABLE_SIZE):
+                entry_pid, beat = self._worker_entry(index)
+                if entry_pid == pid:
+                    free = index
+                    break
+                if free is None and (entry_pid == 0 or now - beat > ttl):
+                    free = index
+            if free is None:
+                raise RuntimeError(f"More than {WORKER_TABLE_SIZE} live workers share {self.path}")
+            self._set_worker_entry(free, pid, now)
+
+    def remove_worker(self, pid: int):
+        with self.locked():
+            for index in range(WORKER_TABLE_SIZE):
+                if self._worker_entry(index)[0] == pid:
+                    self._set_worker_entry(index, 0, 0.0)
+
+    def live_workers(self, now: float, ttl: float) -> int:
+        """Workers whose heartbeat is at most ttl seconds old."""
+        with self.locked():
+            entries = [self._worker_entry(index) for index in range(WORKER_TABLE_SIZE)]
+        return sum(1 for pid, beat in entries if pid and now - beat <= ttl)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def load_shared_state(path: Optional[str]) -> Optional[SharedState]:
+    """The deployment's shared state, or None (per-process state) when no path is configured."""
+    return SharedState(path) if path else None
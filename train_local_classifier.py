@@ -0,0 +1,112 @@
+"""Train the local document-type pre-classifier and export it to ONNX.
+
+The training manifest is a JSON list of {"file_path": ..., "document_type": ...}.
+Without one, the bundled images/ samples are labelled from their filenames.
+
+    python train_local_classifier.py --output local_classifier.onnx [--manifest labels.json]
+
+Then start the server with LOCAL_CLASSIFIER_MODEL=local_classifier.onnx.
+"""
+import argparse
+import json
+import os
+from typing import List, Tuple
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper
+
+from local_classifier import FEATURE_DIMENSION, extract_image_features
+
+LABELS = ["passport", "drivers_license", "ead_card"]
+FILENAME_LABELS = {"Passport": "passport", "License": "drivers_license", "EAD": "ead_card"}
+
+
+def bundled_manifest(images_dir: str = "images") -> List[dict]:
+    manifest = []
+    for name in sorted(os.listdir(images_dir)):
+        for marker, document_type in FILENAME_LABELS.items():
+            if marker in name:
+                manifest.append({"file_path": os.path.join(images_dir, name), "document_type": document_type})
+    return manifest
+
+
+def load_dataset(manifest: List[dict]) -> Tuple[np.ndarray, np.ndarray]:
+    features, targets = [], []
+    for entry in manifest:
+        with open(entry["file_path"], "rb") as f:
+            features.append(extract_image_features(f.read()))
+        targets.append(LABELS.index(entry["document_type"]))
+    return np.stack(features), np.array(targets)
+
+
+def train_softmax_regression(
+    features: np.ndarray, targets: np.ndarray, epochs: int = 2000, learning_rate: float = 0.5, l2: float = 0.01
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Multinomial logistic regression by full-batch gradient descent on standardized features."""
+    mean = features.mean(axis=0)
+    std = features.std(axis=0) + 1e-6
+    x = (features - mean) / std
+    one_hot = np.eye(len(LABELS))[targets]
+    weights = np.zeros((x.shape[1], len(LABELS)))
+    bias = np.zeros(len(LABELS))
+    for _ in range(epochs):
+        logits = x @ weights + bias
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        gradient = probabilities - one_hot
+        weights -= learning_rate * (x.T @ gradient / len(x) + l2 * weights)
+        bias -= learning_rate * gradient.mean(axis=0)
+    return mean, std, weights, bias
+
+
+def export_onnx(mean: np.ndarray, std: np.ndarray, weights: np.ndarray, bias: np.ndarray, output_path: str):
+    # softmax(((x - mean) / std) @ W + b), so the server only has to compute raw features
+    initializers = [
+        helper.make_tensor("mean", TensorProto.FLOAT, mean.shape, mean.astype(np.float32).ravel()),
+        helper.make_tensor("std", TensorProto.FLOAT, std.shape, std.astype(np.float32).ravel()),
+        helper.make_tensor("weights", TensorProto.FLOAT, weights.shape, weights.astype(np.float32).ravel()),
+        helper.make_tensor("bias", TensorProto.FLOAT, bias.shape, bias.astype(np.float32).ravel()),
+    ]
+    nodes = [
+        helper.make_node("Sub", ["features", "mean"], ["centered"]),
+        helper.make_node("Div", ["centered", "std"], ["standardized"]),
+        helper.make_node("MatMul", ["standardized", "weights"], ["projected"]),
+        helper.make_node("Add", ["projected", "bias"], ["logits"]),
+        helper.make_node("Softmax", ["logits"], ["probabilities"], axis=1),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "document_type_classifier",
+        [helper.make_tensor_value_info("features", TensorProto.FLOAT, [None, FEATURE_DIMENSION])],
+        [helper.make_tensor_value_info("probabilities", TensorProto.FLOAT, [None, len(LABELS)])],
+        initializer=initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8 # Loadable by the pinned onnxruntime
+    helper.set_model_props(model, {"labels": json.dumps(LABELS)})
+    onnx.checker.check_model(model)
+    onnx.save(model, output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--manifest", help="JSON list of {file_path, document_type}; defaults to the bundled images/")
+    parser.add_argument("--output", default="local_classifier.onnx")
+    parser.add_argument("--epochs", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.manifest:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+    else:
+        manifest = bundled_manifest()
+    features, targets = load_dataset(manifest)
+    mean, std, weights, bias = train_softmax_regression(features, targets, epochs=args.epochs)
+    export_onnx(mean, std, weights, bias, args.output)
+    print(f"Trained on {len(manifest)} image(s); wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Upload intake: size limits, content hashing and format sniffing in one streaming pass.
+
+Starlette spools multipart file parts to a SpooledTemporaryFile (in memory up to
+1 MiB, on disk beyond). receive_upload reads that file once in chunks, so the
+upload is never held in memory as a whole; the file object itself is handed on
+to PIL. BodySizeLimitMiddleware refuses oversized requests while they arrive,
+before Starlette spools them at all.
+"""
+import hashlib
+import io
+import json
+from typing import BinaryIO, Collection, NamedTuple, Optional
+
+from starlette.exceptions import HTTPException
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+ZIP_MIME_TYPE = "application/zip"
+# Formats normalize_image can decode
+IMAGE_MIME_TYPES = ("image/jpeg", "image/png", "image/webp", "image/gif", "image/bmp", "image/tiff")
+
+
+class UploadTooLargeError(ValueError):
+    """The upload is over the configured size limit."""
+
+
+class UnsupportedUploadError(ValueError):
+    """The upload's content is not one of the accepted formats, whatever its declared content type."""
+
+
+def sniff_mime_type(head: bytes) -> Optional[str]:
+    """MIME type from the file's leading magic bytes, or None if unrecognized."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head.startswith(b"BM"):
+        return "image/bmp"
+    if head.startswith((b"II*\x00", b"MM\x00*")):
+        return "image/tiff"
+    if head.startswith(b"PK\x03\x04"):
+        return ZIP_MIME_TYPE
+    return None
+
+
+class ReceivedUpload(NamedTuple):
+    file: BinaryIO  # Rewound to the start
+    size: int
+    sha256: str
+    mime_type: Optional[str]  # Sniffed from the content
+
+
+def receive_upload(
+    file: BinaryIO, max_bytes: int, accepted: Optional[Collection[str]] = IMAGE_MIME_TYPES
+) -> ReceivedUpload:
+    """Hash, measure and sniff an uploaded file in one pass. Blocking; run it in a worker thread.
+
+    accepted=None accepts any content; mime_type is then None when unrecognized.
+    """
+    file.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    mime_type = None
+    while chunk := file.read(UPLOAD_CHUNK_SIZE):
+        if not size:
+            # Rejected on the first chunk, before reading the rest
+            mime_type = sniff_mime_type(chunk)
+            if accepted is not None and mime_type not in accepted:
+                raise UnsupportedUploadError(
+                    f"Unsupported file content; expected one of {', '.join(accepted)}"
+                )
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the {max_bytes:,} byte limit")
+        digest.update(chunk)
+    if not size:
+        raise UnsupportedUploadError("Upload is empty")
+    file.seek(0)
+    return ReceivedUpload(file, size, digest.hexdigest(), mime_type)
+
+
+def received_from_bytes(contents: bytes, max_bytes: int, accepted: Collection[str] = IMAGE_MIME_TYPES) -> ReceivedUpload:
+    """The same checks for content already in memory (zip members, blobs read back for jobs)."""
+    return receive_upload(io.BytesIO(contents), max_bytes, accepted)
+
+
+class RequestTooLarge(HTTPException):
+    # An HTTPException so FastAPI's body parsing passes it through as a 413 rather than wrapping it in a 400
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=f"Request body exceeds the {max_bytes:,} byte limit")
+
+
+class BodySizeLimitMiddleware:
+    """Answers 413 once a request body passes max_bytes, by Content-Length up front or while streaming."""
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            return await self.reject(send)
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise RequestTooLarge(self.max_bytes)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            response_started = response_started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except RequestTooLarge:
+            if not response_started:
+                await self.reject(send)
+
+    async def reject(self, send):
+        body = json.dumps({"detail": RequestTooLarge(self.max_bytes).detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
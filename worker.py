@@ -0,0 +1,32 @@
+"""Run job workers in their own process, sharing the server's database and blob store.
+
+Start the API with JOB_WORKERS=0 to leave all job processing to these:
+
+    python worker.py [--workers 4]
+"""
+import argparse
+import asyncio
+
+import migrations
+import server
+
+
+async def main(workers: int):
+    try:
+        await server.job_pool.run_forever(workers)
+    finally:
+        await server.client.close()
+        server.image_executor.shutdown(wait=False)
+        await server.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    if server.DB_SCHEMA_SETUP:
+        migrations.setup_schema(server.engine)
+    try:
+        asyncio.run(main(args.workers))
+    except KeyboardInterrupt:
+        pass